@@ -1,26 +1,57 @@
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
 from app.core.config import settings
+from app.core.token_cache import token_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
 def decode_access_token(token: str) -> Dict[str, Any]:
-    """解码JWT访问令牌"""
+    """解码JWT访问令牌，已验证的令牌会被缓存直到过期"""
+    if settings.JWT_CACHE_ENABLED:
+        token_cache.bind_secret(settings.SECRET_KEY, settings.ALGORITHM)
+        payload = token_cache.get(token)
+        if payload is not None:
+            return payload
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="无效的认证凭证",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if settings.JWT_CACHE_ENABLED:
+        token_cache.put(token, payload)
+    return payload
+
+
+def user_scopes(user: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    取出JWT声明中的权限范围。
+    支持 scopes 列表和OAuth2风格的空格分隔 scope 字符串。
+
+    参数:
+        user: 解码后的JWT载荷，未认证时为None
+
+    返回:
+        权限范围列表
+    """
+    if user is None:
+        return []
+    scopes = user.get("scopes")
+    if scopes is None:
+        scopes = user.get("scope")
+    if isinstance(scopes, str):
+        return scopes.split()
+    if isinstance(scopes, (list, tuple)):
+        return list(scopes)
+    return []
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
@@ -0,0 +1,167 @@
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.logger import logger
+
+
+class Compressor:
+    """
+    增量压缩器。
+    compress() 返回到目前为止可以输出的压缩数据（已刷新，客户端可以立即解压），
+    finish() 结束压缩流并返回剩余数据。
+    """
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        # wbits=31 输出gzip格式（带头部和校验和）
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, quality: int):
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        import zstandard
+
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(self._flush_block)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def _optional_dependency(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+# 编码名称 -> (压缩器工厂, 所需的可选依赖)
+_CODECS: Dict[str, Tuple[Callable[[], Compressor], Optional[str]]] = {
+    "gzip": (lambda: GzipCompressor(settings.COMPRESSION_GZIP_LEVEL), None),
+    "br": (lambda: BrotliCompressor(settings.COMPRESSION_BROTLI_QUALITY), "brotli"),
+    "zstd": (lambda: ZstdCompressor(settings.COMPRESSION_ZSTD_LEVEL), "zstandard"),
+}
+
+
+def available_encodings(configured: List[str]) -> List[str]:
+    """
+    按配置顺序返回可用的编码，跳过未知编码和未安装依赖的编码。
+
+    参数:
+        configured: 配置的编码列表，顺序即服务端偏好
+
+    返回:
+        可用的编码列表
+    """
+    encodings = []
+    for encoding in configured:
+        codec = _CODECS.get(encoding)
+        if codec is None:
+            logger.warning("不支持的压缩编码: '%s'", encoding)
+            continue
+        dependency = codec[1]
+        if dependency is not None and not _optional_dependency(dependency):
+            logger.info("未安装 %s，不启用 %s 压缩。请安装 %s", dependency, encoding, dependency)
+            continue
+        encodings.append(encoding)
+    return encodings
+
+
+def create_compressor(encoding: str) -> Compressor:
+    """创建指定编码的压缩器"""
+    return _CODECS[encoding][0]()
+
+
+def negotiate(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择编码。
+    优先选择客户端 q 值最高的编码，q 值相同时按服务端偏好顺序选择。
+
+    参数:
+        accept_encoding: 请求的 Accept-Encoding 头
+        encodings: 服务端可用的编码，按偏好排序
+
+    返回:
+        选择的编码，没有可接受的编码时返回None
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+
+    wildcard = weights.get("*", 0.0)
+    best: Optional[str] = None
+    best_weight = 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, wildcard)
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(content_type: str, types: List[str]) -> bool:
+    """
+    判断内容类型是否值得压缩。
+
+    参数:
+        content_type: 响应的 Content-Type 头
+        types: 可压缩的类型，"text/" 这样以 "/" 结尾的按前缀匹配，
+            "+json" 这样以 "+" 开头的按结构化语法后缀匹配
+
+    返回:
+        是否压缩
+    """
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if not media_type:
+        return False
+    for pattern in types:
+        if pattern.endswith("/"):
+            if media_type.startswith(pattern):
+                return True
+        elif pattern.startswith("+"):
+            if media_type.endswith(pattern):
+                return True
+        elif media_type == pattern:
+            return True
+    return False
@@ -0,0 +1,277 @@
+import asyncio
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from app.core.config import Settings, settings
+from app.utils.logger import logger
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """请求没有拿到并发名额（队列已满、被更高优先级的请求挤出或排队超时）"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason  # 监控指标中的原因标签
+
+
+class LimitAlgorithm:
+    """根据请求结果调整并发上限的算法"""
+
+    name = ""
+
+    def update(self, limit: float, latency: float, in_flight: int, dropped: bool) -> float:
+        """
+        根据一个请求的结果计算新的并发上限。
+
+        参数:
+            limit: 当前上限
+            latency: 请求收到响应头的耗时（秒）
+            in_flight: 请求完成时正在转发的请求数（包括这个请求）
+            dropped: 请求是否超时或被后端以过载拒绝
+
+        返回:
+            新的上限（未限制在最小值和最大值之间）
+        """
+        raise NotImplementedError
+
+
+class AIMDLimit(LimitAlgorithm):
+    """
+    加性增、乘性减。
+    请求超时、被后端以过载拒绝或慢于 latency_threshold 时上限乘以 backoff_ratio；
+    否则在并发接近上限时每轮（约 limit 个请求）加一，并发远低于上限时不增长。
+    """
+
+    name = "aimd"
+
+    def __init__(self, backoff_ratio: float, latency_threshold: float):
+        self.backoff_ratio = backoff_ratio
+        self.latency_threshold = latency_threshold
+
+    def update(self, limit: float, latency: float, in_flight: int, dropped: bool) -> float:
+        if dropped or latency > self.latency_threshold:
+            return limit * self.backoff_ratio
+        if in_flight * 2 >= limit:
+            return limit + 1.0 / limit
+        return limit
+
+
+class _ExponentialAverage:
+    """指数移动平均，前 window 个样本使用算术平均作为预热"""
+
+    __slots__ = ("window", "value", "count")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.value = 0.0
+        self.count = 0
+
+    def add(self, sample: float) -> float:
+        if self.count < self.window:
+            self.count += 1
+            self.value += (sample - self.value) / self.count
+        else:
+            self.value += (sample - self.value) * 2.0 / (self.window + 1)
+        return self.value
+
+
+class GradientLimit(LimitAlgorithm):
+    """
+    梯度算法（Vegas 思路）：比较短期平均延迟与没有排队时的基线延迟。
+    基线取观测到的最小短期延迟；只有在并发远低于上限（后端没有排队）时，基线才缓慢跟随实际延迟上升，
+    持续过载期间排队造成的延迟不会被误当作新的基线。
+    短期延迟超过基线的 tolerance 倍说明请求开始在后端排队，按比例缩小上限（每次最多减半）；
+    延迟接近基线时在当前上限上加 sqrt(limit) 的余量继续探测。
+    新上限经过平滑，单个慢请求不会造成剧烈波动；并发远低于上限时不调整，避免在低负载时无限增长。
+    """
+
+    name = "gradient"
+
+    def __init__(self, tolerance: float, smoothing: float = 0.2, short_window: int = 10, baseline_rise: float = 0.01):
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_rise = baseline_rise
+        self._short = _ExponentialAverage(short_window)
+        self._baseline = math.inf
+
+    def update(self, limit: float, latency: float, in_flight: int, dropped: bool) -> float:
+        short = self._short.add(latency)
+        if short <= 0:
+            return limit
+        if short < self._baseline:
+            self._baseline = short
+        if dropped:
+            gradient = 0.5
+        elif in_flight * 2 < limit:
+            self._baseline += (short - self._baseline) * self.baseline_rise
+            return limit
+        else:
+            gradient = max(0.5, min(1.0, self.tolerance * self._baseline / short))
+        new_limit = limit * gradient + math.sqrt(limit)
+        return limit * (1 - self.smoothing) + new_limit * self.smoothing
+
+
+def create_limit_algorithm(name: str, config: Optional[Settings] = None) -> LimitAlgorithm:
+    """
+    按名称创建并发上限算法，config 默认为当前配置。
+
+    参数:
+        name: 算法名称，gradient 或 aimd
+
+    返回:
+        算法实例
+    """
+    if config is None:
+        config = settings
+    if name == GradientLimit.name:
+        return GradientLimit(config.CONCURRENCY_TOLERANCE)
+    if name == AIMDLimit.name:
+        return AIMDLimit(config.CONCURRENCY_BACKOFF_RATIO, config.CIRCUIT_BREAKER_SLOW_CALL_DURATION)
+    raise ValueError(f"不支持的并发限制算法: '{name}'，可选: {GradientLimit.name}, {AIMDLimit.name}")
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    单个后端服务的自适应并发限制。
+    同时转发到后端的请求数不超过当前上限，上限由算法根据观测到的延迟调整，
+    使后端保持在吞吐量接近峰值、延迟尚未恶化的并发水平。
+
+    超过上限的请求按优先级短暂排队：
+    - 名额释放时优先唤醒优先级高的请求，同一优先级先到先得
+    - 队列已满时，新请求的优先级高于队列中最低的优先级则挤出其中最后到达的一个，否则直接拒绝
+    - 优先级为负的请求不排队，没有名额时直接拒绝
+    - 排队超过 queue_timeout 秒的请求被拒绝
+    排队的请求数有上限，过载期间网关的内存占用不会随积压增长。
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        algorithm: LimitAlgorithm,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        queue_size: int,
+        queue_timeout: float,
+    ):
+        self.service_name = service_name
+        self.algorithm = algorithm
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        # 优先级 -> 等待名额的请求（先到的在左侧）
+        self._waiters: Dict[int, Deque[asyncio.Future]] = {}
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self, priority: int = 0) -> None:
+        """
+        获取一个并发名额，必要时排队等待。
+
+        参数:
+            priority: 请求优先级，越大越优先
+
+        异常:
+            ConcurrencyLimitExceeded: 没有拿到名额
+        """
+        if self.in_flight < self.current_limit and not self.queued:
+            self.in_flight += 1
+            return
+        if priority < 0 or self.queue_size <= 0:
+            raise ConcurrencyLimitExceeded("limit", "并发已达上限")
+        while self.queued >= self.queue_size:
+            lowest = min(level for level, waiters in self._waiters.items() if waiters)
+            if lowest >= priority:
+                raise ConcurrencyLimitExceeded("queue_full", "排队请求已满")
+            victim = self._waiters[lowest].pop()
+            self.queued -= 1
+            # 已被取消的请求只是还没来得及从队列中移除，跳过它再看队列是否仍然已满
+            if not victim.done():
+                victim.set_exception(ConcurrencyLimitExceeded("preempted", "被更高优先级的请求挤出队列"))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiters = self._waiters.get(priority)
+        if waiters is None:
+            waiters = self._waiters[priority] = deque()
+        waiters.append(future)
+        self.queued += 1
+        timer = loop.call_later(self.queue_timeout, self._expire, priority, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # 客户端断开时仍在排队
+                self._remove(priority, future)
+            elif future.exception() is None:
+                # 已经拿到名额但请求被取消，把名额让给下一个请求
+                self.release(None, False)
+            raise
+        finally:
+            timer.cancel()
+
+    def release(self, latency: Optional[float], dropped: bool) -> None:
+        """
+        归还名额并根据请求结果调整上限。
+
+        参数:
+            latency: 请求收到响应头的耗时（秒），None 表示请求结果不能反映后端负载（例如连接失败、客户端断开）
+            dropped: 请求是否超时或被后端以过载拒绝
+        """
+        if latency is not None:
+            limit = self.algorithm.update(self.limit, latency, self.in_flight, dropped)
+            self.limit = min(max(limit, float(self.min_limit)), float(self.max_limit))
+        self.in_flight -= 1
+        # 上限提高或名额释放后唤醒排队的请求，名额直接交给被唤醒的请求
+        while self.queued and self.in_flight < self.current_limit:
+            level = max(level for level, waiters in self._waiters.items() if waiters)
+            future = self._waiters[level].popleft()
+            self.queued -= 1
+            if future.done():
+                # 排队期间被取消、还没来得及从队列中移除的请求
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _remove(self, priority: int, future: asyncio.Future) -> None:
+        try:
+            self._waiters[priority].remove(future)
+        except (KeyError, ValueError):
+            return
+        self.queued -= 1
+
+    def _expire(self, priority: int, future: asyncio.Future) -> None:
+        if future.done():
+            return
+        self._remove(priority, future)
+        future.set_exception(ConcurrencyLimitExceeded("queue_timeout", "排队超时"))
+
+    def snapshot(self) -> List[int]:
+        """当前上限、进行中的请求数和排队的请求数"""
+        return [self.current_limit, self.in_flight, self.queued]
+
+
+def create_limiter(service_name: str) -> AdaptiveConcurrencyLimiter:
+    """按当前配置为服务创建并发限制"""
+    max_limit = settings.CONCURRENCY_MAX_LIMIT or settings.UPSTREAM_MAX_CONNECTIONS
+    limiter = AdaptiveConcurrencyLimiter(
+        service_name,
+        create_limit_algorithm(settings.CONCURRENCY_LIMIT_ALGORITHM),
+        initial_limit=settings.CONCURRENCY_INITIAL_LIMIT,
+        min_limit=settings.CONCURRENCY_MIN_LIMIT,
+        max_limit=max_limit,
+        queue_size=settings.CONCURRENCY_QUEUE_SIZE,
+        queue_timeout=settings.CONCURRENCY_QUEUE_TIMEOUT,
+    )
+    logger.debug(
+        "服务 '%s' 的并发限制: 算法=%s, 初始上限=%d, 范围=[%d, %d]",
+        service_name, limiter.algorithm.name, limiter.current_limit, limiter.min_limit, limiter.max_limit,
+    )
+    return limiter
@@ -1,36 +1,221 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
+import json
+import os
 import platform
 from pydantic_settings import BaseSettings
 
 
+def _default_backend_services() -> Dict[str, Union[str, List[str]]]:
+    """默认的后端服务配置"""
+    # 在Windows系统上使用IP地址而不是localhost
+    if platform.system() == "Windows":
+        return {
+            # backend 的各个副本组成实例池，由网关负载均衡
+            "backend": [
+                "http://127.0.0.1:8000",
+                "http://localhost:8000",
+                "http://[::1]:8000",  # IPv6 本地地址
+            ],
+            # 备用地址，如果主地址无法连接，可以尝试这些地址
+            "backend_alt1": "http://localhost:8000",
+            "backend_alt2": "http://[::1]:8000",  # IPv6 本地地址
+        }
+    return {
+        "backend": [
+            "http://localhost:8000",
+            "http://127.0.0.1:8000",
+        ],
+        "backend_alt1": "http://127.0.0.1:8000",
+    }
+
+
 class Settings(BaseSettings):
     """应用配置"""
     APP_NAME: str = "ExercisesRxAI API Gateway"
     DEBUG: bool = True  # 开启调试模式以获取更多日志信息
+
+    # 日志配置
+    LOG_LEVEL: Optional[str] = None  # 日志级别，未设置时 DEBUG 模式为 DEBUG，否则为 INFO
+    LOG_FORMAT: str = "text"  # 日志格式: "text" 或 "json"
+    LOG_ASYNC: bool = True  # 是否在后台线程中格式化和输出日志
+    LOG_QUEUE_SIZE: int = 10000  # 异步日志队列长度，队列满时丢弃日志而不是阻塞
+    LOG_SAMPLE_RATES: Dict[str, float] = {}  # 按日志器名称采样 DEBUG/INFO 日志，例如 {"api_gateway.proxy": 0.1}
+    LOG_REPEAT_BURST: int = 10  # 同一位置的 WARNING/ERROR 日志每个周期最多输出的条数，0 表示不限制
+    LOG_REPEAT_INTERVAL: float = 10.0  # 重复日志的统计周期（秒）
     
+    # 生产环境启动配置（python main.py 或 python -m app.server）
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 10001
+    SERVER_WORKERS: int = 0  # 工作进程数，0 表示等于CPU核数
+    SERVER_REUSE_PORT: bool = True  # 每个工作进程用 SO_REUSEPORT 单独监听，由内核均衡分配连接
+    SERVER_BACKLOG: int = 2048  # 监听队列长度（同时受内核 net.core.somaxconn 限制）
+    SERVER_KEEPALIVE_TIMEOUT: float = 75.0  # 客户端空闲长连接的保持时间（秒），应大于前置负载均衡器的空闲超时
+    SERVER_GRACEFUL_TIMEOUT: float = 30.0  # 停止时等待进行中的请求和流式响应完成的最长时间（秒）
+    SERVER_MAX_REQUESTS: int = 0  # 工作进程处理多少个请求后被替换，0 表示不限制
+    SERVER_MAX_REQUESTS_JITTER: int = 0  # 每个工作进程在 SERVER_MAX_REQUESTS 上增加的随机数，避免同时替换
+    SERVER_MAX_MEMORY_MB: int = 0  # 工作进程常驻内存超过该值（MB）时被替换，0 表示不限制
+    SERVER_LOOP: str = "auto"  # 事件循环: auto（已安装 uvloop 时使用）/ uvloop / asyncio
+    SERVER_HTTP: str = "auto"  # HTTP解析器: auto（已安装 httptools 时使用）/ httptools / h11
+    SERVER_ACCESS_LOG: bool = False  # 是否输出uvicorn访问日志
+
+    # 配置热加载（修改 .env 或 CONFIG_FILE 后自动生效，也可以向进程发送 SIGHUP 立即重新加载）
+    CONFIG_FILE: str = ""  # 额外的JSON或YAML配置文件（YAML需要安装 pyyaml），其中的配置项优先于环境变量和 .env
+    CONFIG_RELOAD_ENABLED: bool = True  # 是否监视配置文件的变化
+    CONFIG_RELOAD_INTERVAL: float = 2.0  # 检查配置文件修改时间的间隔（秒）
+    CONFIG_DRAIN_TIMEOUT: float = 30.0  # 被移除或替换的上游客户端等待进行中请求完成的最长时间（秒）
+
     # JWT配置
     SECRET_KEY: str = "chenhaiqing"  # 在生产环境中应当使用环境变量设置
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+
+    # 已验证JWT缓存配置
+    JWT_CACHE_ENABLED: bool = True  # 是否缓存已验证的令牌声明
+    JWT_CACHE_TTL: float = 300.0  # 缓存条目最长存活时间（秒），不会超过令牌的exp
+    JWT_CACHE_MAX_ENTRIES: int = 10000  # 最大缓存条目数
+    JWT_CACHE_MAX_BYTES: int = 16 * 1024 * 1024  # 缓存估算内存上限（字节）
     
-    # 后端服务配置 - 根据操作系统选择不同配置
-    @property
-    def BACKEND_SERVICES(self) -> Dict[str, str]:
-        # 在Windows系统上使用IP地址而不是localhost
-        if platform.system() == "Windows":
-            return {
-                "backend": "http://127.0.0.1:8000",
-                # 备用地址，如果主地址无法连接，可以尝试这些地址
-                "backend_alt1": "http://localhost:8000",
-                "backend_alt2": "http://[::1]:8000",  # IPv6 本地地址
-            }
-        else:
-            return {
-                "backend": "http://localhost:8000",
-                "backend_alt1": "http://127.0.0.1:8000",
-            }
+    # 后端服务配置 - 根据操作系统选择不同配置，只在启动时计算一次
+    # 每个服务可以是单个地址，也可以是多个副本地址组成的实例池
+    BACKEND_SERVICES: Dict[str, Union[str, List[str]]] = _default_backend_services()
     
-    # 白名单路径（不需要认证的路径）
+    # 负载均衡配置
+    LOAD_BALANCER_STRATEGY: str = "round_robin"  # 实例选择策略: round_robin / least_outstanding / power_of_two
+    # 被动异常检测：连续失败（连接错误、超时或5xx）达到阈值的实例会被暂时驱逐
+    OUTLIER_CONSECUTIVE_FAILURES: int = 5
+    OUTLIER_BASE_EJECTION_TIME: float = 30.0  # 首次驱逐时长（秒），每次再驱逐按次数递增
+    OUTLIER_MAX_EJECTION_TIME: float = 300.0  # 最长驱逐时长（秒）
+    OUTLIER_MAX_EJECTION_PERCENT: int = 50  # 同一服务最多同时驱逐的实例比例（%）
+
+    # 监控指标配置（/metrics，Prometheus文本格式）
+    METRICS_ENABLED: bool = True  # 是否记录请求指标
+    METRICS_DIR: str = ""  # 多工作进程时存放各进程指标快照的目录，为空表示单进程
+    METRICS_SNAPSHOT_INTERVAL: float = 5.0  # 多进程模式下写入快照的间隔（秒）
+
+    # 请求链路追踪（W3C Trace Context）
+    TRACING_ENABLED: bool = True  # 是否向后端传递 traceparent 并对采样的请求按阶段计时
+    TRACING_SAMPLE_RATE: float = 0.01  # 没有携带上游采样决定的请求的采样比例
+    TRACING_SERVER_TIMING: bool = False  # 是否在采样请求的响应中返回 Server-Timing 头（会向客户端暴露网关内部耗时）
+    TRACING_SLOW_THRESHOLD: float = 1.0  # 采样请求总耗时超过该值（秒）时输出各阶段耗时日志，0 表示不输出
+
+    # 管理接口（/admin/...）
+    ADMIN_SCOPE: str = "gateway:admin"  # 访问管理接口需要的JWT scope
+    PROFILER_INTERVAL: float = 0.005  # 统计采样分析器的采样间隔（秒）
+    PROFILER_MAX_SECONDS: float = 60.0  # 单次分析的最长时间（秒）
+
+    # 主动健康检查配置
+    HEALTH_CHECK_ENABLED: bool = True  # 是否在后台定期探测所有后端实例
+    HEALTH_CHECK_INTERVAL: float = 5.0  # 探测间隔（秒）
+    HEALTH_CHECK_JITTER: float = 1.0  # 每次间隔额外增加的随机抖动上限（秒）
+    HEALTH_CHECK_TIMEOUT: float = 3.0  # 单次探测超时（秒）
+    HEALTH_CHECK_PATH: str = "/health"  # 后端健康检查路径
+    HEALTH_CHECK_UNHEALTHY_THRESHOLD: int = 2  # 连续失败多少次标记为不健康
+    HEALTH_CHECK_HEALTHY_THRESHOLD: int = 1  # 连续成功多少次恢复为健康
+
+    # 上游连接池配置（每个后端服务一个长期存在的客户端）
+    UPSTREAM_MAX_CONNECTIONS: int = 100  # 每个后端服务的最大连接数
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20  # 每个后端服务保留的空闲长连接数
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0  # 空闲长连接的过期时间（秒）
+    UPSTREAM_HTTP2: bool = False  # 是否启用HTTP/2（需要安装 httpx[http2]）
+
+    # 上游超时配置（秒）
+    UPSTREAM_CONNECT_TIMEOUT: float = 10.0
+    UPSTREAM_READ_TIMEOUT: float = 30.0
+    UPSTREAM_WRITE_TIMEOUT: float = 30.0
+    UPSTREAM_POOL_TIMEOUT: float = 30.0
+    # 按服务覆盖超时配置，例如 {"backend": {"read": 60.0, "connect": 5.0}}
+    UPSTREAM_SERVICE_TIMEOUTS: Dict[str, Dict[str, float]] = {}
+
+    # 熔断配置（按后端服务统计，超过阈值后快速失败）
+    CIRCUIT_BREAKER_ENABLED: bool = True
+    CIRCUIT_BREAKER_WINDOW: float = 10.0  # 统计窗口（秒），同时用于重试预算
+    CIRCUIT_BREAKER_MIN_REQUESTS: int = 20  # 窗口内请求数达到该值才会触发熔断
+    CIRCUIT_BREAKER_ERROR_RATE: float = 0.5  # 触发熔断的错误率（连接错误、超时和5xx）
+    CIRCUIT_BREAKER_SLOW_CALL_DURATION: float = 5.0  # 收到响应头超过该时间视为慢调用（秒）
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = 0.8  # 触发熔断的慢调用比例
+    CIRCUIT_BREAKER_OPEN_DURATION: float = 10.0  # 熔断持续时间（秒），之后进入半开状态
+    CIRCUIT_BREAKER_HALF_OPEN_REQUESTS: int = 3  # 半开状态下的探测请求数
+
+    # 重试配置（只重试可以安全重放的请求）
+    RETRY_MAX_ATTEMPTS: int = 2  # 单个请求的最大重试次数
+    RETRY_STATUS_CODES: List[int] = [502, 503, 504]  # 幂等请求遇到这些状态码时重试
+    RETRY_BUDGET_RATIO: float = 0.2  # 重试量不超过正常请求量的比例
+    RETRY_BUDGET_MIN_PER_SECOND: float = 3.0  # 每秒保底允许的重试次数
+
+    # 对冲请求配置（幂等请求超过延迟分位数仍未响应时向另一个实例再发一次）
+    HEDGE_ENABLED: bool = False
+    HEDGE_QUANTILE: float = 0.95  # 对冲延迟取最近响应延迟的分位数
+    HEDGE_MIN_DELAY: float = 0.05  # 最小对冲延迟（秒）
+
+    # 自适应并发限制（按后端服务根据响应延迟调整同时转发的请求数，超出时短暂排队，队列满或排队超时返回503）
+    CONCURRENCY_LIMIT_ENABLED: bool = True
+    CONCURRENCY_LIMIT_ALGORITHM: str = "gradient"  # gradient（比较短期与长期延迟）或 aimd（加性增、乘性减）
+    CONCURRENCY_INITIAL_LIMIT: int = 20
+    CONCURRENCY_MIN_LIMIT: int = 4
+    CONCURRENCY_MAX_LIMIT: int = 0  # 0 表示与 UPSTREAM_MAX_CONNECTIONS 相同
+    CONCURRENCY_TOLERANCE: float = 1.5  # gradient：短期延迟超过长期延迟的该倍数时降低上限
+    CONCURRENCY_BACKOFF_RATIO: float = 0.9  # aimd：超时、后端返回429/503或慢调用时上限乘以该比例
+    CONCURRENCY_QUEUE_SIZE: int = 100  # 每个服务最多排队的请求数，0表示不排队
+    CONCURRENCY_QUEUE_TIMEOUT: float = 1.0  # 排队的最长时间（秒）
+
+    # 是否以流式方式转发请求体和响应体（关闭后整体缓冲再转发）
+    PROXY_STREAMING: bool = True
+    # 请求体大小上限（字节，0 表示不限制），路由可以用 "max_body_size" 单独设置；超过时返回413
+    MAX_REQUEST_BODY_SIZE: int = 100 * 1024 * 1024
+    # 需要缓冲请求体时（关闭流式转发），超过该大小的部分写入临时文件，转发时从文件读取
+    REQUEST_BODY_SPOOL_THRESHOLD: int = 1024 * 1024
+    REQUEST_BODY_SPOOL_DIR: str = ""  # 临时文件目录，为空时使用系统临时目录
+
+    # WebSocket代理配置（需要安装 websockets），/api/{service}/... 的WebSocket连接经认证和限流后转发到后端
+    WEBSOCKET_ENABLED: bool = True
+    WEBSOCKET_MAX_CONNECTIONS: int = 10000  # 每个工作进程同时转发的最大连接数，超过时拒绝新连接（503）；整个网关的上限为该值乘以工作进程数
+    WEBSOCKET_IDLE_TIMEOUT: float = 300.0  # 两个方向都没有消息超过该时间（秒）时关闭连接，0表示不限制
+    WEBSOCKET_MAX_MESSAGE_SIZE: int = 1024 * 1024  # 单条消息的最大字节数，客户端和后端两侧相同
+    WEBSOCKET_MAX_QUEUE: int = 4  # 每个方向最多缓冲的待转发消息数，满时停止读取发送方（背压）
+    WEBSOCKET_WRITE_LIMIT: int = 64 * 1024  # 发往后端的缓冲区高水位（字节），超过时暂停读取客户端
+    WEBSOCKET_PING_INTERVAL: float = 20.0  # 向客户端和后端发送ping检测断开连接的间隔（秒），0表示不发送
+    WEBSOCKET_COMPRESSION: bool = False  # 是否启用 permessage-deflate，每个连接的压缩上下文需要数百KB内存
+    WEBSOCKET_TOKEN_QUERY_PARAM: str = "access_token"  # 浏览器无法设置请求头，允许通过该查询参数传递JWT，为空时禁用
+
+    # 响应压缩配置（按 Accept-Encoding 协商，br 和 zstd 需要安装 brotli、zstandard）
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: List[str] = ["zstd", "br", "gzip"]  # 支持的编码，客户端q值相同时按此顺序优先
+    COMPRESSION_MIN_SIZE: int = 1024  # 一次性返回的响应体小于该值时不压缩（字节），流式响应总是压缩
+    COMPRESSION_THREAD_THRESHOLD: int = 64 * 1024  # 单块数据超过该大小时在线程池中压缩（字节）
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    # 可压缩的内容类型，以 "/" 结尾的按前缀匹配，以 "+" 开头的按后缀匹配
+    COMPRESSION_CONTENT_TYPES: List[str] = [
+        "text/",
+        "application/json",
+        "application/javascript",
+        "application/xml",
+        "application/x-ndjson",
+        "+json",
+        "+xml",
+    ]
+
+    # 响应缓存配置（遵循后端返回的 Cache-Control / ETag / Vary，只缓存GET请求）
+    RESPONSE_CACHE_ENABLED: bool = True  # 是否启用响应缓存
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 缓存总容量（字节）
+    RESPONSE_CACHE_MAX_ENTRY_BYTES: int = 1024 * 1024  # 单个响应的最大缓存大小（字节）
+
+    # POST请求去重缓存（路由设置 "dedup": true 时启用），保存在多个工作进程共享、重启后保留的mmap文件中
+    DEDUP_CACHE_ENABLED: bool = True  # 总开关，关闭后所有路由都不去重
+    DEDUP_CACHE_PATH: str = ""  # 缓存文件路径，为空时使用临时目录
+    DEDUP_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # 缓存数据区大小（字节），写满后覆盖最早的条目
+    DEDUP_CACHE_INDEX_SLOTS: int = 65536  # 索引槽位数（每个槽位36字节），决定最多保存的条目数
+    DEDUP_CACHE_MAX_ENTRY_BYTES: int = 4 * 1024 * 1024  # 单个响应的最大缓存大小（字节）
+    DEDUP_CACHE_MAX_BODY_BYTES: int = 1024 * 1024  # 请求体超过该大小时不去重，直接转发
+    DEDUP_CACHE_TTL: float = 3600.0  # 缓存条目和 Idempotency-Key 的保存时间（秒）
+
+    # 自定义路由规则，路径支持 "*"、"{name}" 单段通配和末尾的 "**" 前缀匹配，例如
+    # [{"path": "/api/ai/**", "service": "ai", "upstream_prefix": "/v1"},
+    #  {"path": "/api/*/public/**", "auth": false}]
+    ROUTES: List[Dict[str, Any]] = []
+
+    # 白名单路径（不需要认证的路径），支持与 ROUTES 相同的通配写法
     WHITELIST_PATHS: List[str] = [
         "/api/backend/v1/auth/login",
         "/api/backend_alt1/v1/auth/login",  # 添加备用服务的路径
@@ -39,6 +224,7 @@ class Settings(BaseSettings):
         "/redoc",
         "/openapi.json",
         "/health",  # 添加健康检查路径
+        "/metrics",  # 监控指标路径
         "/",  # 添加根路径
     ]
     
@@ -46,6 +232,25 @@ class Settings(BaseSettings):
     RATE_LIMIT_ENABLED: bool = True  # 是否启用流量控制
     RATE_LIMIT_WINDOW_SIZE: int = 60  # 时间窗口大小（秒）
     RATE_LIMIT_MAX_REQUESTS: int = 20  # 时间窗口内允许的最大请求数 (减小为20便于测试)
+    RATE_LIMIT_ALGORITHM: str = "sliding_window"  # 限流算法: sliding_window / token_bucket / gcra
+    RATE_LIMIT_KEY: str = "user"  # 默认的限流键: user（按JWT的 sub，未认证的请求按IP）/ ip
+    # 命名的限流策略，路由通过 "rate_limit" 引用；未写的字段沿用上面的默认值，例如
+    # {"ai": {"limit": 100000, "window": 60, "cost": 500, "usage_header": "x-usage-total-tokens",
+    #         "scopes": {"ai:premium": {"limit": 1000000}}}}
+    # scopes 按顺序匹配JWT的 scopes / scope 声明选择配额档位；cost 为每个请求预扣的配额，
+    # 设置 usage_header 时响应后按后端报告的实际用量结算差额
+    RATE_LIMIT_POLICIES: Dict[str, Dict[str, Any]] = {}
+    RATE_LIMIT_IDLE_TTL: float = 0.0  # 限流键空闲多久后淘汰（秒），不小于算法状态的有效期
+    RATE_LIMIT_EVICTION_INTERVAL: float = 10.0  # 后台淘汰空闲限流键的间隔（秒）
+    # 限流状态存储: memory（进程内）/ shared_memory（同一主机多进程共享）/ redis（多节点共享）
+    RATE_LIMIT_STORAGE: str = "memory"
+    RATE_LIMIT_SHM_PATH: str = ""  # 共享内存文件路径，为空时使用 /dev/shm 或临时目录
+    RATE_LIMIT_SHM_SLOTS: int = 262144  # 共享内存哈希表槽位数（每个槽位40字节）
+    RATE_LIMIT_REDIS_URL: str = "redis://localhost:6379/0"
+    RATE_LIMIT_REDIS_PREFIX: str = "gateway:ratelimit:"
+    RATE_LIMIT_REDIS_TIMEOUT: float = 1.0  # Redis命令的回复超时（秒），超时按 RATE_LIMIT_FAIL_OPEN 处理
+    RATE_LIMIT_LEASE_SIZE: int = 0  # 本地租约大小，大于0时每次从Redis预取一批配额在本地扣减
+    RATE_LIMIT_FAIL_OPEN: bool = True  # Redis不可用时是否放行请求
     # 不进行流量控制的路径
     RATE_LIMIT_EXCLUDE_PATHS: List[str] = [
         "/health",
@@ -58,4 +263,40 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
-settings = Settings() 
\ No newline at end of file
+def read_config_file(path: str) -> Dict[str, Any]:
+    """
+    读取 CONFIG_FILE，返回配置项字典。
+
+    参数:
+        path: JSON（.json）或YAML（.yaml / .yml）文件路径
+
+    返回:
+        配置项名称 -> 值
+    """
+    with open(path, encoding="utf-8") as file:
+        content = file.read()
+    if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"读取YAML配置文件需要安装 pyyaml: '{path}'")
+        data = yaml.safe_load(content) or {}
+    else:
+        data = json.loads(content) if content.strip() else {}
+    if not isinstance(data, dict):
+        raise ValueError(f"配置文件的顶层必须是对象: '{path}'")
+    return data
+
+
+def load_settings() -> Settings:
+    """
+    加载完整配置：默认值 < .env < 环境变量 < CONFIG_FILE。
+    配置无效时抛出异常（pydantic.ValidationError 或 ValueError）。
+    """
+    base = Settings()
+    if not base.CONFIG_FILE:
+        return base
+    return Settings(**read_config_file(base.CONFIG_FILE))
+
+
+settings = load_settings() 
\ No newline at end of file
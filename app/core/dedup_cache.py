@@ -0,0 +1,304 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.logger import logger
+
+# 参与去重键计算的请求头：同一请求体在不同的内容协商下可能得到不同的响应
+_KEY_HEADERS = ("accept", "accept-encoding")
+
+
+class StoredResponse(NamedTuple):
+    """去重缓存中保存的响应"""
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+    fingerprint: bytes  # 产生该响应的请求指纹，用于检查 Idempotency-Key 是否被用于不同的请求
+
+
+def canonical_body(body: bytes, content_type: str) -> bytes:
+    """
+    规范化请求体：JSON请求体按键排序、去掉多余空白后再参与哈希，
+    只有键顺序或格式不同的请求视为同一个请求；其他类型的请求体按原始字节比较。
+    """
+    if "json" not in content_type:
+        return body
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _digest(*parts: bytes) -> bytes:
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        # 每段带长度前缀，避免不同的分段方式拼出相同的输入
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.digest()
+
+
+class DedupCache:
+    """
+    POST请求去重缓存。
+    请求按 方法、服务、后端路径、用户身份、内容协商头和规范化后的请求体 计算指纹，
+    相同指纹的请求直接返回保存的响应，不再转发到后端；携带 Idempotency-Key 的请求按该键保存和重放。
+
+    数据保存在固定大小的mmap文件中，同一主机上的多个工作进程共享，进程重启后仍然有效：
+    - 索引区是开放寻址哈希表，每个槽位保存键摘要、记录位置、长度和过期时间
+    - 数据区是环形日志，新记录追加在写位置，写满后从头覆盖最早的记录；
+      写位置单调递增，记录仍在最近写入的 capacity 字节内即未被覆盖，无需后台清理
+    - 读写用fcntl文件锁在进程之间互斥（读为共享锁），每条记录带CRC校验
+    """
+
+    MAGIC = b"GWDEDUP1"
+    HEADER = struct.Struct("<8sQQQ")  # 魔数、索引槽位数、数据区大小、写位置
+    HEADER_SIZE = 64
+    WRITE_POSITION = struct.Struct("<Q")
+    WRITE_POSITION_OFFSET = 24
+    SLOT = struct.Struct("<16sQId")  # 键摘要、记录的逻辑位置、记录长度、过期时间
+    # 记录头：键摘要、请求指纹、过期时间、状态码、响应头长度、响应体长度、CRC32
+    RECORD = struct.Struct("<16s16sdHIII")
+    MAX_PROBE = 8
+
+    def __init__(self, path: str, max_bytes: int, slots: int, max_entry_bytes: int, max_body_bytes: int, ttl: float):
+        self.path = path
+        self.capacity = max_bytes
+        self.slots = slots
+        self.max_entry_bytes = max_entry_bytes
+        self.max_body_bytes = max_body_bytes
+        self.ttl = ttl
+        self._data_offset = self.HEADER_SIZE + slots * self.SLOT.size
+        self._fd: Optional[int] = None
+        self._mmap: Optional[mmap.mmap] = None
+        # fcntl锁只在进程之间互斥，同一进程内的线程用普通锁保护
+        self._thread_lock = threading.Lock()
+        # 正在转发的请求，相同的请求等待其结果
+        self._pending: Dict[bytes, asyncio.Future] = {}
+
+    def _open(self) -> None:
+        size = self._data_offset + self.capacity
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            stat = os.fstat(fd)
+            existing = os.pread(fd, self.HEADER.size, 0) if stat.st_size >= self.HEADER_SIZE else b""
+            if stat.st_size != size or existing[:24] != self.HEADER.pack(self.MAGIC, self.slots, self.capacity, 0)[:24]:
+                # 文件不存在或容量变化时重新初始化；容量不变时保留已有条目
+                logger.info("初始化去重缓存文件: %s, 数据区=%d字节, 索引槽位数=%d", self.path, self.capacity, self.slots)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, self.slots, self.capacity, 0), 0)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mmap = mmap.mmap(fd, size)
+
+    def close(self) -> None:
+        """关闭缓存文件"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def fingerprint(
+        self,
+        method: str,
+        service_name: str,
+        target: str,
+        identity: Optional[str],
+        headers: Dict[str, str],
+        body: bytes,
+    ) -> bytes:
+        """
+        计算请求指纹。
+
+        参数:
+            method: 请求方法
+            service_name: 目标服务
+            target: 后端路径（含查询字符串）
+            identity: 用户身份标识，不同用户的请求互不复用
+            headers: 请求头（名称小写）
+            body: 请求体
+
+        返回:
+            16字节的指纹
+        """
+        return _digest(
+            method.encode("latin-1"),
+            service_name.encode("utf-8"),
+            target.encode("latin-1"),
+            (identity or "").encode("utf-8"),
+            *(headers.get(name, "").encode("latin-1") for name in _KEY_HEADERS),
+            canonical_body(body, headers.get("content-type", "")),
+        )
+
+    @staticmethod
+    def idempotency_key(service_name: str, identity: Optional[str], key: str) -> bytes:
+        """Idempotency-Key 对应的缓存键，按用户隔离"""
+        return _digest(b"idempotency-key", service_name.encode("utf-8"), (identity or "").encode("utf-8"), key.encode("latin-1"))
+
+    def _slot_range(self, key: bytes) -> Tuple[int, int]:
+        first = int.from_bytes(key[:8], "little") % self.slots
+        probe = min(self.MAX_PROBE, self.slots - first)
+        return self.HEADER_SIZE + first * self.SLOT.size, probe
+
+    def get(self, key: bytes, now: Optional[float] = None) -> Optional[StoredResponse]:
+        """
+        读取保存的响应。
+
+        参数:
+            key: 请求指纹或 Idempotency-Key 的缓存键
+
+        返回:
+            保存的响应，没有、已过期或已被覆盖时返回None
+        """
+        if self._mmap is None:
+            self._open()
+        if now is None:
+            now = time.time()
+        buffer = self._mmap
+        offset, probe = self._slot_range(key)
+        record = None
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH)
+            try:
+                write_position, = self.WRITE_POSITION.unpack_from(buffer, self.WRITE_POSITION_OFFSET)
+                for index in range(probe):
+                    digest, position, length, expires = self.SLOT.unpack_from(buffer, offset + index * self.SLOT.size)
+                    if digest != key:
+                        continue
+                    if expires > now and position + self.capacity >= write_position:
+                        start = self._data_offset + position % self.capacity
+                        record = buffer[start:start + length]
+                    break
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        if record is None:
+            return None
+        return self._decode(key, record)
+
+    def _decode(self, key: bytes, record: bytes) -> Optional[StoredResponse]:
+        digest, fingerprint, _, status, headers_length, body_length, checksum = self.RECORD.unpack_from(record)
+        payload = record[self.RECORD.size:]
+        if digest != key or len(payload) != headers_length + body_length or zlib.crc32(payload) != checksum:
+            logger.warning("去重缓存记录校验失败，忽略该记录")
+            return None
+        headers = []
+        if headers_length:
+            for line in payload[:headers_length].split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                headers.append((name, value))
+        return StoredResponse(status, headers, payload[headers_length:], fingerprint)
+
+    def put(
+        self,
+        key: bytes,
+        fingerprint: bytes,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        body: bytes,
+        now: Optional[float] = None,
+    ) -> bool:
+        """
+        保存响应，超过单条上限的响应不保存。
+
+        返回:
+            是否已保存
+        """
+        if self._mmap is None:
+            self._open()
+        if len(body) > self.max_entry_bytes:
+            return False
+        if now is None:
+            now = time.time()
+        headers_blob = b"\r\n".join(name + b":" + value for name, value in headers)
+        payload = headers_blob + body
+        expires = now + self.ttl
+        record = self.RECORD.pack(
+            key, fingerprint, expires, status, len(headers_blob), len(body), zlib.crc32(payload)
+        ) + payload
+        length = len(record)
+        if length > self.capacity:
+            return False
+
+        buffer = self._mmap
+        offset, probe = self._slot_range(key)
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                position, = self.WRITE_POSITION.unpack_from(buffer, self.WRITE_POSITION_OFFSET)
+                ring_offset = position % self.capacity
+                if ring_offset + length > self.capacity:
+                    # 记录不跨越数据区末尾，剩余空间跳过
+                    position += self.capacity - ring_offset
+                    ring_offset = 0
+                start = self._data_offset + ring_offset
+                buffer[start:start + length] = record
+                self.WRITE_POSITION.pack_into(buffer, self.WRITE_POSITION_OFFSET, position + length)
+
+                # 选择索引槽位：同一个键 > 空槽位或已失效的槽位 > 最早写入的槽位
+                target = None
+                oldest = None
+                oldest_position = None
+                floor = position + length - self.capacity
+                for index in range(probe):
+                    slot_offset = offset + index * self.SLOT.size
+                    digest, slot_position, _, slot_expires = self.SLOT.unpack_from(buffer, slot_offset)
+                    if digest == key:
+                        target = slot_offset
+                        break
+                    if target is None and (
+                        digest == bytes(16) or slot_expires <= now or slot_position < floor
+                    ):
+                        target = slot_offset
+                    elif oldest_position is None or slot_position < oldest_position:
+                        oldest, oldest_position = slot_offset, slot_position
+                if target is None:
+                    target = oldest
+                self.SLOT.pack_into(buffer, target, key, position, length, expires)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return True
+
+    def pending(self, key: bytes) -> Optional[asyncio.Future]:
+        """获取本进程内正在转发的相同请求，没有时返回None"""
+        return self._pending.get(key)
+
+    def begin(self, key: bytes) -> None:
+        """标记一个请求开始转发到后端"""
+        self._pending[key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, key: bytes) -> None:
+        """标记请求完成，唤醒等待同一结果的请求"""
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+def _default_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "api_gateway_dedup.cache")
+
+
+# 创建全局去重缓存实例（首次使用时打开缓存文件）
+dedup_cache = DedupCache(
+    path=settings.DEDUP_CACHE_PATH or _default_path(),
+    max_bytes=settings.DEDUP_CACHE_MAX_BYTES,
+    slots=settings.DEDUP_CACHE_INDEX_SLOTS,
+    max_entry_bytes=settings.DEDUP_CACHE_MAX_ENTRY_BYTES,
+    max_body_bytes=settings.DEDUP_CACHE_MAX_BODY_BYTES,
+    ttl=settings.DEDUP_CACHE_TTL,
+)
@@ -0,0 +1,152 @@
+import asyncio
+import random
+import time
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.load_balancer import Endpoint, upstream_pools
+from app.core.upstream import upstream_clients
+from app.utils.logger import logger
+
+
+class EndpointHealth:
+    """单个实例最近一次主动健康检查的结果"""
+
+    __slots__ = ("status", "checked_at", "consecutive_successes", "consecutive_failures")
+
+    def __init__(self):
+        self.status = "pending"  # 尚未完成第一次检查
+        self.checked_at = 0.0
+        self.consecutive_successes = 0
+        self.consecutive_failures = 0
+
+
+class HealthChecker:
+    """
+    后台主动健康检查。
+    按配置的间隔（带随机抖动）并发探测所有服务实例，结果缓存在内存中：
+    /health 直接读取缓存立即返回，负载均衡选择实例时也会跳过不健康的实例。
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        jitter: float,
+        timeout: float,
+        path: str,
+        unhealthy_threshold: int,
+        healthy_threshold: int,
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.path = path
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        # (服务名称, 实例地址) -> 检查结果
+        self._results: Dict[tuple, EndpointHealth] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, service_name: str, endpoint: Endpoint) -> None:
+        result = self._results.setdefault((service_name, endpoint.url), EndpointHealth())
+        try:
+            client = upstream_clients.get(service_name)
+            response = await client.get(f"{endpoint.url}{self.path}", timeout=self.timeout)
+            error = None if response.status_code == 200 else f"status code: {response.status_code}"
+        except Exception as e:
+            error = f"error: {str(e)}"
+
+        result.checked_at = time.time()
+        if error is None:
+            result.consecutive_failures = 0
+            result.consecutive_successes += 1
+            if result.consecutive_successes >= self.healthy_threshold or result.status == "pending":
+                if not endpoint.healthy:
+                    logger.info("实例恢复健康: %s %s", service_name, endpoint.url)
+                endpoint.healthy = True
+                result.status = "healthy"
+        else:
+            result.consecutive_successes = 0
+            result.consecutive_failures += 1
+            if result.consecutive_failures >= self.unhealthy_threshold or result.status == "pending":
+                if endpoint.healthy:
+                    logger.warning("实例健康检查失败: %s %s %s", service_name, endpoint.url, error)
+                endpoint.healthy = False
+                result.status = f"unhealthy - {error}"
+
+    async def check_all(self) -> None:
+        """并发探测所有服务实例"""
+        await asyncio.gather(*(
+            self._probe(service_name, endpoint)
+            for service_name, pool in upstream_pools.items()
+            for endpoint in pool.endpoints
+        ))
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error("健康检查出错: %s", e)
+            # 随机抖动避免多个网关节点同时探测后端
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+
+    def start(self) -> None:
+        """启动后台健康检查任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止后台健康检查任务"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def prune(self) -> None:
+        """删除已不在配置中的实例的检查结果（配置热加载后调用）"""
+        current = {
+            (service_name, endpoint.url)
+            for service_name, pool in upstream_pools.items()
+            for endpoint in pool.endpoints
+        }
+        for key in list(self._results):
+            if key not in current:
+                del self._results[key]
+
+    def snapshot(self) -> Dict[str, str]:
+        """
+        返回每个服务的缓存健康状态。
+        服务的所有实例都健康时为 "healthy"，否则列出不健康的实例。
+        """
+        backends: Dict[str, str] = {}
+        for service_name, pool in upstream_pools.items():
+            errors = []
+            pending = False
+            for endpoint in pool.endpoints:
+                result = self._results.get((service_name, endpoint.url))
+                if result is None or result.status == "pending":
+                    pending = True
+                elif result.status != "healthy":
+                    errors.append(f"{endpoint.url} {result.status[len('unhealthy - '):]}")
+            if errors:
+                backends[service_name] = f"unhealthy - {'; '.join(errors)}"
+            elif pending:
+                backends[service_name] = "pending"
+            else:
+                backends[service_name] = "healthy"
+        return backends
+
+
+# 创建全局健康检查器实例
+health_checker = HealthChecker(
+    interval=settings.HEALTH_CHECK_INTERVAL,
+    jitter=settings.HEALTH_CHECK_JITTER,
+    timeout=settings.HEALTH_CHECK_TIMEOUT,
+    path=settings.HEALTH_CHECK_PATH,
+    unhealthy_threshold=settings.HEALTH_CHECK_UNHEALTHY_THRESHOLD,
+    healthy_threshold=settings.HEALTH_CHECK_HEALTHY_THRESHOLD,
+)
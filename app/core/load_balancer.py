@@ -0,0 +1,207 @@
+import itertools
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from app.core.config import Settings, settings
+from app.utils.logger import logger
+
+
+class Endpoint:
+    """
+    后端服务的单个实例。
+    记录进行中的请求数、主动健康检查结果和被动健康状态（连续失败次数、驱逐截止时间）。
+    """
+
+    __slots__ = ("url", "outstanding", "healthy", "consecutive_failures", "ejected_until", "ejection_count")
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True  # 由后台主动健康检查更新
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejection_count = 0
+
+    def is_available(self, now: float) -> bool:
+        """实例当前是否可以接收请求"""
+        return self.healthy and self.ejected_until <= now
+
+
+class UpstreamPool:
+    """
+    一个后端服务的实例池。
+    按配置的策略（轮询、最少进行中请求、二选一）选择实例，
+    连接错误或5xx响应连续出现时将实例暂时驱逐（被动异常检测）。
+    """
+
+    STRATEGIES = ("round_robin", "least_outstanding", "power_of_two")
+
+    def __init__(
+        self,
+        service_name: str,
+        urls: Iterable[str],
+        strategy: str = "round_robin",
+        failure_threshold: int = 5,
+        base_ejection_time: float = 30.0,
+        max_ejection_time: float = 300.0,
+        max_ejection_percent: int = 50,
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"不支持的负载均衡策略: '{strategy}'，可选: {', '.join(self.STRATEGIES)}")
+        self.service_name = service_name
+        self.endpoints: List[Endpoint] = [Endpoint(url) for url in urls]
+        if not self.endpoints:
+            raise ValueError(f"服务 '{service_name}' 没有配置任何实例")
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_ejection_percent = max_ejection_percent
+        self._counter = itertools.count()
+
+    def _candidates(self, now: float, exclude: Optional[Endpoint]) -> List[Endpoint]:
+        candidates = [
+            endpoint for endpoint in self.endpoints
+            if endpoint is not exclude and endpoint.is_available(now)
+        ]
+        if not candidates:
+            # 所有实例都被驱逐或不健康时进入恐慌模式，忽略健康状态，避免服务完全不可用
+            candidates = [endpoint for endpoint in self.endpoints if endpoint is not exclude] or self.endpoints
+        return candidates
+
+    def pick(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """
+        选择一个实例。
+
+        参数:
+            exclude: 需要排除的实例（例如重试时排除上一次失败的实例）
+
+        返回:
+            选中的实例
+        """
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        candidates = self._candidates(time.time(), exclude)
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "least_outstanding":
+            # 进行中请求数相同时按轮询顺序选择，避免总是压在第一个实例上
+            offset = next(self._counter)
+            count = len(candidates)
+            return min(
+                (candidates[(offset + index) % count] for index in range(count)),
+                key=lambda endpoint: endpoint.outstanding,
+            )
+        if self.strategy == "power_of_two":
+            first, second = random.sample(candidates, 2)
+            return first if first.outstanding <= second.outstanding else second
+        return candidates[next(self._counter) % len(candidates)]
+
+    def acquire(self, endpoint: Endpoint) -> None:
+        """记录实例开始处理一个请求"""
+        endpoint.outstanding += 1
+
+    def release(self, endpoint: Endpoint, success: bool) -> None:
+        """
+        记录实例完成一个请求，并更新被动健康状态。
+
+        参数:
+            endpoint: 处理请求的实例
+            success: 请求是否成功（连接错误、超时或5xx视为失败）
+        """
+        endpoint.outstanding -= 1
+        if success:
+            endpoint.consecutive_failures = 0
+            return
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            self._eject(endpoint)
+
+    def _eject(self, endpoint: Endpoint) -> None:
+        now = time.time()
+        if endpoint.ejected_until > now:
+            return
+        ejected = sum(1 for other in self.endpoints if other.ejected_until > now)
+        if (ejected + 1) * 100 > self.max_ejection_percent * len(self.endpoints):
+            # 超过最大驱逐比例时保留实例，避免把剩余流量全部压到少数实例上
+            return
+        endpoint.ejection_count += 1
+        duration = min(self.base_ejection_time * endpoint.ejection_count, self.max_ejection_time)
+        endpoint.ejected_until = now + duration
+        endpoint.consecutive_failures = 0
+        logger.warning("实例被暂时驱逐: %s %s, %.0f秒", self.service_name, endpoint.url, duration)
+
+
+class UpstreamPoolRegistry:
+    """所有后端服务实例池的注册表"""
+
+    def __init__(self):
+        self._pools: Dict[str, UpstreamPool] = {}
+
+    @staticmethod
+    def _normalize(urls: Union[str, List[str]]) -> List[str]:
+        return [urls] if isinstance(urls, str) else list(urls)
+
+    def prepare(
+        self,
+        services: Dict[str, Union[str, List[str]]],
+        config: Optional[Settings] = None,
+    ) -> Dict[str, UpstreamPool]:
+        """
+        根据服务配置创建实例池，不修改当前注册表。
+        已有服务中地址不变的实例沿用原来的实例对象，保留进行中请求数、健康状态和驱逐状态。
+
+        参数:
+            services: 服务名称 -> 实例地址
+            config: 负载均衡和异常检测配置，默认为当前配置
+
+        返回:
+            服务名称 -> 实例池
+        """
+        if config is None:
+            config = settings
+        pools = {}
+        for service_name, urls in services.items():
+            pool = UpstreamPool(
+                service_name,
+                self._normalize(urls),
+                strategy=config.LOAD_BALANCER_STRATEGY,
+                failure_threshold=config.OUTLIER_CONSECUTIVE_FAILURES,
+                base_ejection_time=config.OUTLIER_BASE_EJECTION_TIME,
+                max_ejection_time=config.OUTLIER_MAX_EJECTION_TIME,
+                max_ejection_percent=config.OUTLIER_MAX_EJECTION_PERCENT,
+            )
+            current = self._pools.get(service_name)
+            if current is not None:
+                existing = {endpoint.url: endpoint for endpoint in current.endpoints}
+                pool.endpoints = [existing.get(endpoint.url, endpoint) for endpoint in pool.endpoints]
+            pools[service_name] = pool
+        return pools
+
+    def build(self, services: Dict[str, Union[str, List[str]]]) -> None:
+        """根据服务配置创建实例池"""
+        self._pools = self.prepare(services)
+
+    def replace(self, pools: Dict[str, UpstreamPool]) -> List[UpstreamPool]:
+        """
+        替换所有实例池（配置热加载）。
+
+        返回:
+            被移除服务的实例池
+        """
+        removed = [pool for service_name, pool in self._pools.items() if service_name not in pools]
+        self._pools = pools
+        return removed
+
+    def get(self, service_name: str) -> Optional[UpstreamPool]:
+        """获取服务的实例池，未配置时返回None"""
+        return self._pools.get(service_name)
+
+    def items(self):
+        return self._pools.items()
+
+
+# 创建全局实例池注册表
+upstream_pools = UpstreamPoolRegistry()
+upstream_pools.build(settings.BACKEND_SERVICES)
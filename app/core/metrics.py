@@ -0,0 +1,342 @@
+import asyncio
+import json
+import os
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.resilience import resilience
+from app.core.upstream import upstream_clients
+from app.utils.logger import logger
+
+# 延迟直方图的桶上界（秒），所有直方图共用
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 响应状态码类别
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+# 本地处理的请求和未配置服务的请求使用的服务标签，避免任意路径产生无限多的标签值
+LOCAL_SERVICE = "gateway"
+UNKNOWN_SERVICE = "unknown"
+
+
+class Histogram:
+    """桶预先分配的延迟直方图，记录时不分配内存"""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        # 最后一个桶对应 +Inf
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+    def dump(self) -> List[float]:
+        return [*self.counts, self.sum]
+
+
+class ServiceMetrics:
+    """单个服务的请求指标"""
+
+    __slots__ = ("responses", "in_flight", "duration", "upstream", "overhead")
+
+    def __init__(self):
+        self.responses = [0] * len(STATUS_CLASSES)  # 按状态码类别的请求数
+        self.in_flight = 0  # 正在处理的请求数
+        self.duration = Histogram()  # 请求在网关中的总耗时
+        self.upstream = Histogram()  # 后端返回响应头的耗时
+        self.overhead = Histogram()  # 返回响应头之前网关自身的耗时
+
+    def observe(self, status_code: int, duration: float, upstream: float, overhead: float) -> None:
+        """
+        记录一个已完成的请求。
+
+        参数:
+            status_code: 响应状态码
+            duration: 总耗时（秒）
+            upstream: 后端响应头耗时（秒），未转发到后端时为0
+            overhead: 网关自身耗时（秒）
+        """
+        index = status_code // 100 - 1
+        self.responses[index if 0 <= index < len(STATUS_CLASSES) else 4] += 1
+        self.duration.observe(duration)
+        if upstream:
+            self.upstream.observe(upstream)
+        self.overhead.observe(overhead if overhead > 0 else 0.0)
+
+
+class GatewayMetrics:
+    """
+    网关监控指标，以Prometheus文本格式输出。
+    请求路径上只做整数累加和直方图计数，字符串格式化只在抓取时进行。
+
+    多个工作进程时配置 METRICS_DIR：每个进程定期把自己的指标快照写入该目录，
+    抓取时合并所有进程的快照；已退出进程的计数器保留，正在处理的请求数和连接数只统计存活进程。
+    """
+
+    def __init__(self, directory: str, snapshot_interval: float):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self._services: Dict[str, ServiceMetrics] = {}
+        self.rate_limited: Dict[str, int] = {}  # 限流策略 -> 被拒绝的请求数
+        self.quota_usage: Dict[str, float] = {}  # 限流策略 -> 后端报告的累计用量
+        self.auth_failures: Dict[str, int] = {"missing": 0, "invalid": 0, "error": 0}
+        self.websockets: Dict[str, int] = {}  # 服务 -> 正在转发的WebSocket连接数
+        self.load_shed: Dict[str, Dict[str, int]] = {}  # 服务 -> 原因 -> 因过载被拒绝的请求数
+        self.stages: Dict[str, Histogram] = {}  # 请求阶段 -> 被采样请求在该阶段的耗时
+        self._task: Optional[asyncio.Task] = None
+
+    def service(self, service_name: str) -> ServiceMetrics:
+        """获取服务的指标对象，首次使用时创建"""
+        metrics = self._services.get(service_name)
+        if metrics is None:
+            metrics = self._services[service_name] = ServiceMetrics()
+        return metrics
+
+    def record_rate_limited(self, policy: str) -> None:
+        """记录一次被限流拒绝的请求"""
+        self.rate_limited[policy] = self.rate_limited.get(policy, 0) + 1
+
+    def record_quota_usage(self, policy: str, usage: float) -> None:
+        """记录一次后端报告的用量（例如AI接口消耗的token数）"""
+        self.quota_usage[policy] = self.quota_usage.get(policy, 0.0) + usage
+
+    def record_stages(self, stages: Dict[str, float]) -> None:
+        """记录一个被采样请求各阶段的耗时"""
+        for stage, duration in stages.items():
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(duration)
+
+    def record_load_shed(self, service_name: str, reason: str) -> None:
+        """记录一次因后端并发达到上限被拒绝的请求"""
+        counts = self.load_shed.get(service_name)
+        if counts is None:
+            counts = self.load_shed[service_name] = {}
+        counts[reason] = counts.get(reason, 0) + 1
+
+    def record_auth_failure(self, reason: str) -> None:
+        """记录一次JWT认证失败，reason 为 missing、invalid 或 error"""
+        self.auth_failures[reason] = self.auth_failures.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前进程的指标快照"""
+        return {
+            "pid": os.getpid(),
+            "services": {
+                name: {
+                    "responses": metrics.responses,
+                    "in_flight": metrics.in_flight,
+                    "duration": metrics.duration.dump(),
+                    "upstream": metrics.upstream.dump(),
+                    "overhead": metrics.overhead.dump(),
+                }
+                for name, metrics in self._services.items()
+            },
+            "rate_limited": self.rate_limited,
+            "quota_usage": self.quota_usage,
+            "auth_failures": self.auth_failures,
+            "connections": upstream_clients.pool_usage(),
+            "websockets": self.websockets,
+            "load_shed": self.load_shed,
+            "stages": {stage: histogram.dump() for stage, histogram in self.stages.items()},
+            "concurrency": {name: policy.limiter.snapshot() for name, policy in resilience.items()},
+        }
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def write_snapshot(self) -> None:
+        """把当前进程的快照原子地写入 METRICS_DIR"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temp_path, path)
+
+    def _collect(self) -> List[Tuple[Dict[str, Any], bool]]:
+        """收集所有进程的快照及进程是否存活"""
+        if not self.directory:
+            return [(self.snapshot(), True)]
+        self.write_snapshot()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("worker-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("读取指标快照失败: %s %s", name, e)
+                continue
+            snapshots.append((snapshot, _process_alive(snapshot.get("pid", 0))))
+        return snapshots
+
+    def render(self) -> str:
+        """合并所有进程的指标并输出Prometheus文本格式"""
+        services: Dict[str, Dict[str, Any]] = {}
+        rate_limited: Dict[str, int] = {}
+        quota_usage: Dict[str, float] = {}
+        auth_failures: Dict[str, int] = {}
+        connections: Dict[str, List[int]] = {}
+        websockets: Dict[str, int] = {}
+        load_shed: Dict[Tuple[str, str], int] = {}
+        concurrency: Dict[str, List[int]] = {}
+        stages: Dict[str, List[float]] = {}
+        for snapshot, alive in self._collect():
+            for name, data in snapshot["services"].items():
+                merged = services.get(name)
+                if merged is None:
+                    merged = services[name] = {
+                        "responses": [0] * len(STATUS_CLASSES),
+                        "in_flight": 0,
+                        "duration": [0.0] * (len(LATENCY_BUCKETS) + 2),
+                        "upstream": [0.0] * (len(LATENCY_BUCKETS) + 2),
+                        "overhead": [0.0] * (len(LATENCY_BUCKETS) + 2),
+                    }
+                for key in ("responses", "duration", "upstream", "overhead"):
+                    merged[key] = [a + b for a, b in zip(merged[key], data[key])]
+                if alive:
+                    merged["in_flight"] += data["in_flight"]
+            for policy, count in snapshot["rate_limited"].items():
+                rate_limited[policy] = rate_limited.get(policy, 0) + count
+            for policy, usage in snapshot.get("quota_usage", {}).items():
+                quota_usage[policy] = quota_usage.get(policy, 0.0) + usage
+            for reason, count in snapshot["auth_failures"].items():
+                auth_failures[reason] = auth_failures.get(reason, 0) + count
+            if alive:
+                for name, (active, idle) in snapshot["connections"].items():
+                    usage = connections.setdefault(name, [0, 0])
+                    usage[0] += active
+                    usage[1] += idle
+                for name, count in snapshot.get("websockets", {}).items():
+                    websockets[name] = websockets.get(name, 0) + count
+                for name, (limit, _, queued) in snapshot.get("concurrency", {}).items():
+                    usage = concurrency.setdefault(name, [0, 0])
+                    usage[0] += limit
+                    usage[1] += queued
+            for name, counts in snapshot.get("load_shed", {}).items():
+                for reason, count in counts.items():
+                    load_shed[(name, reason)] = load_shed.get((name, reason), 0) + count
+            for stage, data in snapshot.get("stages", {}).items():
+                merged_stage = stages.get(stage)
+                stages[stage] = data if merged_stage is None else [a + b for a, b in zip(merged_stage, data)]
+
+        lines: List[str] = []
+        _header(lines, "gateway_requests_total", "counter", "按服务和状态码类别统计的请求数")
+        for name, data in sorted(services.items()):
+            for status_class, count in zip(STATUS_CLASSES, data["responses"]):
+                if count:
+                    lines.append(f'gateway_requests_total{{service="{name}",status="{status_class}"}} {count}')
+        _header(lines, "gateway_in_flight_requests", "gauge", "正在处理的请求数")
+        for name, data in sorted(services.items()):
+            lines.append(f'gateway_in_flight_requests{{service="{name}"}} {data["in_flight"]}')
+        for key, metric, help_text in (
+            ("duration", "gateway_request_duration_seconds", "请求在网关中的总耗时"),
+            ("upstream", "gateway_upstream_duration_seconds", "后端返回响应头的耗时"),
+            ("overhead", "gateway_overhead_duration_seconds", "返回响应头之前网关自身的耗时（不含后端耗时）"),
+        ):
+            _header(lines, metric, "histogram", help_text)
+            for name, data in sorted(services.items()):
+                if any(data[key][:-1]):
+                    _histogram(lines, metric, f'service="{name}"', data[key])
+        _header(lines, "gateway_stage_duration_seconds", "histogram", "被采样请求在各处理阶段的耗时")
+        for stage, data in sorted(stages.items()):
+            _histogram(lines, "gateway_stage_duration_seconds", f'stage="{stage}"', data)
+        _header(lines, "gateway_rate_limited_total", "counter", "按限流策略统计的被拒绝请求数")
+        for policy, count in sorted(rate_limited.items()):
+            lines.append(f'gateway_rate_limited_total{{policy="{policy}"}} {count}')
+        _header(lines, "gateway_quota_usage_total", "counter", "按限流策略统计的后端报告用量")
+        for policy, usage in sorted(quota_usage.items()):
+            lines.append(f'gateway_quota_usage_total{{policy="{policy}"}} {usage:g}')
+        _header(lines, "gateway_auth_failures_total", "counter", "JWT认证失败次数")
+        for reason, count in sorted(auth_failures.items()):
+            lines.append(f'gateway_auth_failures_total{{reason="{reason}"}} {count}')
+        _header(lines, "gateway_upstream_connections", "gauge", "上游连接池中的连接数")
+        for name, (active, idle) in sorted(connections.items()):
+            lines.append(f'gateway_upstream_connections{{service="{name}",state="active"}} {active}')
+            lines.append(f'gateway_upstream_connections{{service="{name}",state="idle"}} {idle}')
+        _header(lines, "gateway_concurrency_limit", "gauge", "按服务的自适应并发上限（所有工作进程之和）")
+        for name, (limit, _) in sorted(concurrency.items()):
+            lines.append(f'gateway_concurrency_limit{{service="{name}"}} {limit}')
+        _header(lines, "gateway_concurrency_queued", "gauge", "等待并发名额的请求数")
+        for name, (_, queued) in sorted(concurrency.items()):
+            lines.append(f'gateway_concurrency_queued{{service="{name}"}} {queued}')
+        _header(lines, "gateway_load_shed_total", "counter", "后端并发达到上限时被拒绝的请求数")
+        for (name, reason), count in sorted(load_shed.items()):
+            lines.append(f'gateway_load_shed_total{{service="{name}",reason="{reason}"}} {count}')
+        _header(lines, "gateway_websocket_connections", "gauge", "正在转发的WebSocket连接数")
+        for name, count in sorted(websockets.items()):
+            lines.append(f'gateway_websocket_connections{{service="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                logger.warning("写入指标快照失败: %s", e)
+
+    def start(self) -> None:
+        """多进程模式下启动定期写入快照的后台任务"""
+        if self.directory and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止后台任务并写入最后一次快照"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            logger.warning("写入指标快照失败: %s", e)
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, ValueError):
+        # 没有权限发送信号说明进程存在
+        return True
+    return True
+
+
+def _header(lines: List[str], name: str, metric_type: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def _histogram(lines: List[str], name: str, labels: str, data: List[float]) -> None:
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, data):
+        cumulative += int(count)
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    cumulative += int(data[len(LATENCY_BUCKETS)])
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {data[-1]}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+# 创建全局监控指标实例
+metrics = GatewayMetrics(
+    directory=settings.METRICS_DIR,
+    snapshot_interval=settings.METRICS_SNAPSHOT_INTERVAL,
+)
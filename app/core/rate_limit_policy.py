@@ -0,0 +1,167 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.auth import user_scopes
+from app.core.config import Settings, settings
+from app.core.rate_limiter import RateLimitAlgorithm, create_algorithm
+from app.core.router import DEFAULT_RATE_LIMIT_POLICY
+
+# 限流键的来源：user 按JWT的 sub（未认证的请求按IP），ip 按客户端IP
+POLICY_KEYS = ("user", "ip")
+
+_POLICY_FIELDS = {"key", "limit", "window", "cost", "usage_header", "scopes"}
+_TIER_FIELDS = {"limit", "window"}
+
+
+class RateLimitTier:
+    """限流策略中的一档配额"""
+
+    __slots__ = ("name", "algorithm", "prefix")
+
+    def __init__(self, policy_name: str, name: str, algorithm: RateLimitAlgorithm):
+        self.name = name
+        self.algorithm = algorithm
+        # 限流键前缀：不同策略、不同档位的计数互不影响
+        self.prefix = f"{policy_name}:{name}:"
+
+
+class RateLimitPolicy:
+    """
+    限流策略：路由通过策略名称引用。
+    按JWT的 scopes 选择配额档位，每个请求预先扣减 cost；
+    设置了 usage_header 时，响应后按后端在该响应头中报告的实际用量（例如AI接口的token数）结算差额。
+    """
+
+    __slots__ = ("name", "key", "cost", "usage_header", "tier", "scope_tiers")
+
+    def __init__(
+        self,
+        name: str,
+        key: str,
+        cost: float,
+        usage_header: str,
+        tier: RateLimitTier,
+        scope_tiers: List[Tuple[str, RateLimitTier]],
+    ):
+        self.name = name
+        self.key = key
+        self.cost = cost
+        self.usage_header = usage_header.lower().encode("latin-1")
+        self.tier = tier  # 没有匹配任何 scope 时的默认档位
+        self.scope_tiers = scope_tiers  # 按配置顺序匹配，第一个匹配的 scope 生效
+
+    def select(self, user: Optional[Dict[str, Any]]) -> RateLimitTier:
+        """
+        根据用户的JWT声明选择配额档位。
+
+        参数:
+            user: 解码后的JWT载荷，未认证时为None
+
+        返回:
+            配额档位
+        """
+        if user is None or not self.scope_tiers:
+            return self.tier
+        scopes = user_scopes(user)
+        if not scopes:
+            return self.tier
+        for scope, tier in self.scope_tiers:
+            if scope in scopes:
+                return tier
+        return self.tier
+
+
+class RateLimitPolicies:
+    """预编译的限流策略表，查找只是一次字典访问"""
+
+    def __init__(self, policies: Dict[str, RateLimitPolicy]):
+        self._policies = policies
+
+    def get(self, name: str) -> RateLimitPolicy:
+        """按名称获取限流策略，未定义的名称使用默认策略"""
+        policy = self._policies.get(name)
+        if policy is None:
+            policy = self._policies[DEFAULT_RATE_LIMIT_POLICY]
+        return policy
+
+    def tiers(self) -> Iterable[RateLimitTier]:
+        for policy in self._policies.values():
+            yield policy.tier
+            for _, tier in policy.scope_tiers:
+                yield tier
+
+    @property
+    def idle_after(self) -> float:
+        """所有档位中状态有效期最长的一个，限流键的空闲淘汰时间不能小于它"""
+        return max(tier.algorithm.idle_after for tier in self.tiers())
+
+    def replace(self, other: "RateLimitPolicies") -> None:
+        """用另一个已编译的策略表替换当前策略表（配置热加载）"""
+        self._policies = other._policies
+
+
+def _positive(policy_name: str, field: str, value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"限流策略 '{policy_name}' 的 {field} 必须是正数: {value!r}")
+    return value
+
+
+def _build_policy(name: str, data: Dict[str, Any], config: Settings) -> RateLimitPolicy:
+    unknown = set(data) - _POLICY_FIELDS
+    if unknown:
+        raise ValueError(f"限流策略 '{name}' 包含未知字段: {', '.join(sorted(unknown))}")
+    key = data.get("key", config.RATE_LIMIT_KEY)
+    if key not in POLICY_KEYS:
+        raise ValueError(f"限流策略 '{name}' 的 key 无效: '{key}'，可选: {', '.join(POLICY_KEYS)}")
+    limit = int(_positive(name, "limit", data.get("limit", config.RATE_LIMIT_MAX_REQUESTS)))
+    window = _positive(name, "window", data.get("window", config.RATE_LIMIT_WINDOW_SIZE))
+    cost = data.get("cost", 1)
+    if isinstance(cost, bool) or not isinstance(cost, (int, float)) or cost < 0:
+        raise ValueError(f"限流策略 '{name}' 的 cost 必须是非负数: {cost!r}")
+    usage_header = data.get("usage_header", "")
+    if not isinstance(usage_header, str):
+        raise ValueError(f"限流策略 '{name}' 的 usage_header 必须是字符串")
+
+    algorithm_name = config.RATE_LIMIT_ALGORITHM
+    tier = RateLimitTier(name, "", create_algorithm(algorithm_name, limit, window))
+    scope_tiers: List[Tuple[str, RateLimitTier]] = []
+    scopes = data.get("scopes", {})
+    if not isinstance(scopes, dict):
+        raise ValueError(f"限流策略 '{name}' 的 scopes 必须是 scope -> 配额 的对象")
+    for scope, tier_data in scopes.items():
+        if not isinstance(tier_data, dict) or set(tier_data) - _TIER_FIELDS:
+            raise ValueError(f"限流策略 '{name}' 中 scope '{scope}' 的配额只能包含 limit 和 window")
+        tier_limit = int(_positive(name, f"scopes.{scope}.limit", tier_data.get("limit", limit)))
+        tier_window = _positive(name, f"scopes.{scope}.window", tier_data.get("window", window))
+        scope_tiers.append((scope, RateLimitTier(name, scope, create_algorithm(algorithm_name, tier_limit, tier_window))))
+    return RateLimitPolicy(name, key, cost, usage_header, tier, scope_tiers)
+
+
+def build_policies(config: Settings) -> RateLimitPolicies:
+    """
+    根据配置编译限流策略表。
+    默认策略由 RATE_LIMIT_* 配置项定义，RATE_LIMIT_POLICIES 中同名的条目可以覆盖其中的字段。
+
+    参数:
+        config: 配置
+
+    返回:
+        限流策略表
+
+    异常:
+        ValueError: 策略定义无效，或路由引用了未定义的策略
+    """
+    definitions = dict(config.RATE_LIMIT_POLICIES)
+    definitions.setdefault(DEFAULT_RATE_LIMIT_POLICY, {})
+    policies = {
+        name: _build_policy(name, data or {}, config)
+        for name, data in definitions.items()
+    }
+    for route in config.ROUTES:
+        policy_name = route.get("rate_limit")
+        if policy_name and policy_name not in policies:
+            raise ValueError(f"路由 '{route.get('path')}' 引用了未定义的限流策略: '{policy_name}'")
+    return RateLimitPolicies(policies)
+
+
+# 创建全局限流策略表实例
+rate_limit_policies = build_policies(settings)
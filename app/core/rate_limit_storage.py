@@ -0,0 +1,515 @@
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.rate_limit_policy import rate_limit_policies
+from app.core.rate_limiter import RateLimitAlgorithm, RateLimiter, RateLimitResult, create_algorithm
+from app.utils.logger import logger
+from app.utils.redis_client import RedisClient, RedisError
+
+
+class RateLimitStorage:
+    """
+    限流状态存储后端接口。
+    不同后端决定限流状态保存在哪里：单进程内存、同一主机的共享内存或网络KV服务。
+    """
+
+    name = ""
+
+    def __init__(self, algorithm: RateLimitAlgorithm):
+        self.algorithm = algorithm
+
+    async def hit(self, key: str, cost: float = 1, algorithm: Optional[RateLimitAlgorithm] = None) -> RateLimitResult:
+        """
+        对限流键执行一次检查并消耗配额。
+
+        参数:
+            key: 限流键
+            cost: 本次请求消耗的配额
+            algorithm: 该键使用的限流算法（与存储的算法类型相同，只是阈值和窗口不同），默认为存储的算法
+
+        返回:
+            限流检查结果
+        """
+        raise NotImplementedError
+
+    async def charge(self, key: str, amount: float, algorithm: Optional[RateLimitAlgorithm] = None) -> None:
+        """
+        不做检查直接扣减限流键的配额（amount 为负数时退还），用于请求完成后按实际用量结算。
+
+        参数:
+            key: 限流键
+            amount: 补扣的配额
+            algorithm: 该键使用的限流算法，默认为存储的算法
+        """
+        raise NotImplementedError
+
+    def reconfigure(self, algorithm: RateLimitAlgorithm, idle_ttl: float) -> bool:
+        """
+        应用新的限流算法参数（配置热加载）。
+
+        返回:
+            是否已生效；False 表示该存储后端需要重启才能应用
+        """
+        return (
+            algorithm.name == self.algorithm.name
+            and algorithm.limit == self.algorithm.limit
+            and algorithm.window == self.algorithm.window
+        )
+
+    async def start(self) -> None:
+        """启动后端需要的连接或后台任务"""
+
+    async def stop(self) -> None:
+        """释放后端占用的资源"""
+
+
+class MemoryStorage(RateLimitStorage):
+    """进程内存储，每个工作进程各自计数"""
+
+    name = "memory"
+
+    def __init__(self, algorithm: RateLimitAlgorithm, idle_ttl: float, eviction_interval: float):
+        super().__init__(algorithm)
+        self.limiter = RateLimiter(algorithm, idle_ttl=idle_ttl)
+        self.eviction_interval = eviction_interval
+
+    async def hit(self, key: str, cost: float = 1, algorithm: Optional[RateLimitAlgorithm] = None) -> RateLimitResult:
+        return self.limiter.hit(key, cost, algorithm=algorithm)
+
+    async def charge(self, key: str, amount: float, algorithm: Optional[RateLimitAlgorithm] = None) -> None:
+        self.limiter.charge(key, amount, algorithm=algorithm)
+
+    def reconfigure(self, algorithm: RateLimitAlgorithm, idle_ttl: float) -> bool:
+        self.algorithm = algorithm
+        self.limiter.reconfigure(algorithm, idle_ttl)
+        return True
+
+    async def start(self) -> None:
+        self.limiter.start(self.eviction_interval)
+
+    async def stop(self) -> None:
+        await self.limiter.stop()
+
+
+class SharedMemoryStorage(RateLimitStorage):
+    """
+    基于mmap文件的跨进程共享存储，供同一主机上的多个工作进程共享限流状态。
+    文件是固定大小的开放寻址哈希表，每个槽位保存键的64位摘要和算法状态，
+    内存占用与客户端数量无关。探测窗口用fcntl字节范围锁保护，
+    空闲或最久未访问的槽位会被直接复用，无需后台淘汰。
+    """
+
+    name = "shared_memory"
+
+    MAGIC = b"GWRLSHM2"
+    # 魔数、槽位布局摘要（算法及其状态字段）、槽位数；
+    # 阈值和窗口不影响槽位布局，不写入文件头，修改后各进程通过 reconfigure 直接生效
+    HEADER = struct.Struct("<8s16sQ")
+    HEADER_SIZE = 64
+    # 槽位：键摘要 + 最多4个状态字段（touched 及算法状态）
+    SLOT = struct.Struct("<Q4d")
+    MAX_PROBE = 8
+
+    def __init__(self, algorithm: RateLimitAlgorithm, path: str, slots: int, idle_ttl: float):
+        super().__init__(algorithm)
+        self.path = path
+        self.slots = slots
+        self.idle_ttl = max(idle_ttl, algorithm.idle_after)
+        self.fields = algorithm.state_class.__slots__
+        if len(self.fields) > 4:
+            raise ValueError(f"算法 '{algorithm.name}' 的状态字段过多，无法放入共享内存槽位")
+        self._fd: Optional[int] = None
+        self._mmap: Optional[mmap.mmap] = None
+        # fcntl锁只在进程之间互斥，同一进程内的线程用普通锁保护
+        self._thread_lock = threading.Lock()
+
+    def _open(self) -> None:
+        size = self.HEADER_SIZE + self.slots * self.SLOT.size
+        layout = f"{self.algorithm.name}:{','.join(self.fields)}"
+        layout_digest = hashlib.blake2b(layout.encode("utf-8"), digest_size=16).digest()
+        header = self.HEADER.pack(self.MAGIC, layout_digest, self.slots)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            stat = os.fstat(fd)
+            existing = os.pread(fd, self.HEADER.size, 0) if stat.st_size >= self.HEADER_SIZE else b""
+            if stat.st_size != size or existing != header:
+                # 文件不存在、槽位数或槽位布局变化时重新初始化
+                logger.info("初始化共享限流存储: %s, 槽位数=%d", self.path, self.slots)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mmap = mmap.mmap(fd, size)
+
+    async def start(self) -> None:
+        if self._mmap is None:
+            self._open()
+
+    async def stop(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # 摘要0表示空槽位，因此强制最低位为1
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+    def reconfigure(self, algorithm: RateLimitAlgorithm, idle_ttl: float) -> bool:
+        # 槽位布局只取决于算法类型，阈值和窗口变化可以直接生效
+        if algorithm.state_class is not self.algorithm.state_class:
+            return False
+        self.algorithm = algorithm
+        self.idle_ttl = max(idle_ttl, algorithm.idle_after)
+        return True
+
+    async def hit(self, key: str, cost: float = 1, algorithm: Optional[RateLimitAlgorithm] = None) -> RateLimitResult:
+        return self.hit_sync(key, cost, algorithm=algorithm)
+
+    async def charge(self, key: str, amount: float, algorithm: Optional[RateLimitAlgorithm] = None) -> None:
+        self._update(key, algorithm or self.algorithm, time.time(), amount, True)
+
+    def hit_sync(
+        self,
+        key: str,
+        cost: float = 1,
+        now: Optional[float] = None,
+        algorithm: Optional[RateLimitAlgorithm] = None,
+    ) -> RateLimitResult:
+        """同步执行一次限流检查（临界区内没有await）"""
+        if now is None:
+            now = time.time()
+        return self._update(key, algorithm or self.algorithm, now, cost, False)
+
+    def _update(
+        self,
+        key: str,
+        algorithm: RateLimitAlgorithm,
+        now: float,
+        cost: float,
+        charge: bool,
+    ) -> Optional[RateLimitResult]:
+        """在字节范围锁内读取、更新并写回限流键的槽位"""
+        if self._mmap is None:
+            self._open()
+        digest = self._hash(key)
+        slot_size = self.SLOT.size
+        first = digest % self.slots
+        probe = min(self.MAX_PROBE, self.slots - first)
+        offset = self.HEADER_SIZE + first * slot_size
+        buffer = self._mmap
+
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, probe * slot_size, offset, os.SEEK_SET)
+            try:
+                target = None
+                target_values = None
+                free = None
+                oldest = None
+                oldest_touched = float("inf")
+                deadline = now - self.idle_ttl
+                for index in range(probe):
+                    slot_offset = offset + index * slot_size
+                    slot_digest, *values = self.SLOT.unpack_from(buffer, slot_offset)
+                    if slot_digest == digest:
+                        target, target_values = slot_offset, values
+                        break
+                    if slot_digest == 0 or values[0] <= deadline:
+                        # 空槽位或空闲槽位可以直接复用
+                        if free is None:
+                            free = slot_offset
+                    elif values[0] < oldest_touched:
+                        oldest, oldest_touched = slot_offset, values[0]
+
+                if target is None:
+                    # 探测窗口已满时复用最久未访问的槽位
+                    target = free if free is not None else oldest
+                    state = algorithm.new_state(now)
+                else:
+                    state = algorithm.state_class.__new__(algorithm.state_class)
+                    for name, value in zip(self.fields, target_values):
+                        setattr(state, name, value)
+
+                state.touched = now
+                if charge:
+                    algorithm.charge(state, now, cost)
+                    result = None
+                else:
+                    result = algorithm.consume(state, now, cost)
+                values = [getattr(state, name) for name in self.fields]
+                values.extend([0.0] * (4 - len(values)))
+                self.SLOT.pack_into(buffer, target, digest, *values)
+                return result
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, probe * slot_size, offset, os.SEEK_SET)
+
+
+class _Lease:
+    """从网络后端预取的本地配额"""
+    __slots__ = ("window", "window_start", "tokens", "remaining", "blocked_until")
+
+    def __init__(self, window: float, window_start: float, tokens: float, remaining: float, blocked_until: float = 0.0):
+        self.window = window
+        self.window_start = window_start
+        self.tokens = tokens
+        self.remaining = remaining
+        # 远端已拒绝时，在此时间之前直接在本地拒绝
+        self.blocked_until = blocked_until
+
+
+class RedisStorage(RateLimitStorage):
+    """
+    基于Redis协议的网络存储，供多个网关节点共享限流状态。
+    只使用 INCRBYFLOAT/PEXPIRE/GET 等基础命令实现滑动窗口计数器（计数为浮点数，支持小数的请求权重），
+    因此可以对接Redis或任何兼容RESP协议的替身服务。
+    同一轮事件循环内的检查会合并成一次流水线写入。
+    每次检查的阈值和窗口取自调用方传入的算法，不同限流策略共用同一个存储。
+
+    开启本地租约模式（lease_size > 0）时，节点一次从远端预取一批配额，
+    在当前窗口内本地扣减，大部分请求不需要访问网络。
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        algorithm: RateLimitAlgorithm,
+        url: str,
+        prefix: str,
+        lease_size: int,
+        fail_open: bool,
+        eviction_interval: float,
+        timeout: float,
+    ):
+        if algorithm.name != "sliding_window":
+            logger.warning("Redis存储只支持滑动窗口计数器，忽略配置的算法 '%s'", algorithm.name)
+            algorithm = create_algorithm("sliding_window", algorithm.limit, algorithm.window)
+        super().__init__(algorithm)
+        self.url = url
+        self.prefix = prefix
+        self.lease_size = lease_size
+        self.fail_open = fail_open
+        self.eviction_interval = eviction_interval
+        self.timeout = timeout
+        self.limit = algorithm.limit
+        self.window = algorithm.window
+        self._client: Optional[RedisClient] = None
+        self._leases: Dict[str, _Lease] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = RedisClient(self.url, command_timeout=self.timeout)
+        if self.lease_size > 0 and self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        task, self._sweep_task = self._sweep_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        client, self._client = self._client, None
+        if client is not None:
+            await client.close()
+
+    def reconfigure(self, algorithm: RateLimitAlgorithm, idle_ttl: float) -> bool:
+        if algorithm.name != "sliding_window":
+            logger.warning("Redis存储只支持滑动窗口计数器，忽略配置的算法 '%s'", algorithm.name)
+            algorithm = create_algorithm("sliding_window", algorithm.limit, algorithm.window)
+        if algorithm.window != self.window:
+            # 窗口长度变化后原有租约所属的窗口不再对应，丢弃本地租约
+            self._leases.clear()
+        self.algorithm = algorithm
+        self.limit = algorithm.limit
+        self.window = algorithm.window
+        return True
+
+    def _window_keys(self, key: str, window_start: float, window: float) -> Tuple[str, str]:
+        index = int(window_start // window)
+        return f"{self.prefix}{key}:{index}", f"{self.prefix}{key}:{index - 1}"
+
+    async def _incr(self, key: str, window_start: float, window: float, amount: float) -> Tuple[float, float]:
+        """
+        在当前窗口计数上增加 amount，并返回增加前的滑动窗口估算值。
+        """
+        current_key, previous_key = self._window_keys(key, window_start, window)
+        if self._client is None:
+            await self.start()
+        replies = await self._client.pipeline([
+            ("INCRBYFLOAT", current_key, float(amount)),
+            ("PEXPIRE", current_key, int(window * 2 * 1000)),
+            ("GET", previous_key),
+        ])
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        current, _, previous = replies
+        previous = float(previous) if previous is not None else 0.0
+        return previous, float(current) - amount
+
+    def _release(self, key: str, window_start: float, window: float, amount: float) -> None:
+        """归还多占用的配额（不等待回复）"""
+        current_key, _ = self._window_keys(key, window_start, window)
+        asyncio.ensure_future(self._release_remote(current_key, amount))
+
+    async def _release_remote(self, current_key: str, amount: float) -> None:
+        try:
+            reply, = await self._client.pipeline([("INCRBYFLOAT", current_key, -float(amount))])
+            if isinstance(reply, RedisError):
+                raise reply
+        except (ConnectionError, OSError, asyncio.TimeoutError, RedisError, AttributeError) as e:
+            logger.warning("归还Redis限流配额失败: %s", e)
+
+    async def hit(self, key: str, cost: float = 1, algorithm: Optional[RateLimitAlgorithm] = None) -> RateLimitResult:
+        limit, window = (algorithm.limit, algorithm.window) if algorithm is not None else (self.limit, self.window)
+        if self.lease_size <= 0:
+            return await self._hit_remote(key, cost, limit, window)
+
+        while True:
+            now = time.time()
+            window_start = now - (now % window)
+            reset_after = window - (now - window_start)
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_start == window_start:
+                if lease.tokens >= cost:
+                    lease.tokens -= cost
+                    lease.remaining = max(0.0, lease.remaining - cost)
+                    return RateLimitResult(True, int(lease.remaining), reset_after, 0.0)
+                if lease.blocked_until > now:
+                    return RateLimitResult(False, 0, reset_after, lease.blocked_until - now)
+            # 同一个键同时只有一个请求去远端续租，其余请求等待后使用新租约
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            return await self._hit_remote(key, cost, limit, window)
+        finally:
+            del self._pending[key]
+            future.set_result(None)
+
+    async def charge(self, key: str, amount: float, algorithm: Optional[RateLimitAlgorithm] = None) -> None:
+        window = algorithm.window if algorithm is not None else self.window
+        now = time.time()
+        window_start = now - (now % window)
+        lease = self._leases.get(key)
+        if lease is not None and lease.window_start == window_start:
+            # 先从本地租约中扣减（租约已经计入远端计数），不足的部分再记到远端
+            lease.tokens -= amount
+            lease.remaining = max(0.0, lease.remaining - amount)
+            if lease.tokens >= 0:
+                return
+            amount, lease.tokens = -lease.tokens, 0.0
+        if not amount:
+            return
+        try:
+            await self._incr(key, window_start, window, amount)
+        except (ConnectionError, OSError, asyncio.TimeoutError, RedisError) as e:
+            logger.warning("Redis限流存储补扣配额失败: %s", e)
+
+    async def _hit_remote(self, key: str, cost: float, limit: int, window: float) -> RateLimitResult:
+        now = time.time()
+        window_start = now - (now % window)
+        reset_after = window - (now - window_start)
+
+        request_amount = max(cost, self.lease_size)
+        try:
+            previous, current_before = await self._incr(key, window_start, window, request_amount)
+        except (ConnectionError, OSError, asyncio.TimeoutError, RedisError) as e:
+            logger.error("访问Redis限流存储失败: %s", e)
+            if self.fail_open:
+                return RateLimitResult(True, 0, reset_after, 0.0)
+            return RateLimitResult(False, 0, reset_after, 1.0)
+
+        estimated = previous * (reset_after / window) + current_before
+        available = max(0.0, limit - estimated)
+        if available < cost:
+            # 配额不足：归还本次预占的计数
+            self._release(key, window_start, window, request_amount)
+            retry_after = reset_after
+            if previous > 0:
+                retry_after = min(retry_after, (estimated + cost - limit) / previous * window)
+            if self.lease_size > 0:
+                self._leases[key] = _Lease(window, window_start, 0.0, 0, now + retry_after)
+            return RateLimitResult(False, 0, reset_after, retry_after)
+
+        granted = min(request_amount, available)
+        if granted < request_amount:
+            self._release(key, window_start, window, request_amount - granted)
+        remaining = max(0.0, available - cost)
+        if self.lease_size > 0:
+            self._leases[key] = _Lease(window, window_start, granted - cost, remaining)
+        return RateLimitResult(True, int(remaining), reset_after, 0.0)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.eviction_interval)
+            now = time.time()
+            # 过期窗口的租约已无法使用，直接丢弃
+            stale = [key for key, lease in self._leases.items() if lease.window_start + lease.window <= now]
+            for key in stale:
+                del self._leases[key]
+
+
+def _default_shm_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "api_gateway_rate_limit.shm")
+
+
+def create_storage() -> RateLimitStorage:
+    """根据配置创建限流存储后端"""
+    algorithm = create_algorithm(
+        settings.RATE_LIMIT_ALGORITHM,
+        settings.RATE_LIMIT_MAX_REQUESTS,
+        settings.RATE_LIMIT_WINDOW_SIZE,
+    )
+    # 空闲淘汰时间要覆盖所有限流策略中最长的窗口
+    idle_ttl = max(settings.RATE_LIMIT_IDLE_TTL, rate_limit_policies.idle_after)
+    storage_name = settings.RATE_LIMIT_STORAGE
+    if storage_name == MemoryStorage.name:
+        return MemoryStorage(algorithm, idle_ttl, settings.RATE_LIMIT_EVICTION_INTERVAL)
+    if storage_name == SharedMemoryStorage.name:
+        return SharedMemoryStorage(
+            algorithm,
+            settings.RATE_LIMIT_SHM_PATH or _default_shm_path(),
+            settings.RATE_LIMIT_SHM_SLOTS,
+            idle_ttl,
+        )
+    if storage_name == RedisStorage.name:
+        return RedisStorage(
+            algorithm,
+            settings.RATE_LIMIT_REDIS_URL,
+            settings.RATE_LIMIT_REDIS_PREFIX,
+            settings.RATE_LIMIT_LEASE_SIZE,
+            settings.RATE_LIMIT_FAIL_OPEN,
+            settings.RATE_LIMIT_EVICTION_INTERVAL,
+            settings.RATE_LIMIT_REDIS_TIMEOUT,
+        )
+    raise ValueError(f"不支持的限流存储后端: '{storage_name}'，可选: memory, shared_memory, redis")
+
+
+# 创建全局限流存储实例
+rate_limit_storage = create_storage()
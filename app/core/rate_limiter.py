@@ -0,0 +1,372 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Type
+
+from app.utils.logger import logger
+
+
+class RateLimitResult(NamedTuple):
+    """单次限流检查的结果"""
+    allowed: bool  # 是否放行
+    remaining: int  # 剩余可用请求数
+    reset_after: float  # 距离配额完全恢复的秒数
+    retry_after: float  # 被限流时建议的重试等待秒数
+
+
+class SlidingWindowState:
+    """滑动窗口计数器状态：当前窗口与上一窗口的计数"""
+    __slots__ = ("touched", "window_start", "current", "previous")
+
+    def __init__(self, now: float):
+        self.touched = now
+        self.window_start = 0.0
+        self.current = 0.0
+        self.previous = 0.0
+
+
+class TokenBucketState:
+    """令牌桶状态：剩余令牌数与上次补充时间"""
+    __slots__ = ("touched", "tokens", "updated")
+
+    def __init__(self, now: float):
+        self.touched = now
+        self.tokens = 0.0
+        self.updated = now
+
+
+class GCRAState:
+    """GCRA状态：理论到达时间(TAT)"""
+    __slots__ = ("touched", "tat")
+
+    def __init__(self, now: float):
+        self.touched = now
+        self.tat = now
+
+
+class RateLimitAlgorithm:
+    """
+    限流算法基类。
+    每个限流键只保存一个固定大小的状态记录，检查的时间复杂度为O(1)。
+    超过 window 秒未访问的状态等价于新状态，可以安全淘汰。
+    """
+
+    name = ""
+    state_class: Type = object
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = float(window)
+
+    def new_state(self, now: float):
+        """创建限流键的初始状态"""
+        return self.state_class(now)
+
+    def consume(self, state, now: float, cost: float = 1) -> RateLimitResult:
+        """
+        尝试消耗配额并更新状态。
+
+        参数:
+            state: 限流键的状态记录
+            now: 当前时间戳
+            cost: 本次请求消耗的配额
+
+        返回:
+            限流检查结果
+        """
+        raise NotImplementedError
+
+    def charge(self, state, now: float, amount: float) -> None:
+        """
+        不做检查直接扣减配额，用于请求完成后按实际用量补扣。
+        扣减超过剩余配额时记为欠额，后续请求在欠额恢复前被拒绝；amount 为负数时退还配额。
+
+        参数:
+            state: 限流键的状态记录
+            now: 当前时间戳
+            amount: 补扣的配额
+        """
+        raise NotImplementedError
+
+    @property
+    def idle_after(self) -> float:
+        """状态在多少秒未访问后可以被淘汰"""
+        return self.window
+
+
+class SlidingWindowCounter(RateLimitAlgorithm):
+    """
+    滑动窗口计数器。
+    用上一窗口计数按时间加权估算滑动窗口内的请求数。
+    """
+
+    name = "sliding_window"
+    state_class = SlidingWindowState
+
+    @property
+    def idle_after(self) -> float:
+        # 上一窗口的计数在两个窗口后才完全失效
+        return self.window * 2
+
+    def _advance(self, state: SlidingWindowState, now: float) -> float:
+        window = self.window
+        window_start = now - (now % window)
+        if window_start != state.window_start:
+            # 进入新窗口：紧邻的上一窗口计数保留用于加权，更早的直接丢弃
+            state.previous = state.current if window_start - state.window_start == window else 0.0
+            state.current = 0.0
+            state.window_start = window_start
+        return window_start
+
+    def consume(self, state: SlidingWindowState, now: float, cost: float = 1) -> RateLimitResult:
+        window = self.window
+        window_start = self._advance(state, now)
+
+        elapsed = now - window_start
+        reset_after = window - elapsed
+        estimated = state.previous * (reset_after / window) + state.current
+        if estimated + cost > self.limit:
+            retry_after = reset_after
+            if state.previous > 0:
+                retry_after = min(retry_after, (estimated + cost - self.limit) / state.previous * window)
+            return RateLimitResult(False, 0, reset_after, retry_after)
+
+        state.current += cost
+        remaining = max(0, int(self.limit - estimated - cost))
+        return RateLimitResult(True, remaining, reset_after, 0.0)
+
+    def charge(self, state: SlidingWindowState, now: float, amount: float) -> None:
+        self._advance(state, now)
+        state.current = max(0.0, state.current + amount)
+
+
+class TokenBucket(RateLimitAlgorithm):
+    """
+    令牌桶。
+    桶容量为 limit，每 window 秒补满一次，允许突发流量。
+    """
+
+    name = "token_bucket"
+    state_class = TokenBucketState
+
+    def __init__(self, limit: int, window: float):
+        super().__init__(limit, window)
+        self.rate = limit / self.window
+
+    def new_state(self, now: float) -> TokenBucketState:
+        state = TokenBucketState(now)
+        state.tokens = float(self.limit)
+        return state
+
+    def consume(self, state: TokenBucketState, now: float, cost: float = 1) -> RateLimitResult:
+        tokens = min(float(self.limit), state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if tokens < cost:
+            state.tokens = tokens
+            return RateLimitResult(False, 0, (self.limit - tokens) / self.rate, (cost - tokens) / self.rate)
+
+        tokens -= cost
+        state.tokens = tokens
+        return RateLimitResult(True, int(tokens), (self.limit - tokens) / self.rate, 0.0)
+
+    def charge(self, state: TokenBucketState, now: float, amount: float) -> None:
+        # 令牌数可以为负，补充到足够一次请求的令牌之前请求都会被拒绝
+        tokens = min(float(self.limit), state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        state.tokens = min(float(self.limit), tokens - amount)
+
+
+class GCRA(RateLimitAlgorithm):
+    """
+    通用信元速率算法(GCRA)。
+    只保存一个理论到达时间，效果等价于平滑的漏桶，允许 limit 个请求的突发。
+    """
+
+    name = "gcra"
+    state_class = GCRAState
+
+    def __init__(self, limit: int, window: float):
+        super().__init__(limit, window)
+        self.emission_interval = self.window / limit
+
+    def consume(self, state: GCRAState, now: float, cost: float = 1) -> RateLimitResult:
+        tat = max(state.tat, now)
+        new_tat = tat + self.emission_interval * cost
+        allow_at = new_tat - self.window
+        if now < allow_at:
+            return RateLimitResult(False, 0, tat - now, allow_at - now)
+
+        state.tat = new_tat
+        remaining = int((self.window - (new_tat - now)) / self.emission_interval)
+        return RateLimitResult(True, max(0, remaining), new_tat - now, 0.0)
+
+    def charge(self, state: GCRAState, now: float, amount: float) -> None:
+        state.tat = max(max(state.tat, now) + self.emission_interval * amount, now)
+
+
+# 可选的限流算法
+ALGORITHMS: Dict[str, Type[RateLimitAlgorithm]] = {
+    SlidingWindowCounter.name: SlidingWindowCounter,
+    TokenBucket.name: TokenBucket,
+    GCRA.name: GCRA,
+}
+
+
+def create_algorithm(name: str, limit: int, window: float) -> RateLimitAlgorithm:
+    """
+    根据名称创建限流算法。
+
+    参数:
+        name: 算法名称（sliding_window / token_bucket / gcra）
+        limit: 时间窗口内允许的最大请求数
+        window: 时间窗口大小（秒）
+
+    返回:
+        限流算法实例
+    """
+    algorithm_class = ALGORITHMS.get(name)
+    if algorithm_class is None:
+        raise ValueError(f"不支持的限流算法: '{name}'，可选: {', '.join(ALGORITHMS)}")
+    return algorithm_class(limit, window)
+
+
+class RateLimiter:
+    """
+    进程内限流器。
+    按访问顺序保存每个限流键的固定大小状态，后台任务从最久未访问的一端淘汰空闲键，
+    使内存占用只与活跃客户端数相关。
+    """
+
+    def __init__(self, algorithm: RateLimitAlgorithm, idle_ttl: float = 0.0, eviction_batch: int = 1000):
+        self.algorithm = algorithm
+        # 空闲时间至少要覆盖算法状态的有效期，淘汰后重新创建的状态才与原状态等价
+        self.idle_ttl = max(idle_ttl, algorithm.idle_after)
+        self.eviction_batch = eviction_batch
+        self._states: "OrderedDict[str, object]" = OrderedDict()
+        self._eviction_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _state(self, key: str, algorithm: RateLimitAlgorithm, now: float):
+        states = self._states
+        state = states.get(key)
+        if state is None:
+            state = algorithm.new_state(now)
+            states[key] = state
+        else:
+            states.move_to_end(key)
+        state.touched = now
+        return state
+
+    def hit(
+        self,
+        key: str,
+        cost: float = 1,
+        now: Optional[float] = None,
+        algorithm: Optional[RateLimitAlgorithm] = None,
+    ) -> RateLimitResult:
+        """
+        对限流键执行一次检查并消耗配额。
+
+        参数:
+            key: 限流键
+            cost: 本次请求消耗的配额
+            now: 当前时间戳，默认取系统时间
+            algorithm: 该键使用的限流算法（不同限流策略的阈值和窗口不同），默认为限流器的算法
+
+        返回:
+            限流检查结果
+        """
+        if now is None:
+            now = time.time()
+        if algorithm is None:
+            algorithm = self.algorithm
+        return algorithm.consume(self._state(key, algorithm, now), now, cost)
+
+    def charge(
+        self,
+        key: str,
+        amount: float,
+        now: Optional[float] = None,
+        algorithm: Optional[RateLimitAlgorithm] = None,
+    ) -> None:
+        """
+        不做检查直接扣减（amount 为负数时退还）限流键的配额。
+
+        参数:
+            key: 限流键
+            amount: 补扣的配额
+            now: 当前时间戳，默认取系统时间
+            algorithm: 该键使用的限流算法，默认为限流器的算法
+        """
+        if now is None:
+            now = time.time()
+        if algorithm is None:
+            algorithm = self.algorithm
+        algorithm.charge(self._state(key, algorithm, now), now, amount)
+
+    def reconfigure(self, algorithm: RateLimitAlgorithm, idle_ttl: float = 0.0) -> None:
+        """
+        更换限流算法参数（配置热加载）。
+        状态类型不变时保留已有状态，新的阈值和窗口立即生效；算法类型变化时清空所有状态。
+        """
+        if algorithm.state_class is not self.algorithm.state_class:
+            self._states.clear()
+        self.algorithm = algorithm
+        self.idle_ttl = max(idle_ttl, algorithm.idle_after)
+
+    def evict_idle(self, now: Optional[float] = None, limit: Optional[int] = None) -> int:
+        """
+        淘汰空闲的限流键。
+        状态按访问顺序排列，从最久未访问的一端开始检查，遇到活跃键即停止。
+
+        参数:
+            now: 当前时间戳
+            limit: 本次最多淘汰的键数量
+
+        返回:
+            淘汰的键数量
+        """
+        if now is None:
+            now = time.time()
+        deadline = now - self.idle_ttl
+        states = self._states
+        evicted = 0
+        while states and (limit is None or evicted < limit):
+            key = next(iter(states))
+            if states[key].touched > deadline:
+                break
+            del states[key]
+            evicted += 1
+        return evicted
+
+    async def _eviction_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            total = 0
+            # 分批淘汰并让出事件循环，避免大量键同时过期时阻塞请求处理
+            while True:
+                evicted = self.evict_idle(limit=self.eviction_batch)
+                total += evicted
+                if evicted < self.eviction_batch:
+                    break
+                await asyncio.sleep(0)
+            if total:
+                logger.debug("已淘汰空闲限流键: %d, 当前键数量: %d", total, len(self._states))
+
+    def start(self, interval: float) -> None:
+        """启动后台空闲键淘汰任务"""
+        if self._eviction_task is None:
+            self._eviction_task = asyncio.create_task(self._eviction_loop(interval))
+
+    async def stop(self) -> None:
+        """停止后台淘汰任务"""
+        task, self._eviction_task = self._eviction_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
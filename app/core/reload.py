@@ -0,0 +1,252 @@
+import asyncio
+import os
+import signal
+from typing import Dict, List, Optional, Set
+
+from app.core.concurrency import create_limit_algorithm
+from app.core.config import Settings, load_settings, settings
+from app.core.dedup_cache import dedup_cache
+from app.core.health import health_checker
+from app.core.load_balancer import upstream_pools
+from app.core.profiler import profiler
+from app.core.rate_limit_policy import build_policies, rate_limit_policies
+from app.core.rate_limit_storage import rate_limit_storage
+from app.core.rate_limiter import create_algorithm
+from app.core.resilience import resilience
+from app.core.response_cache import response_cache
+from app.core.router import Router, build_rules, router
+from app.core.token_cache import token_cache
+from app.core.upstream import upstream_clients
+from app.utils.logger import logger
+
+# 修改后需要重启才能生效的配置（进程启动时创建的存储、日志处理器和后台任务），SERVER_* 同理
+RESTART_REQUIRED_SETTINGS = (
+    "LOG_FORMAT",
+    "LOG_ASYNC",
+    "LOG_QUEUE_SIZE",
+    "LOG_SAMPLE_RATES",
+    "LOG_REPEAT_BURST",
+    "LOG_REPEAT_INTERVAL",
+    "RATE_LIMIT_STORAGE",
+    "RATE_LIMIT_SHM_PATH",
+    "RATE_LIMIT_SHM_SLOTS",
+    "RATE_LIMIT_REDIS_URL",
+    "RATE_LIMIT_REDIS_PREFIX",
+    "RATE_LIMIT_REDIS_TIMEOUT",
+    "RATE_LIMIT_LEASE_SIZE",
+    "RATE_LIMIT_FAIL_OPEN",
+    "RATE_LIMIT_EVICTION_INTERVAL",
+    "METRICS_DIR",
+    "METRICS_SNAPSHOT_INTERVAL",
+    "DEDUP_CACHE_PATH",
+    "DEDUP_CACHE_MAX_BYTES",
+    "DEDUP_CACHE_INDEX_SLOTS",
+)
+
+# 这些配置变化时按新配置重新创建各服务的熔断器、重试预算和并发限制
+_RESILIENCE_SETTINGS = (
+    "CIRCUIT_BREAKER_WINDOW",
+    "CIRCUIT_BREAKER_MIN_REQUESTS",
+    "CIRCUIT_BREAKER_ERROR_RATE",
+    "CIRCUIT_BREAKER_SLOW_CALL_DURATION",
+    "CIRCUIT_BREAKER_SLOW_CALL_RATE",
+    "CIRCUIT_BREAKER_OPEN_DURATION",
+    "CIRCUIT_BREAKER_HALF_OPEN_REQUESTS",
+    "RETRY_BUDGET_RATIO",
+    "RETRY_BUDGET_MIN_PER_SECOND",
+    "CONCURRENCY_LIMIT_ALGORITHM",
+    "CONCURRENCY_INITIAL_LIMIT",
+    "CONCURRENCY_MIN_LIMIT",
+    "CONCURRENCY_MAX_LIMIT",
+    "CONCURRENCY_TOLERANCE",
+    "CONCURRENCY_BACKOFF_RATIO",
+    "CONCURRENCY_QUEUE_SIZE",
+    "CONCURRENCY_QUEUE_TIMEOUT",
+)
+
+
+class ConfigReloader:
+    """
+    配置热加载。
+    定期检查 .env 和 CONFIG_FILE 的修改时间，文件变化或收到 SIGHUP 时重新读取完整配置。
+
+    新配置先完整校验（配置项类型、路由规则、负载均衡策略、限流算法和策略、并发限制算法），任何一项无效都保留当前配置；
+    校验通过后在一次同步调用中替换配置、路由表、实例池、上游客户端和限流参数。
+    替换过程中没有 await，其他协程不会看到只应用了一半的配置；
+    每个请求在进入网关时确定路由和实例池，处理途中发生的重新加载不影响这个请求。
+    被移除服务的上游客户端在进行中的请求完成后（最多 CONFIG_DRAIN_TIMEOUT 秒）才关闭，
+    地址不变的实例保留连接池、健康状态和被动异常检测状态。
+    """
+
+    def __init__(self, interval: float, drain_timeout: float):
+        self.interval = interval
+        self.drain_timeout = drain_timeout
+        self.generation = 0  # 已应用的配置版本，每次成功重新加载加一
+        self._mtimes: Dict[str, Optional[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._drains: Set[asyncio.Task] = set()
+        self._signal_installed = False
+
+    @staticmethod
+    def _watched_paths() -> List[str]:
+        paths = [Settings.model_config.get("env_file") or ""]
+        paths.append(settings.CONFIG_FILE)
+        return [path for path in paths if isinstance(path, str) and path]
+
+    def _stat(self) -> Dict[str, Optional[float]]:
+        mtimes: Dict[str, Optional[float]] = {}
+        for path in self._watched_paths():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def reload(self) -> bool:
+        """
+        重新加载配置。
+
+        返回:
+            是否应用了新配置；配置无效或没有变化时返回False
+        """
+        try:
+            new_settings = load_settings()
+            new_router = Router(build_rules(new_settings))
+            new_pools = upstream_pools.prepare(new_settings.BACKEND_SERVICES, new_settings)
+            algorithm = create_algorithm(
+                new_settings.RATE_LIMIT_ALGORITHM,
+                new_settings.RATE_LIMIT_MAX_REQUESTS,
+                new_settings.RATE_LIMIT_WINDOW_SIZE,
+            )
+            new_policies = build_policies(new_settings)
+            create_limit_algorithm(new_settings.CONCURRENCY_LIMIT_ALGORITHM, new_settings)
+        except Exception as e:
+            logger.error("配置无效，继续使用当前配置: %s", e)
+            return False
+
+        changed = [
+            name for name in Settings.model_fields
+            if getattr(new_settings, name) != getattr(settings, name)
+        ]
+        if not changed:
+            logger.debug("配置没有变化")
+            return False
+
+        # 以下替换全部同步完成，中间不让出事件循环
+        settings.__dict__.update(new_settings.__dict__)
+        router.replace(new_router)
+        removed = upstream_pools.replace(new_pools)
+        retired = upstream_clients.reconfigure()
+        rate_limit_policies.replace(new_policies)
+        idle_ttl = max(settings.RATE_LIMIT_IDLE_TTL, new_policies.idle_after)
+        if not rate_limit_storage.reconfigure(algorithm, idle_ttl):
+            logger.warning("当前限流存储 '%s' 不支持在运行中修改限流算法参数，需要重启生效", rate_limit_storage.name)
+        resilience.reconfigure(settings.BACKEND_SERVICES, reset=any(name in changed for name in _RESILIENCE_SETTINGS))
+        self._apply_components(changed)
+        self.generation += 1
+
+        for client in retired:
+            task = asyncio.ensure_future(upstream_clients.drain(client, self.drain_timeout))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+
+        restart_required = [
+            name for name in changed
+            if name in RESTART_REQUIRED_SETTINGS or name.startswith("SERVER_")
+        ]
+        if restart_required:
+            logger.warning("以下配置修改需要重启才能生效: %s", ", ".join(restart_required))
+        logger.info(
+            "配置已重新加载 (版本 %d): %s%s",
+            self.generation,
+            ", ".join(changed),
+            f"，移除服务: {', '.join(pool.service_name for pool in removed)}" if removed else "",
+        )
+        return True
+
+    def _apply_components(self, changed: List[str]) -> None:
+        """把新配置应用到启动时按配置创建的组件"""
+        health_checker.interval = settings.HEALTH_CHECK_INTERVAL
+        health_checker.jitter = settings.HEALTH_CHECK_JITTER
+        health_checker.timeout = settings.HEALTH_CHECK_TIMEOUT
+        health_checker.path = settings.HEALTH_CHECK_PATH
+        health_checker.unhealthy_threshold = settings.HEALTH_CHECK_UNHEALTHY_THRESHOLD
+        health_checker.healthy_threshold = settings.HEALTH_CHECK_HEALTHY_THRESHOLD
+        health_checker.prune()
+        if settings.HEALTH_CHECK_ENABLED:
+            health_checker.start()
+            if "BACKEND_SERVICES" in changed:
+                # 立即探测新增的实例，不等下一个检查周期
+                asyncio.ensure_future(health_checker.check_all())
+        elif "HEALTH_CHECK_ENABLED" in changed:
+            asyncio.ensure_future(health_checker.stop())
+
+        response_cache.max_bytes = settings.RESPONSE_CACHE_MAX_BYTES
+        response_cache.max_entry_bytes = settings.RESPONSE_CACHE_MAX_ENTRY_BYTES
+        dedup_cache.max_entry_bytes = settings.DEDUP_CACHE_MAX_ENTRY_BYTES
+        dedup_cache.max_body_bytes = settings.DEDUP_CACHE_MAX_BODY_BYTES
+        dedup_cache.ttl = settings.DEDUP_CACHE_TTL
+        token_cache.max_entries = settings.JWT_CACHE_MAX_ENTRIES
+        token_cache.max_bytes = settings.JWT_CACHE_MAX_BYTES
+        token_cache.ttl = settings.JWT_CACHE_TTL
+        profiler.interval = settings.PROFILER_INTERVAL
+
+        if "LOG_LEVEL" in changed or "DEBUG" in changed:
+            level = settings.LOG_LEVEL or ("DEBUG" if settings.DEBUG else "INFO")
+            logger.logger.setLevel(level.upper())
+
+        self.interval = settings.CONFIG_RELOAD_INTERVAL
+        self.drain_timeout = settings.CONFIG_DRAIN_TIMEOUT
+
+    def _on_signal(self) -> None:
+        logger.info("收到 SIGHUP，重新加载配置")
+        self.reload()
+        self._mtimes = self._stat()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            mtimes = self._stat()
+            if mtimes == self._mtimes:
+                continue
+            self._mtimes = mtimes
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error("重新加载配置出错: %s", e, exc_info=True)
+
+    def start(self) -> None:
+        """安装 SIGHUP 处理器，CONFIG_RELOAD_ENABLED 时启动文件监视任务"""
+        loop = asyncio.get_running_loop()
+        if not self._signal_installed and hasattr(signal, "SIGHUP"):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, self._on_signal)
+                self._signal_installed = True
+            except (NotImplementedError, RuntimeError, ValueError):
+                # 非主线程或不支持信号处理的事件循环
+                pass
+        if settings.CONFIG_RELOAD_ENABLED and self._task is None:
+            self._mtimes = self._stat()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止文件监视，关闭仍在排空的旧客户端"""
+        if self._signal_installed:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._signal_installed = False
+        task, self._task = self._task, None
+        for pending in [task, *self._drains]:
+            if pending is None:
+                continue
+            pending.cancel()
+            try:
+                await pending
+            except asyncio.CancelledError:
+                pass
+
+
+# 创建全局配置热加载器实例
+config_reloader = ConfigReloader(
+    interval=settings.CONFIG_RELOAD_INTERVAL,
+    drain_timeout=settings.CONFIG_DRAIN_TIMEOUT,
+)
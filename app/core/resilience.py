@@ -0,0 +1,278 @@
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.core.concurrency import create_limiter
+from app.core.config import settings
+from app.utils.logger import logger
+
+# 幂等方法，失败后可以安全地重新发送
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"}
+
+
+class RollingWindow:
+    """按时间分桶的滑动窗口计数器，内存占用固定"""
+
+    def __init__(self, window: float, buckets: int = 10, fields: int = 1):
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self._epochs = [-1] * buckets
+        self._counts = [[0] * fields for _ in range(buckets)]
+
+    def add(self, now: float, *values: int) -> None:
+        """在当前时间所在的桶中累加计数"""
+        epoch = int(now / self.bucket_width)
+        index = epoch % self.buckets
+        counts = self._counts[index]
+        if self._epochs[index] != epoch:
+            # 桶已过期，重新开始计数
+            self._epochs[index] = epoch
+            for field in range(len(counts)):
+                counts[field] = 0
+        for field, value in enumerate(values):
+            counts[field] += value
+
+    def totals(self, now: float) -> List[int]:
+        """窗口内各字段的累计值"""
+        oldest = int(now / self.bucket_width) - self.buckets
+        totals = [0] * len(self._counts[0])
+        for epoch, counts in zip(self._epochs, self._counts):
+            if epoch > oldest:
+                for field, value in enumerate(counts):
+                    totals[field] += value
+        return totals
+
+
+class CircuitBreaker:
+    """
+    后端服务的熔断器。
+    - closed: 正常转发，统计窗口内的错误率和慢调用比例
+    - open: 错误率或慢调用比例超过阈值后直接拒绝请求，持续 open_duration 秒
+    - half_open: 放行少量探测请求，全部成功则恢复为 closed，任一失败则重新 open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        service_name: str,
+        window: float,
+        min_requests: int,
+        error_rate: float,
+        slow_call_duration: float,
+        slow_call_rate: float,
+        open_duration: float,
+        half_open_requests: int,
+    ):
+        self.service_name = service_name
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_requests = half_open_requests
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        # 请求数、失败数、慢调用数
+        self._window = RollingWindow(window, fields=3)
+        self._window_size = window
+        self._probes = 0  # half_open 状态下已放行的探测请求数
+        self._probe_successes = 0
+
+    def allow(self) -> bool:
+        """
+        判断是否放行请求。放行的请求必须在完成后调用 record。
+
+        返回:
+            True 表示放行
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_duration:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+            logger.info("熔断器进入半开状态: %s", self.service_name)
+        if self._probes >= self.half_open_requests:
+            return False
+        self._probes += 1
+        return True
+
+    def record(self, success: Optional[bool], latency: float) -> None:
+        """
+        记录请求结果。
+
+        参数:
+            success: 请求是否成功；None 表示结果与后端无关（例如客户端断开），只归还探测名额
+            latency: 从发送请求到收到响应头的耗时（秒）
+        """
+        if self.state == self.HALF_OPEN:
+            if success is None:
+                self._probes -= 1
+            elif not success or latency >= self.slow_call_duration:
+                self._open()
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_requests:
+                    self.state = self.CLOSED
+                    self._window = RollingWindow(self._window_size, fields=3)
+                    logger.info("熔断器恢复: %s", self.service_name)
+            return
+        if success is None or self.state != self.CLOSED:
+            return
+        now = time.monotonic()
+        self._window.add(now, 1, 0 if success else 1, 1 if latency >= self.slow_call_duration else 0)
+        requests, failures, slow_calls = self._window.totals(now)
+        if requests < self.min_requests:
+            return
+        if failures >= requests * self.error_rate or slow_calls >= requests * self.slow_call_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logger.warning("熔断器打开: %s, %.0f秒内快速失败", self.service_name, self.open_duration)
+
+    def retry_after(self) -> int:
+        """距离进入半开状态的剩余秒数"""
+        return max(1, int(self.open_duration - (time.monotonic() - self.opened_at) + 0.999))
+
+
+class RetryBudget:
+    """
+    重试预算。
+    窗口内的重试（包括对冲请求）数量不超过正常请求数的 ratio 倍，
+    另外每秒保底允许 min_per_second 次，避免低流量时完全无法重试。
+    后端整体故障时重试量受限，不会成倍放大故障。
+    """
+
+    def __init__(self, window: float, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.min_retries = min_per_second * window
+        # 请求数、重试数
+        self._window = RollingWindow(window, fields=2)
+
+    def record_request(self) -> None:
+        """记录一次正常请求"""
+        self._window.add(time.monotonic(), 1, 0)
+
+    def try_retry(self) -> bool:
+        """
+        尝试消耗一次重试预算。
+
+        返回:
+            True 表示允许重试
+        """
+        now = time.monotonic()
+        requests, retries = self._window.totals(now)
+        if retries >= max(self.min_retries, requests * self.ratio):
+            return False
+        self._window.add(now, 0, 1)
+        return True
+
+
+class LatencyTracker:
+    """
+    最近若干次请求的响应延迟，用于估算对冲请求的延迟阈值。
+    分位数每记录 refresh 次重新计算一次，查询开销为常数。
+    """
+
+    def __init__(self, size: int = 1000, refresh: int = 100, min_samples: int = 20):
+        self._samples = [0.0] * size
+        self._count = 0
+        self._refresh = refresh
+        self._min_samples = min_samples
+        self._since_refresh = 0
+        self._sorted: List[float] = []
+
+    def record(self, latency: float) -> None:
+        self._samples[self._count % len(self._samples)] = latency
+        self._count += 1
+        self._since_refresh += 1
+        if self._since_refresh >= self._refresh or self._count == self._min_samples:
+            self._since_refresh = 0
+            self._sorted = sorted(self._samples[:min(self._count, len(self._samples))])
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        估算延迟分位数。
+
+        参数:
+            q: 分位数，例如 0.95
+
+        返回:
+            延迟（秒）；样本不足时返回None
+        """
+        if self._count < self._min_samples or not self._sorted:
+            return None
+        return self._sorted[min(int(len(self._sorted) * q), len(self._sorted) - 1)]
+
+
+class ServiceResilience:
+    """单个后端服务的熔断器、重试预算、并发限制和延迟统计"""
+
+    def __init__(self, service_name: str):
+        self.breaker = CircuitBreaker(
+            service_name,
+            window=settings.CIRCUIT_BREAKER_WINDOW,
+            min_requests=settings.CIRCUIT_BREAKER_MIN_REQUESTS,
+            error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+            slow_call_duration=settings.CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+            slow_call_rate=settings.CIRCUIT_BREAKER_SLOW_CALL_RATE,
+            open_duration=settings.CIRCUIT_BREAKER_OPEN_DURATION,
+            half_open_requests=settings.CIRCUIT_BREAKER_HALF_OPEN_REQUESTS,
+        )
+        self.retry_budget = RetryBudget(
+            window=settings.CIRCUIT_BREAKER_WINDOW,
+            ratio=settings.RETRY_BUDGET_RATIO,
+            min_per_second=settings.RETRY_BUDGET_MIN_PER_SECOND,
+        )
+        self.latency = LatencyTracker()
+        self.limiter = create_limiter(service_name)
+
+    def hedge_delay(self) -> Optional[float]:
+        """对冲请求的发送延迟；未启用或样本不足时返回None"""
+        if not settings.HEDGE_ENABLED:
+            return None
+        delay = self.latency.quantile(settings.HEDGE_QUANTILE)
+        if delay is None:
+            return None
+        return max(delay, settings.HEDGE_MIN_DELAY)
+
+
+class ResilienceRegistry:
+    """所有后端服务的弹性策略注册表"""
+
+    def __init__(self):
+        self._services: Dict[str, ServiceResilience] = {}
+
+    def get(self, service_name: str) -> ServiceResilience:
+        """获取服务的弹性策略，首次使用时创建"""
+        service = self._services.get(service_name)
+        if service is None:
+            service = self._services[service_name] = ServiceResilience(service_name)
+        return service
+
+    def items(self):
+        return self._services.items()
+
+    def reconfigure(self, services: Iterable[str], reset: bool) -> None:
+        """
+        配置热加载后同步弹性策略。
+
+        参数:
+            services: 当前配置的服务名称，其余服务的策略被丢弃
+            reset: 熔断、重试或并发限制配置发生变化时丢弃所有策略，按新配置重新创建
+        """
+        if reset:
+            self._services = {}
+            return
+        services = set(services)
+        self._services = {name: service for name, service in self._services.items() if name in services}
+
+
+# 创建全局弹性策略注册表
+resilience = ResilienceRegistry()
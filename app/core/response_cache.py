@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+# 允许缓存的响应状态码（RFC 9111 中默认可缓存的常见状态码）
+CACHEABLE_STATUS_CODES = {200, 203, 300, 301, 404, 410}
+
+# 304 响应只需要携带的响应头
+NOT_MODIFIED_HEADERS = {b"cache-control", b"content-location", b"date", b"etag", b"expires", b"vary"}
+
+# 每个缓存条目除响应体外的估算内存开销
+ENTRY_OVERHEAD_BYTES = 256
+
+# 共享缓存的作用域名称
+SHARED_SCOPE = "shared"
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    """
+    解析 Cache-Control 头。
+
+    参数:
+        value: Cache-Control 头的值
+
+    返回:
+        指令名称（小写） -> 参数，无参数的指令为None
+    """
+    directives: Dict[str, Optional[str]] = {}
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """按弱比较判断 If-None-Match 是否匹配 ETag"""
+    if if_none_match.strip() == "*":
+        return True
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+class CachedResponse:
+    """缓存的后端响应"""
+
+    __slots__ = (
+        "key",
+        "primary_key",
+        "scope",
+        "status",
+        "headers",
+        "body",
+        "etag",
+        "vary",
+        "stored_at",
+        "validated_at",
+        "expires_at",
+        "size",
+    )
+
+    def __init__(
+        self,
+        primary_key: str,
+        scope: str,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        etag: Optional[str],
+        vary: Tuple[str, ...],
+    ):
+        self.key = ""
+        self.primary_key = primary_key
+        self.scope = scope
+        self.status = status
+        self.headers = headers
+        self.body = b""
+        self.etag = etag
+        self.vary = vary
+        self.stored_at = 0.0  # 响应在后端生成的时间（已扣除后端返回的 Age）
+        self.validated_at = 0.0  # 最近一次从后端获取或重新验证的时间
+        self.expires_at = 0.0
+        self.size = 0
+
+    def is_fresh(self, now: float) -> bool:
+        """条目是否仍可不经验证直接返回"""
+        return self.expires_at > now
+
+    def age(self, now: float) -> int:
+        """条目的当前年龄（秒），用于 Age 响应头"""
+        return max(0, int(now - self.stored_at))
+
+
+class ResponseCache:
+    """
+    遵循HTTP缓存语义的后端响应缓存。
+    - 按 Cache-Control（max-age、s-maxage、no-store、no-cache、private、public）和 Expires 计算新鲜期
+    - 过期但带 ETag 的条目通过 If-None-Match 向后端重新验证
+    - 按 Vary 声明的请求头区分同一URL的不同变体
+    - 携带用户身份的请求默认按用户隔离缓存，只有后端明确声明 public/s-maxage 时才进入共享缓存
+    - 按总字节数限制容量，LRU淘汰
+    - 相同请求并发未命中时只有一个请求转发到后端，其余请求等待其结果
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        # 主键 -> [Vary 请求头名称, 该主键下的条目数]
+        self._vary: Dict[str, List[Any]] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def identity(headers: Dict[str, str], user: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        请求的身份标识，用于隔离按用户缓存的响应。
+
+        参数:
+            headers: 请求头（名称小写）
+            user: 已认证的用户信息
+
+        返回:
+            身份标识；匿名请求返回None
+        """
+        if user is not None and "sub" in user:
+            return f"user:{user['sub']}"
+        credentials = headers.get("authorization") or headers.get("cookie")
+        if credentials:
+            return "credentials:" + hashlib.sha256(credentials.encode("latin-1")).hexdigest()
+        return None
+
+    @staticmethod
+    def _primary_key(scope: str, service_name: str, target: str) -> str:
+        return f"{scope} {service_name} {target}"
+
+    @staticmethod
+    def _variant_key(primary_key: str, vary: Tuple[str, ...], headers: Dict[str, str]) -> str:
+        if not vary:
+            return primary_key
+        return primary_key + "\n" + "\n".join(f"{name}:{headers.get(name, '')}" for name in vary)
+
+    def lookup(
+        self,
+        service_name: str,
+        target: str,
+        headers: Dict[str, str],
+        identity: Optional[str],
+    ) -> Optional[CachedResponse]:
+        """
+        查找请求对应的缓存条目（不区分是否新鲜）。
+        有身份的请求先查该用户的缓存，再查共享缓存。
+
+        参数:
+            service_name: 后端服务名称
+            target: 后端路径（含查询字符串）
+            headers: 请求头（名称小写）
+            identity: 请求的身份标识
+
+        返回:
+            缓存条目；未命中时返回None
+        """
+        scopes = (identity, SHARED_SCOPE) if identity is not None else (SHARED_SCOPE,)
+        for scope in scopes:
+            primary_key = self._primary_key(scope, service_name, target)
+            vary = self._vary.get(primary_key)
+            if vary is None:
+                continue
+            entry = self._entries.get(self._variant_key(primary_key, vary[0], headers))
+            if entry is not None:
+                self._entries.move_to_end(entry.key)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def _freshness(cache_control: Dict[str, Optional[str]], headers: httpx.Headers, shared: bool) -> int:
+        """根据响应头计算新鲜期（秒）"""
+        if "no-cache" in cache_control:
+            return 0
+        lifetime = _seconds(cache_control.get("s-maxage")) if shared else None
+        if lifetime is None:
+            lifetime = _seconds(cache_control.get("max-age"))
+        if lifetime is None and "expires" in headers:
+            try:
+                expires = parsedate_to_datetime(headers["expires"]).timestamp()
+                date = parsedate_to_datetime(headers["date"]).timestamp() if "date" in headers else time.time()
+                lifetime = int(expires - date)
+            except (TypeError, ValueError):
+                lifetime = 0
+        return (lifetime or 0) - (_seconds(headers.get("age")) or 0)
+
+    def prepare(
+        self,
+        service_name: str,
+        target: str,
+        request_headers: Dict[str, str],
+        identity: Optional[str],
+        status: int,
+        response_headers: httpx.Headers,
+        raw_headers: List[Tuple[bytes, bytes]],
+    ) -> Optional[CachedResponse]:
+        """
+        根据响应头判断响应是否可以缓存，在读取响应体之前调用。
+
+        参数:
+            service_name: 后端服务名称
+            target: 后端路径（含查询字符串）
+            request_headers: 请求头（名称小写）
+            identity: 请求的身份标识
+            status: 响应状态码
+            response_headers: 后端响应头
+            raw_headers: 转发给客户端的响应头
+
+        返回:
+            尚未写入响应体的缓存条目；不可缓存时返回None
+        """
+        if status not in CACHEABLE_STATUS_CODES or "set-cookie" in response_headers:
+            return None
+        cache_control = parse_cache_control(", ".join(response_headers.get_list("cache-control")))
+        if "no-store" in cache_control:
+            return None
+        vary = {name.strip().lower() for name in response_headers.get_list("vary", split_commas=True)}
+        if "*" in vary:
+            return None
+        if "content-encoding" in response_headers:
+            # 按 Accept-Encoding 返回不同编码时后端可能未声明 Vary
+            vary.add("accept-encoding")
+        content_length = _seconds(response_headers.get("content-length"))
+        if content_length is not None and content_length > self.max_entry_bytes:
+            return None
+
+        # 带身份的请求只有在后端明确允许时才进入共享缓存（RFC 9111 3.5）
+        if "private" in cache_control:
+            if identity is None:
+                return None
+            scope = identity
+        elif identity is None or {"public", "s-maxage", "must-revalidate"} & cache_control.keys():
+            scope = SHARED_SCOPE
+        else:
+            scope = identity
+
+        freshness = self._freshness(cache_control, response_headers, scope == SHARED_SCOPE)
+        etag = response_headers.get("etag")
+        if freshness <= 0 and etag is None:
+            return None
+
+        now = time.time()
+        primary_key = self._primary_key(scope, service_name, target)
+        entry = CachedResponse(
+            primary_key,
+            scope,
+            status,
+            [(key, value) for key, value in raw_headers if key != b"age"],
+            etag,
+            tuple(sorted(vary)),
+        )
+        entry.key = self._variant_key(primary_key, entry.vary, request_headers)
+        entry.stored_at = now - (_seconds(response_headers.get("age")) or 0)
+        entry.validated_at = now
+        entry.expires_at = now + max(freshness, 0)
+        return entry
+
+    def store(self, entry: CachedResponse, body: bytes) -> None:
+        """写入响应体并加入缓存，超出总容量时淘汰最久未使用的条目"""
+        entry.body = body
+        entry.size = len(body) + sum(len(key) + len(value) for key, value in entry.headers) + ENTRY_OVERHEAD_BYTES
+        if entry.size > self.max_entry_bytes:
+            return
+        self._discard(entry.key)
+        vary = self._vary.get(entry.primary_key)
+        if vary is None or vary[0] != entry.vary:
+            # Vary 变化时旧变体已无法查到，整体替换
+            self._discard_primary(entry.primary_key)
+            vary = self._vary[entry.primary_key] = [entry.vary, 0]
+        vary[1] += 1
+        self._entries[entry.key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            self._discard(next(iter(self._entries)))
+
+    def refresh(self, entry: CachedResponse, response_headers: httpx.Headers) -> None:
+        """后端返回304时更新条目的新鲜期和验证器"""
+        cache_control = parse_cache_control(", ".join(response_headers.get_list("cache-control")))
+        if "no-store" in cache_control:
+            self._discard(entry.key)
+            return
+        now = time.time()
+        freshness = self._freshness(cache_control, response_headers, entry.scope == SHARED_SCOPE)
+        entry.etag = response_headers.get("etag", entry.etag)
+        entry.stored_at = now - (_seconds(response_headers.get("age")) or 0)
+        entry.validated_at = now
+        entry.expires_at = now + max(freshness, 0)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        vary = self._vary.get(entry.primary_key)
+        if vary is not None:
+            vary[1] -= 1
+            if vary[1] <= 0:
+                del self._vary[entry.primary_key]
+
+    def _discard_primary(self, primary_key: str) -> None:
+        if self._vary.pop(primary_key, None) is None:
+            return
+        for key in [key for key, entry in self._entries.items() if entry.primary_key == primary_key]:
+            self._bytes -= self._entries.pop(key).size
+
+    def flight_key(self, service_name: str, target: str, identity: Optional[str]) -> str:
+        """合并并发请求所用的键，不同用户的请求不会合并"""
+        return self._primary_key(identity or SHARED_SCOPE, service_name, target)
+
+    def pending(self, key: str) -> Optional[asyncio.Future]:
+        """获取正在进行的相同请求，没有时返回None"""
+        return self._pending.get(key)
+
+    def begin(self, key: str) -> None:
+        """标记一个请求开始转发到后端"""
+        self._pending[key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, key: str) -> None:
+        """标记请求完成，唤醒等待同一结果的请求"""
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def clear(self) -> None:
+        """清空所有缓存条目"""
+        self._entries.clear()
+        self._vary.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """缓存统计信息"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 创建全局响应缓存实例
+response_cache = ResponseCache(
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=settings.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+)
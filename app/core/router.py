@@ -0,0 +1,240 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import Settings, settings
+
+# 默认的限流策略名称
+DEFAULT_RATE_LIMIT_POLICY = "default"
+
+# 未设置的路由属性，表示沿用更通用规则的值
+_UNSET: Any = object()
+
+
+class RouteRule:
+    """
+    路由规则。
+    路径模式按 "/" 分段匹配：
+    - 普通段精确匹配
+    - "*" 匹配任意一段，"{name}" 匹配任意一段并记录为捕获值
+    - 末尾的 "**" 匹配剩余的一段或多段，剩余部分作为转发到后端的路径
+
+    属性为 _UNSET 时沿用更通用规则的值，因此白名单等规则只需声明自己关心的属性。
+    service 为 "" 表示由网关本地处理，为 "{name}" 表示取路径中的捕获值。
+    """
+
+    __slots__ = (
+        "pattern", "segments", "service", "upstream_prefix", "auth", "rate_limit", "priority", "dedup", "max_body_size",
+        "specificity",
+    )
+
+    def __init__(
+        self,
+        pattern: str,
+        service: Any = _UNSET,
+        upstream_prefix: str = "",
+        auth: Any = _UNSET,
+        rate_limit: Any = _UNSET,
+        priority: Any = _UNSET,
+        dedup: Any = _UNSET,
+        max_body_size: Any = _UNSET,
+    ):
+        self.pattern = pattern
+        self.segments = pattern.split("/")[1:]
+        self.service = service
+        self.upstream_prefix = upstream_prefix.rstrip("/")
+        self.auth = auth
+        self.rate_limit = rate_limit
+        self.priority = priority
+        self.dedup = dedup
+        self.max_body_size = max_body_size
+        is_prefix = bool(self.segments) and self.segments[-1] == "**"
+        literals = sum(1 for segment in self.segments if not _is_wildcard(segment) and segment != "**")
+        # 越具体的规则优先级越高：精确段越多、段数越多、非前缀规则优先
+        self.specificity = (literals, len(self.segments), not is_prefix)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RouteRule":
+        """从配置字典创建规则，例如 {"path": "/api/ai/**", "service": "ai", "auth": True}"""
+        return cls(
+            data["path"],
+            service=data.get("service", _UNSET),
+            upstream_prefix=data.get("upstream_prefix", ""),
+            auth=data.get("auth", _UNSET),
+            rate_limit=data.get("rate_limit", _UNSET),
+            priority=data.get("priority", _UNSET),
+            dedup=data.get("dedup", _UNSET),
+            max_body_size=data.get("max_body_size", _UNSET),
+        )
+
+
+class RouteMatch:
+    """一次路由查找的结果（只读）"""
+
+    __slots__ = ("service", "upstream_path", "auth_required", "rate_limit", "priority", "dedup", "max_body_size")
+
+    def __init__(
+        self,
+        service: Optional[str] = None,
+        upstream_path: str = "/",
+        auth_required: bool = True,
+        rate_limit: Optional[str] = DEFAULT_RATE_LIMIT_POLICY,
+        priority: int = 0,
+        dedup: bool = False,
+        max_body_size: Optional[int] = None,
+    ):
+        self.service = service  # 转发的目标服务，None 表示由网关本地处理
+        self.upstream_path = upstream_path  # 转发到后端的路径
+        self.auth_required = auth_required  # 是否需要JWT认证
+        self.rate_limit = rate_limit  # 限流策略名称，None 表示不限流
+        self.priority = priority  # 后端过载时的排队优先级，越大越优先，负数表示过载时直接拒绝
+        self.dedup = dedup  # 是否对POST请求启用去重缓存
+        self.max_body_size = max_body_size  # 请求体大小上限（字节，0 表示不限制），None 表示使用 MAX_REQUEST_BODY_SIZE
+
+
+def _is_wildcard(segment: str) -> bool:
+    return segment == "*" or (segment.startswith("{") and segment.endswith("}"))
+
+
+class _Node:
+    __slots__ = ("children", "wildcards", "rules", "prefix_rules")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # 捕获名称 -> 子节点，"*" 的捕获名称为空字符串
+        self.wildcards: Dict[str, "_Node"] = {}
+        self.rules: List[RouteRule] = []
+        self.prefix_rules: List[RouteRule] = []
+
+
+class Router:
+    """
+    预编译的路由表。
+    启动时把所有规则编译为按路径段组织的前缀树，
+    一次查找即可得到目标服务、后端路径、是否需要认证和限流策略，
+    查找开销只与路径段数有关，与规则数量无关。
+    """
+
+    def __init__(self, rules: Iterable[RouteRule], cache_size: int = 10000):
+        self._root = _Node()
+        for rule in rules:
+            self._add(rule)
+        # 热点路径的查找结果缓存；查找结果只读，可以在请求之间共享
+        self._cache: Dict[str, RouteMatch] = {}
+        self._cache_size = cache_size
+
+    def replace(self, other: "Router") -> None:
+        """
+        用另一个已编译的路由表替换当前路由表（配置热加载）。
+        前缀树和缓存在一次赋值中同时替换，查找不会看到新旧规则混合的状态。
+        """
+        self._root, self._cache, self._cache_size = other._root, other._cache, other._cache_size
+
+    def _add(self, rule: RouteRule) -> None:
+        node = self._root
+        segments = rule.segments
+        for index, segment in enumerate(segments):
+            if segment == "**":
+                if index != len(segments) - 1:
+                    raise ValueError(f"'**' 只能出现在路由规则末尾: '{rule.pattern}'")
+                node.prefix_rules.append(rule)
+                return
+            if _is_wildcard(segment):
+                name = segment[1:-1] if segment != "*" else ""
+                node = node.wildcards.setdefault(name, _Node())
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.rules.append(rule)
+
+    def _collect(
+        self,
+        node: _Node,
+        segments: List[str],
+        index: int,
+        captures: Dict[str, str],
+        matches: List[Tuple[RouteRule, Dict[str, str], Optional[List[str]]]],
+    ) -> None:
+        if node.prefix_rules and index < len(segments):
+            rest = segments[index:]
+            for rule in node.prefix_rules:
+                matches.append((rule, captures, rest))
+        if index == len(segments):
+            for rule in node.rules:
+                matches.append((rule, captures, None))
+            return
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            self._collect(child, segments, index + 1, captures, matches)
+        for name, child in node.wildcards.items():
+            child_captures = {**captures, name: segment} if name else captures
+            self._collect(child, segments, index + 1, child_captures, matches)
+
+    def resolve(self, path: str) -> RouteMatch:
+        """
+        查找路径对应的路由。
+        所有匹配的规则按具体程度从低到高叠加，更具体的规则覆盖已设置的属性。
+
+        参数:
+            path: 请求路径
+
+        返回:
+            路由查找结果
+        """
+        result = self._cache.get(path)
+        if result is not None:
+            return result
+        result = self._resolve(path)
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[path] = result
+        return result
+
+    def _resolve(self, path: str) -> RouteMatch:
+        matches: List[Tuple[RouteRule, Dict[str, str], Optional[List[str]]]] = []
+        self._collect(self._root, path.split("/")[1:], 0, {}, matches)
+        result = RouteMatch()
+        if not matches:
+            return result
+        matches.sort(key=lambda match: match[0].specificity)
+        for rule, captures, rest in matches:
+            if rule.service is not _UNSET:
+                service = rule.service
+                if service.startswith("{") and service.endswith("}"):
+                    service = captures.get(service[1:-1])
+                result.service = service or None
+                upstream_path = "/" + "/".join(rest) if rest is not None else ""
+                result.upstream_path = (rule.upstream_prefix + upstream_path) or "/"
+            if rule.auth is not _UNSET:
+                result.auth_required = bool(rule.auth)
+            if rule.rate_limit is not _UNSET:
+                result.rate_limit = rule.rate_limit or None
+            if rule.priority is not _UNSET:
+                result.priority = int(rule.priority)
+            if rule.dedup is not _UNSET:
+                result.dedup = bool(rule.dedup)
+            if rule.max_body_size is not _UNSET:
+                result.max_body_size = int(rule.max_body_size)
+        return result
+
+
+def build_rules(config: Optional[Settings] = None) -> List[RouteRule]:
+    """
+    根据配置生成路由规则，config 默认为当前配置：
+    - /api/{service}/** 转发到对应服务，/api/auth/** 由网关本地处理
+    - WHITELIST_PATHS 中的路径不需要认证，也不参与限流
+    - RATE_LIMIT_EXCLUDE_PATHS 中的路径不参与限流
+    - ROUTES 中的自定义规则
+    """
+    if config is None:
+        config = settings
+    rules = [
+        RouteRule("/api/{service}/**", service="{service}"),
+        RouteRule("/api/auth/**", service=""),
+    ]
+    rules.extend(RouteRule(path, auth=False, rate_limit=None) for path in config.WHITELIST_PATHS)
+    rules.extend(RouteRule(path, rate_limit=None) for path in config.RATE_LIMIT_EXCLUDE_PATHS)
+    rules.extend(RouteRule.from_dict(route) for route in config.ROUTES)
+    return rules
+
+
+# 创建全局路由表（启动时编译一次）
+router = Router(build_rules())
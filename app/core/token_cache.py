@@ -0,0 +1,129 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+# 每个缓存条目除令牌本身外的估算内存开销（摘要、字典节点、声明对象等）
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class TokenCache:
+    """
+    已验证JWT声明的有界LRU缓存。
+    以令牌的SHA-256摘要为键，条目在令牌过期时间(exp)与配置TTL中较早者失效。
+    同时限制条目数和估算内存占用，密钥变化时自动清空。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # 摘要 -> (失效时间, 声明, 估算大小)
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._secret: Optional[Tuple[str, str]] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def bind_secret(self, secret_key: str, algorithm: str) -> None:
+        """
+        绑定当前签名密钥。
+        密钥或算法与缓存建立时不同（例如 SECRET_KEY 轮换）时清空所有条目。
+        """
+        secret = (secret_key, algorithm)
+        if secret != self._secret:
+            with self._lock:
+                if secret != self._secret:
+                    self._clear_locked()
+                    self._secret = secret
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        查找令牌对应的已验证声明。
+
+        参数:
+            token: JWT令牌
+
+        返回:
+            声明的副本；未命中或已失效时返回None
+        """
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, claims, size = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(claims)
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        """
+        缓存已验证的声明。
+
+        参数:
+            token: JWT令牌
+            claims: 解码后的声明
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= now:
+            return
+
+        key = self._key(token)
+        size = len(token) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (expires_at, dict(claims), size)
+            self._bytes += size
+            # 超出条目数或内存上限时淘汰最久未使用的条目
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 创建全局JWT缓存实例
+token_cache = TokenCache(
+    max_entries=settings.JWT_CACHE_MAX_ENTRIES,
+    max_bytes=settings.JWT_CACHE_MAX_BYTES,
+    ttl=settings.JWT_CACHE_TTL,
+)
@@ -0,0 +1,133 @@
+import random
+import re
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from app.core.config import settings
+
+# 版本-trace_id-父span_id-标志，更高的版本可以在末尾追加字段
+_TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+
+# httpcore 连接事件 -> 请求阶段
+_UPSTREAM_EVENTS = {
+    "connect_tcp": "connect",
+    "connect_unix_socket": "connect",
+    "start_tls": "connect",
+    "send_request_headers": "send",
+    "send_request_body": "send",
+    "receive_response_headers": "upstream",
+}
+
+
+class Trace:
+    """
+    单个请求的追踪信息。
+    trace_id 沿用客户端 traceparent 中的值（没有时新建），span_id 为网关这一跳的标识；
+    只有被采样的请求记录各阶段耗时，未采样的请求只生成向后端传递的 traceparent。
+    """
+
+    __slots__ = ("trace_id", "span_id", "sampled", "started", "mark", "stages")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64) or 1:016x}"
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        # 收到后端响应头的时间，响应开始发送时据此计算重建响应的耗时
+        self.mark = 0.0
+        # 阶段名称 -> 累计耗时（秒），重试和对冲的多次尝试累加到同一阶段
+        self.stages: Dict[str, float] = {}
+
+    @property
+    def traceparent(self) -> str:
+        """转发给后端的 traceparent，父span为网关"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def add(self, stage: str, started: float, finished: Optional[float] = None) -> None:
+        """
+        记录一个阶段的耗时（未采样的请求不记录）。
+
+        参数:
+            stage: 阶段名称
+            started: 阶段开始时间（time.perf_counter）
+            finished: 阶段结束时间，默认为当前时间
+        """
+        if not self.sampled:
+            return
+        if finished is None:
+            finished = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + finished - started
+
+    def server_timing(self, now: float) -> bytes:
+        """到 now 为止各阶段耗时的 Server-Timing 头（毫秒）"""
+        parts = [f"{stage};dur={duration * 1000:.3f}" for stage, duration in self.stages.items()]
+        parts.append(f"total;dur={(now - self.started) * 1000:.3f}")
+        return ", ".join(parts).encode("latin-1")
+
+    def summary(self) -> str:
+        """各阶段耗时的日志文本（毫秒）"""
+        return " ".join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in self.stages.items())
+
+
+class UpstreamTrace:
+    """
+    httpcore 的 trace 扩展回调，把一次后端请求拆分为
+    等待连接池（pool）、建立连接（connect）、发送请求（send）和等待响应头（upstream）几个阶段。
+    连接池等待没有单独的事件，取请求开始到第一个连接事件之间的时间。
+    """
+
+    __slots__ = ("trace", "started", "pending")
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.pending: Dict[str, float] = {}
+
+    async def __call__(self, event: str, info: Dict[str, Any]) -> None:
+        now = time.perf_counter()
+        if self.started:
+            self.trace.add("pool", self.started, now)
+            self.started = 0.0
+        operation, _, phase = event.rpartition(".")
+        operation = operation.rpartition(".")[2]
+        stage = _UPSTREAM_EVENTS.get(operation)
+        if stage is None:
+            return
+        if phase == "started":
+            self.pending[operation] = now
+        else:
+            started = self.pending.pop(operation, None)
+            if started is not None:
+                self.trace.add(stage, started, now)
+
+
+def _parse_traceparent(value: str) -> Optional[Tuple[str, bool]]:
+    """解析 traceparent，返回 (trace_id, 是否采样)，格式无效时返回None"""
+    match = _TRACEPARENT.match(value.strip())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, bool(int(flags, 16) & 1)
+
+
+def start_trace(headers: Mapping[str, str]) -> Optional[Trace]:
+    """
+    为请求创建追踪信息。
+    客户端携带有效的 traceparent 时沿用其 trace_id 和采样决定，否则按 TRACING_SAMPLE_RATE 采样。
+
+    参数:
+        headers: 请求头（名称为小写）
+
+    返回:
+        追踪信息，未启用追踪时为None
+    """
+    if not settings.TRACING_ENABLED:
+        return None
+    traceparent = headers.get("traceparent")
+    parsed = _parse_traceparent(traceparent) if traceparent else None
+    if parsed is not None:
+        return Trace(*parsed)
+    sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    return Trace(f"{random.getrandbits(128) or 1:032x}", sampled)
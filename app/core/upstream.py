@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.utils.logger import logger
+
+
+class UpstreamClientManager:
+    """
+    上游HTTP客户端管理器。
+    为每个后端服务维护一个在应用生命周期内复用的 httpx.AsyncClient，
+    避免每次转发都重新建立TCP/TLS连接。
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # 配置热加载后被移除、仍在等待进行中请求完成的客户端
+        self._retiring: Dict[str, httpx.AsyncClient] = {}
+        # 创建客户端时使用的连接池配置，变化时需要重建客户端
+        self._options: Optional[Tuple] = None
+
+    @staticmethod
+    def _client_options() -> Tuple:
+        return (
+            settings.UPSTREAM_MAX_CONNECTIONS,
+            settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            settings.UPSTREAM_KEEPALIVE_EXPIRY,
+            settings.UPSTREAM_HTTP2,
+        )
+
+    def _build_timeout(self, service_name: str) -> httpx.Timeout:
+        """
+        构建指定服务的超时配置。
+        UPSTREAM_SERVICE_TIMEOUTS 中的配置会覆盖全局默认值。
+
+        参数:
+            service_name: 服务名称
+
+        返回:
+            超时配置
+        """
+        overrides = settings.UPSTREAM_SERVICE_TIMEOUTS.get(service_name, {})
+        return httpx.Timeout(
+            connect=overrides.get("connect", settings.UPSTREAM_CONNECT_TIMEOUT),
+            read=overrides.get("read", settings.UPSTREAM_READ_TIMEOUT),
+            write=overrides.get("write", settings.UPSTREAM_WRITE_TIMEOUT),
+            pool=overrides.get("pool", settings.UPSTREAM_POOL_TIMEOUT),
+        )
+
+    def _http2_enabled(self) -> bool:
+        """检查是否可以启用HTTP/2（h2为可选依赖）"""
+        if not settings.UPSTREAM_HTTP2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("已配置 UPSTREAM_HTTP2，但未安装 h2，回退到HTTP/1.1。请安装 httpx[http2]")
+            return False
+        return True
+
+    def _create_client(self, service_name: str) -> httpx.AsyncClient:
+        """为指定服务创建带连接池的客户端"""
+        self._options = self._client_options()
+        limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        return httpx.AsyncClient(
+            timeout=self._build_timeout(service_name),
+            limits=limits,
+            http2=self._http2_enabled(),
+        )
+
+    async def startup(self) -> None:
+        """应用启动时为所有已配置的后端服务创建客户端"""
+        for service_name in settings.BACKEND_SERVICES:
+            if service_name not in self._clients:
+                self._clients[service_name] = self._create_client(service_name)
+        logger.info("上游连接池已初始化: %s", list(self._clients))
+
+    def reconfigure(self) -> List[httpx.AsyncClient]:
+        """
+        按当前配置同步客户端（配置热加载）：
+        新增的服务创建客户端，已有服务更新超时配置；连接池配置变化时重建所有客户端。
+
+        返回:
+            需要排空后关闭的旧客户端
+        """
+        services = settings.BACKEND_SERVICES
+        retired = []
+        rebuild = self._options is not None and self._options != self._client_options()
+        for service_name in list(self._clients):
+            if service_name not in services:
+                client = self._retiring[service_name] = self._clients.pop(service_name)
+                retired.append(client)
+            elif rebuild:
+                retired.append(self._clients.pop(service_name))
+        for service_name in services:
+            self._retiring.pop(service_name, None)
+            client = self._clients.get(service_name)
+            if client is None:
+                self._clients[service_name] = self._create_client(service_name)
+            else:
+                client.timeout = self._build_timeout(service_name)
+        return retired
+
+    async def drain(self, client: httpx.AsyncClient, timeout: float) -> None:
+        """
+        等待客户端上进行中的请求完成（最多 timeout 秒）后关闭客户端。
+
+        参数:
+            client: reconfigure() 返回的旧客户端
+            timeout: 最长等待时间（秒）
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                # 先等待一小段时间，让替换前已取得客户端的请求建立连接
+                await asyncio.sleep(min(0.5, timeout))
+                usage = _connection_usage(client)
+                if (usage is not None and usage[0] == 0) or time.monotonic() >= deadline:
+                    break
+        finally:
+            for service_name, retiring in list(self._retiring.items()):
+                if retiring is client:
+                    del self._retiring[service_name]
+            await client.aclose()
+
+    async def shutdown(self) -> None:
+        """应用关闭时关闭所有客户端并释放连接"""
+        clients = list(self._clients.values()) + list(self._retiring.values())
+        self._clients.clear()
+        self._retiring.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+        logger.info("上游连接池已关闭")
+
+    def get(self, service_name: str) -> httpx.AsyncClient:
+        """
+        获取指定服务的客户端。
+        如果应用未经过生命周期启动（例如直接挂载中间件），则按需创建。
+
+        参数:
+            service_name: 服务名称
+
+        返回:
+            该服务共享的 httpx.AsyncClient
+        """
+        client = self._clients.get(service_name)
+        if client is None:
+            # 服务已在配置热加载中移除，进行中的请求继续使用排空中的客户端
+            client = self._retiring.get(service_name)
+            if client is not None:
+                return client
+            client = self._create_client(service_name)
+            self._clients[service_name] = client
+        return client
+
+    def pool_usage(self) -> Dict[str, Tuple[int, int]]:
+        """
+        各服务连接池的使用情况，用于监控指标。
+
+        返回:
+            服务名称 -> (使用中的连接数, 空闲连接数)
+        """
+        usage: Dict[str, Tuple[int, int]] = {}
+        for service_name, client in self._clients.items():
+            connections = _connection_usage(client)
+            if connections is not None:
+                usage[service_name] = connections
+        return usage
+
+
+def _connection_usage(client: httpx.AsyncClient) -> Optional[Tuple[int, int]]:
+    """客户端连接池中 (使用中的连接数, 空闲连接数)"""
+    # httpx 未公开连接池对象，取不到时返回None（例如使用了自定义传输层）
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return len(connections) - idle, idle
+
+
+# 创建全局上游客户端管理器实例
+upstream_clients = UpstreamClientManager()
@@ -1,16 +1,48 @@
-from fastapi import FastAPI, Response, status
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import httpx
 import platform
 import json
 
+from app.core.auth import user_scopes
 from app.core.config import settings
-from app.middlewares.auth import AuthMiddleware
-from app.middlewares.proxy import ProxyMiddleware
-from app.middlewares.rate_limit import RateLimitMiddleware
+from app.core.dedup_cache import dedup_cache
+from app.core.health import health_checker
+from app.core.metrics import metrics
+from app.core.profiler import ProfilerBusy, profiler
+from app.core.rate_limit_storage import rate_limit_storage
+from app.core.reload import config_reloader
+from app.core.upstream import upstream_clients
+from app.middlewares.gateway import GatewayMiddleware
 from app.utils.logger import logger
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建上游连接池和后台任务，关闭时释放"""
+    await upstream_clients.startup()
+    await rate_limit_storage.start()
+    if settings.HEALTH_CHECK_ENABLED:
+        health_checker.start()
+    metrics.start()
+    config_reloader.start()
+    try:
+        yield
+    finally:
+        await config_reloader.stop()
+        await metrics.stop()
+        await health_checker.stop()
+        await rate_limit_storage.stop()
+        await upstream_clients.shutdown()
+        dedup_cache.close()
+
+
+# 系统信息在启动时获取一次
+SYSTEM_INFO = f"{platform.system()} {platform.version()}"
+
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.APP_NAME,
@@ -18,6 +50,7 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # 添加CORS中间件
@@ -29,14 +62,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 添加流量控制中间件（最后添加，最先执行）
-app.add_middleware(RateLimitMiddleware)
-
-# 添加代理中间件 (最后添加的先执行)
-app.add_middleware(ProxyMiddleware)
-
-# 添加认证中间件
-app.add_middleware(AuthMiddleware)
+# 添加网关管道：认证 → 流量控制 → 代理（最后添加的先执行）
+app.add_middleware(GatewayMiddleware)
 
 @app.get("/")
 async def root():
@@ -50,25 +77,13 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """健康检查端点"""
+    """健康检查端点，直接返回后台健康检查缓存的状态"""
     health_status = {
         "gateway": "healthy",
-        "system": f"{platform.system()} {platform.version()}",
-        "backends": {}
+        "system": SYSTEM_INFO,
+        "backends": health_checker.snapshot(),
     }
     
-    # 检查所有后端服务的健康状态
-    for service_name, service_url in settings.BACKEND_SERVICES.items():
-        try:
-            async with httpx.AsyncClient(timeout=3.0) as client:
-                response = await client.get(f"{service_url}/health", timeout=3.0)
-                if response.status_code == 200:
-                    health_status["backends"][service_name] = "healthy"
-                else:
-                    health_status["backends"][service_name] = f"unhealthy - status code: {response.status_code}"
-        except Exception as e:
-            health_status["backends"][service_name] = f"unhealthy - error: {str(e)}"
-    
     # 如果任何后端服务不健康，设置响应状态码为503
     if any("unhealthy" in status for status in health_status["backends"].values()):
         return JSONResponse(
@@ -78,9 +93,41 @@ async def health():
     
     return health_status
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus格式的监控指标"""
+    return Response(
+        content=metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@app.get("/admin/profile")
+async def profile(request: Request, seconds: float = 10.0):
+    """
+    对处理本请求的工作进程采样 seconds 秒，返回折叠栈格式的分析结果，
+    可以直接交给 flamegraph.pl 或 speedscope 生成火焰图。需要 ADMIN_SCOPE 权限。
+    """
+    user = getattr(request.state, "user", None)
+    if settings.ADMIN_SCOPE not in user_scopes(user):
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": "需要管理员权限"})
+    if not 0 < seconds <= settings.PROFILER_MAX_SECONDS:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"detail": f"seconds 必须在 0 到 {settings.PROFILER_MAX_SECONDS} 之间"},
+        )
+    try:
+        folded, samples = await profiler.profile(seconds)
+    except ProfilerBusy:
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": "已有分析正在进行"})
+    return Response(
+        content=folded,
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(samples)},
+    )
+
 if __name__ == "__main__":
-    # 打印所有路由
+    # 开发模式：单进程，代码修改后自动重启；生产环境使用 python main.py（见 app/server.py）
 
     import uvicorn
-    logger.info(f"Starting {settings.APP_NAME}")
+    logger.info("Starting %s", settings.APP_NAME)
     uvicorn.run("app.main:app", host="0.0.0.0", port=10001, reload=True) 
\ No newline at end of file
@@ -1,61 +1,106 @@
-from fastapi import Request, Response, status
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
 from jose import JWTError
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from app.core.config import settings
 from app.core.auth import decode_access_token
-from app.utils.logger import logger
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.middlewares.context import GatewayContext, get_context
+from app.middlewares.websocket import reject
+from app.utils.logger import logger as base_logger
+
+logger = base_logger.get_child("auth")
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
     """
     认证中间件，用于验证请求的JWT令牌。
     白名单路径将被跳过认证检查。
+    WebSocket握手使用相同的认证逻辑；浏览器无法为WebSocket设置请求头，
+    因此也接受 WEBSOCKET_TOKEN_QUERY_PARAM 查询参数中的令牌。
+    以纯ASGI方式实现，直接处理 scope/receive/send。
     """
-    
-    async def dispatch(self, request: Request, call_next):
-        if request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # 检查路径是否在白名单中
-        path = request.url.path
-        if path in settings.WHITELIST_PATHS:
-            return await call_next(request)
-            
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def _query_token(context: GatewayContext) -> Optional[str]:
+        """从WebSocket握手的查询参数中取出令牌，转换为Authorization头的格式"""
+        param = settings.WEBSOCKET_TOKEN_QUERY_PARAM
+        if not param or not context.query_string:
+            return None
+        for key, value in parse_qsl(context.query_string.decode("latin-1")):
+            if key == param and value:
+                return f"Bearer {value}"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        context = get_context(scope)
+        if context.method == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        # 检查路由是否需要认证（白名单路径不需要）
+        if not context.route.auth_required:
+            await self.app(scope, receive, send)
+            return
+
         # 从请求头中获取Authorization
-        authorization = request.headers.get("Authorization")
-        logger.info(f"Authorization: {authorization}")
+        authorization = context.headers.get("authorization")
+        if authorization is None and scope["type"] == "websocket":
+            authorization = self._query_token(context)
         if not authorization or not authorization.startswith("Bearer "):
-            return JSONResponse(
+            metrics.record_auth_failure("missing")
+            response = JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"detail": "未提供有效的认证凭证"},
                 headers={"WWW-Authenticate": "Bearer"}
             )
-        
+            await reject(scope, receive, send, response)
+            return
+
         # 提取并验证JWT令牌
         token = authorization.replace("Bearer ", "")
+        started = time.perf_counter()
         try:
             # 解码JWT获取用户数据
             payload = decode_access_token(token)
-            
-            # 将用户信息添加到请求状态中，以便后续使用
-            request.state.user = payload
-            logger.info(f"Authenticated user: {payload.get('sub')}")
-            
-            # 继续处理请求
-            return await call_next(request)
-            
-        except JWTError as e:
-            logger.error(f"JWT验证失败: {str(e)}")
-            return JSONResponse(
+        except (JWTError, HTTPException) as e:
+            logger.warning("JWT验证失败: %s", e)
+            metrics.record_auth_failure("invalid")
+            response = JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"detail": "无效的认证凭证"},
                 headers={"WWW-Authenticate": "Bearer"}
             )
+            await reject(scope, receive, send, response)
+            return
         except Exception as e:
-            logger.error(f"认证过程中出现错误: {str(e)}")
-            return JSONResponse(
+            logger.error("认证过程中出现错误: %s", e, exc_info=True)
+            metrics.record_auth_failure("error")
+            response = JSONResponse(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 content={"detail": "认证过程中出现错误"}
-            ) 
\ No newline at end of file
+            )
+            await reject(scope, receive, send, response)
+            return
+
+        if context.trace is not None:
+            context.trace.add("auth", started)
+
+        # 将用户信息添加到请求上下文中，以便后续使用
+        context.set_user(payload)
+        logger.debug("Authenticated user: %s", payload.get("sub"))
+
+        # 继续处理请求
+        await self.app(scope, receive, send)
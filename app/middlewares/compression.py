@@ -0,0 +1,177 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.compression import (
+    Compressor,
+    available_encodings,
+    create_compressor,
+    is_compressible,
+    negotiate,
+)
+from app.core.config import settings
+from app.middlewares.context import get_context
+
+# 这些状态码的响应没有响应体或不能改变编码
+_SKIP_STATUS_CODES = {204, 206, 304}
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件，按 Accept-Encoding 协商 zstd / br / gzip。
+    - 后端已经编码过的响应、不可压缩的内容类型、声明了 no-transform 的响应原样返回
+    - 一次性返回的响应体小于 COMPRESSION_MIN_SIZE 时不压缩
+    - 流式响应逐块压缩并立即刷新，SSE事件不会被压缩器缓冲
+    - 超过 COMPRESSION_THREAD_THRESHOLD 的数据块在线程池中压缩，不阻塞事件循环
+    以纯ASGI方式实现，直接处理 scope/receive/send。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._configured: Optional[List[str]] = None
+        self._encodings: List[str] = []
+
+    @property
+    def encodings(self) -> List[str]:
+        """可用的编码；配置热加载替换了 COMPRESSION_ENCODINGS 时重新检查"""
+        configured = settings.COMPRESSION_ENCODINGS
+        if configured is not self._configured:
+            self._encodings = available_encodings(configured)
+            self._configured = configured
+        return self._encodings
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        encodings = self.encodings
+        if not encodings:
+            await self.app(scope, receive, send)
+            return
+
+        context = get_context(scope)
+        encoding = negotiate(context.headers.get("accept-encoding", ""), encodings)
+        if encoding is None or context.method == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingSend(send, encoding)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingSend:
+    """包装 send，决定是否压缩并对响应体增量压缩"""
+
+    __slots__ = ("send", "encoding", "start", "compressor", "passthrough")
+
+    def __init__(self, send: Send, encoding: str):
+        self.send = send
+        self.encoding = encoding
+        # 响应头暂存到第一个响应体消息，以便根据响应体大小决定是否压缩
+        self.start: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            if self._should_compress(message):
+                self.start = message
+            else:
+                self.passthrough = True
+                await self.send(message)
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is not None:
+            data = await self._compress(body, finish=not more_body) if body or not more_body else b""
+            if data or not more_body:
+                await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        start, self.start = self.start, None
+        if start is None:
+            await self.send(message)
+            return
+        if not more_body and len(body) < settings.COMPRESSION_MIN_SIZE:
+            # 完整的响应体太小，压缩得不偿失
+            self.passthrough = True
+            await self.send(start)
+            await self.send(message)
+            return
+
+        self.compressor = create_compressor(self.encoding)
+        if more_body:
+            data = await self._compress(body) if body else b""
+            headers = self._compressed_headers(start["headers"], None)
+        else:
+            data = await self._compress(body, finish=True)
+            headers = self._compressed_headers(start["headers"], len(data))
+        await self.send({**start, "headers": headers})
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _should_compress(self, message: Message) -> bool:
+        if message["status"] < 200 or message["status"] in _SKIP_STATUS_CODES:
+            return False
+        content_type = ""
+        for key, value in message.get("headers", []):
+            key = key.lower()
+            if key == b"content-encoding":
+                # 后端已经压缩过（或声明了 identity 以外的编码），原样返回
+                return False
+            if key == b"cache-control" and b"no-transform" in value.lower():
+                return False
+            if key == b"content-type":
+                content_type = value.decode("latin-1")
+        return is_compressible(content_type, settings.COMPRESSION_CONTENT_TYPES)
+
+    def _compressed_headers(
+        self,
+        headers: List[Tuple[bytes, bytes]],
+        content_length: Optional[int],
+    ) -> List[Tuple[bytes, bytes]]:
+        """
+        压缩后的响应头：替换 Content-Length，加上 Content-Encoding 和 Vary，
+        强ETag改为弱ETag（压缩后的字节与原始表示不同）。
+
+        参数:
+            headers: 原始响应头
+            content_length: 压缩后的长度，流式响应为None
+        """
+        result = []
+        vary = b"Accept-Encoding"
+        for key, value in headers:
+            lower = key.lower()
+            if lower == b"content-length":
+                continue
+            if lower == b"vary":
+                if b"accept-encoding" not in value.lower() and value.strip() != b"*":
+                    vary = value + b", Accept-Encoding"
+                else:
+                    vary = value
+                continue
+            if lower == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            result.append((key, value))
+        result.append((b"content-encoding", self.encoding.encode("latin-1")))
+        result.append((b"vary", vary))
+        if content_length is not None:
+            result.append((b"content-length", str(content_length).encode("latin-1")))
+        return result
+
+    async def _compress(self, data: bytes, finish: bool = False) -> bytes:
+        """压缩一块数据；数据较大时在线程池中执行（zlib、brotli 和 zstd 压缩时都会释放GIL）"""
+        compressor = self.compressor
+        if len(data) < settings.COMPRESSION_THREAD_THRESHOLD:
+            output = compressor.compress(data) if data else b""
+            return output + compressor.finish() if finish else output
+        loop = asyncio.get_running_loop()
+        output = await loop.run_in_executor(None, compressor.compress, data)
+        return output + compressor.finish() if finish else output
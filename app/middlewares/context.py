@@ -0,0 +1,86 @@
+from typing import Any, Dict, Optional
+
+from starlette.types import Scope
+
+from app.core.load_balancer import UpstreamPool, upstream_pools
+from app.core.router import RouteMatch, router
+from app.core.tracing import Trace, start_trace
+
+
+class GatewayContext:
+    """
+    单个请求在网关各阶段之间共享的上下文。
+    请求头和路由在进入网关时只解析一次，认证、流量控制和代理阶段直接复用。
+    路由和目标实例池在进入网关时一起确定，处理途中配置热加载不会影响这个请求。
+    """
+
+    __slots__ = (
+        "scope",
+        "method",
+        "path",
+        "query_string",
+        "headers",
+        "client_ip",
+        "route",
+        "pool",
+        "user",
+        "rate_limit_info",
+        "upstream_time",
+        "trace",
+    )
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.method: str = scope.get("method", "GET")
+        self.path: str = scope["path"]
+        self.query_string: bytes = scope.get("query_string", b"")
+        # 请求头名称统一为小写；重复的请求头以最后一个为准
+        self.headers: Dict[str, str] = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        client = scope.get("client")
+        self.client_ip: str = client[0] if client else "unknown"
+        # 一次查找得到目标服务、后端路径、认证要求和限流策略
+        self.route: RouteMatch = router.resolve(self.path)
+        # 目标服务的实例池，服务未配置或由网关本地处理时为None
+        self.pool: Optional[UpstreamPool] = (
+            upstream_pools.get(self.route.service) if self.route.service is not None else None
+        )
+        self.user: Optional[Dict[str, Any]] = None
+        self.rate_limit_info: Optional[Dict[str, int]] = None
+        # 后端返回响应头的耗时（秒），未转发到后端时为0
+        self.upstream_time = 0.0
+        # 请求的追踪信息，未启用追踪时为None
+        self.trace: Optional[Trace] = start_trace(self.headers)
+
+    def set_user(self, user: Dict[str, Any]) -> None:
+        """
+        记录已认证的用户信息。
+        同时写入 scope["state"]，使后续路由仍可通过 request.state.user 获取。
+        """
+        self.user = user
+        self.scope.setdefault("state", {})["user"] = user
+
+    def set_rate_limit_info(self, info: Dict[str, int]) -> None:
+        """记录限流信息，同时写入 scope["state"] 供后续路由使用"""
+        self.rate_limit_info = info
+        self.scope.setdefault("state", {})["rate_limit_info"] = info
+
+
+def get_context(scope: Scope) -> GatewayContext:
+    """
+    获取请求的网关上下文。
+    如果某个阶段被单独挂载（未经过 GatewayMiddleware），则按需创建。
+
+    参数:
+        scope: ASGI scope
+
+    返回:
+        网关上下文
+    """
+    context = scope.get("gateway")
+    if context is None:
+        context = GatewayContext(scope)
+        scope["gateway"] = context
+    return context
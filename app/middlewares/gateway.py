@@ -0,0 +1,104 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import LOCAL_SERVICE, UNKNOWN_SERVICE, metrics
+from app.core.tracing import Trace
+from app.middlewares.auth import AuthMiddleware
+from app.middlewares.compression import CompressionMiddleware
+from app.middlewares.context import GatewayContext
+from app.middlewares.proxy import ProxyMiddleware
+from app.middlewares.rate_limit import RateLimitMiddleware
+from app.middlewares.websocket import WebSocketProxyMiddleware
+from app.utils.logger import logger as base_logger
+
+logger = base_logger.get_child("tracing")
+
+
+class GatewayMiddleware:
+    """
+    网关请求处理管道。
+    在启动时一次性组装 认证 → 流量控制 → WebSocket代理 → 响应压缩 → 代理 五个纯ASGI阶段，
+    每个请求只创建一次网关上下文，请求头在各阶段之间共享。
+    同时按服务记录HTTP请求数、耗时和正在处理的请求数（WebSocket连接数由WebSocket代理阶段记录），
+    被采样的请求额外记录各阶段耗时，按配置返回 Server-Timing 头。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.pipeline = AuthMiddleware(
+            RateLimitMiddleware(WebSocketProxyMiddleware(CompressionMiddleware(ProxyMiddleware(app))))
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        context = GatewayContext(scope)
+        scope["gateway"] = context
+        trace = context.trace if context.trace is not None and context.trace.sampled else None
+        if scope["type"] == "websocket" or not (settings.METRICS_ENABLED or trace is not None):
+            await self.pipeline(scope, receive, send)
+            return
+
+        service = None
+        if settings.METRICS_ENABLED:
+            service_name = context.route.service
+            if service_name is None:
+                service_name = LOCAL_SERVICE
+            elif context.pool is None:
+                service_name = UNKNOWN_SERVICE
+            service = metrics.service(service_name)
+
+        status_code = 500
+        first_byte = 0.0
+        started = time.perf_counter()
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code, first_byte
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte = time.perf_counter()
+                if trace is not None:
+                    if trace.mark:
+                        # 收到后端响应头到开始返回响应之间：重建响应头、缓冲和压缩
+                        trace.add("response", trace.mark, first_byte)
+                    if settings.TRACING_SERVER_TIMING:
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"server-timing", trace.server_timing(first_byte)),
+                        ]
+            await send(message)
+
+        if service is not None:
+            service.in_flight += 1
+        try:
+            await self.pipeline(scope, receive, send_with_metrics)
+        finally:
+            finished = time.perf_counter()
+            if service is not None:
+                service.in_flight -= 1
+                service.observe(
+                    status_code,
+                    finished - started,
+                    context.upstream_time,
+                    (first_byte or finished) - started - context.upstream_time,
+                )
+            if trace is not None:
+                self._finish_trace(context, trace, status_code, first_byte, finished)
+
+    @staticmethod
+    def _finish_trace(context: GatewayContext, trace: Trace, status_code: int, first_byte: float, finished: float) -> None:
+        """记录被采样请求的阶段耗时，慢请求输出各阶段耗时"""
+        if first_byte:
+            trace.add("transfer", first_byte, finished)
+        if settings.METRICS_ENABLED:
+            metrics.record_stages(trace.stages)
+        duration = finished - trace.started
+        threshold = settings.TRACING_SLOW_THRESHOLD
+        if threshold and duration >= threshold:
+            logger.warning(
+                "慢请求 %s %s -> %d, 耗时 %.1fms, trace_id=%s: %s",
+                context.method, context.path, status_code, duration * 1000, trace.trace_id, trace.summary(),
+            )
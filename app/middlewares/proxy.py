@@ -1,135 +1,855 @@
+import asyncio
 import httpx
-import platform
-import traceback
-from fastapi import Request, Response, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse
+import os
+import tempfile
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from fastapi import Response, status
+from starlette.types import ASGIApp, Receive, Scope, Send
 
+from app.core.concurrency import ConcurrencyLimitExceeded
 from app.core.config import settings
-from app.utils.logger import logger
+from app.core.dedup_cache import StoredResponse, dedup_cache
+from app.core.load_balancer import Endpoint, UpstreamPool
+from app.core.metrics import metrics
+from app.core.resilience import IDEMPOTENT_METHODS, ServiceResilience, resilience
+from app.core.response_cache import (
+    NOT_MODIFIED_HEADERS,
+    CachedResponse,
+    etag_matches,
+    parse_cache_control,
+    response_cache,
+)
+from app.core.tracing import Trace, UpstreamTrace
+from app.core.upstream import upstream_clients
+from app.middlewares.context import GatewayContext, get_context
+from app.utils.logger import logger as base_logger
 
+logger = base_logger.get_child("proxy")
 
-class ProxyMiddleware(BaseHTTPMiddleware):
+# 逐跳头只对单个连接有效，不应转发给客户端
+HOP_BY_HOP_HEADERS = {
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+}
+
+
+def build_upstream_headers(context: GatewayContext) -> Dict[str, str]:
+    """
+    基于已解析的请求头构建转发给后端的请求头。
+
+    参数:
+        context: 请求的网关上下文
+
+    返回:
+        转发的请求头
+    """
+    headers = dict(context.headers)
+    # 移除主机相关头，避免冲突
+    headers.pop("host", None)
+
+    # 如果请求上下文中有用户信息，添加到自定义请求头
+    user = context.user
+    if user is not None:
+        # 将用户ID添加到自定义请求头
+        if "sub" in user:
+            headers["X-User-ID"] = str(user["sub"])
+
+        # 可以添加更多用户信息到请求头
+        # 例如，如果payload中有角色信息
+        if "scopes" in user:
+            headers["X-User-Scopes"] = str(user["scopes"])
+
+    # 网关作为一跳加入调用链，后端的span以网关为父节点；tracestate 原样转发
+    if context.trace is not None:
+        headers["traceparent"] = context.trace.traceparent
+    return headers
+
+
+class ClientDisconnect(Exception):
+    """客户端在请求体发送完成前断开连接"""
+
+
+class RequestBodyTooLarge(Exception):
+    """请求体超过大小上限"""
+
+
+class _LimitedReceive:
+    """读取请求体时累计大小，超过上限立即抛出 RequestBodyTooLarge，不再继续接收"""
+
+    __slots__ = ("receive", "limit", "size")
+
+    def __init__(self, receive: Receive, limit: int):
+        self.receive = receive
+        self.limit = limit
+        self.size = 0
+
+    async def __call__(self) -> Dict[str, Any]:
+        message = await self.receive()
+        if message["type"] == "http.request":
+            self.size += len(message.get("body", b""))
+            if self.size > self.limit:
+                raise RequestBodyTooLarge(f"请求体超过 {self.limit} 字节")
+        return message
+
+
+class _SpooledBody:
+    """
+    缓冲的请求体：不超过阈值时保存在内存中，超过后整体写入临时文件。
+    写入文件后作为异步可迭代对象交给httpx，每次迭代都从头按块读取文件（pread 不共享读位置），
+    因此重试和对冲可以多次、并发地发送同一个请求体，而请求体不会再整体读回内存。
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, threshold: int, directory: str):
+        self.threshold = threshold
+        self.directory = directory or None
+        self.size = 0
+        self._chunks: List[bytes] = []
+        self._file = None
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self._file is None:
+            self._chunks.append(chunk)
+            if self.size <= self.threshold:
+                return
+            self._file = tempfile.TemporaryFile(dir=self.directory, prefix="gateway-body-")
+            chunks, self._chunks = self._chunks, []
+            for buffered in chunks:
+                self._file.write(buffered)
+            return
+        self._file.write(chunk)
+
+    def content(self) -> Union[bytes, "_SpooledBody"]:
+        """转发给httpx的请求体：内存中的请求体直接返回字节串"""
+        if self._file is None:
+            return b"".join(self._chunks)
+        self._file.flush()
+        return self
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        fd = self._file.fileno()
+        offset = 0
+        while offset < self.size:
+            chunk = os.pread(fd, self.CHUNK_SIZE, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        """删除临时文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
+
+
+class _ReplayReceive:
+    """先返回已缓冲的请求体，其余部分继续从客户端读取"""
+
+    __slots__ = ("body", "more_body", "receive")
+
+    def __init__(self, body: bytes, more_body: bool, receive: Receive):
+        self.body: Optional[bytes] = body
+        self.more_body = more_body
+        self.receive = receive
+
+    async def __call__(self) -> Dict[str, Any]:
+        if self.body is None:
+            return await self.receive()
+        body, self.body = self.body, None
+        return {"type": "http.request", "body": body, "more_body": self.more_body}
+
+
+class _ResponseCapture:
+    """转发响应的同时记录状态码、响应头和响应体，供去重缓存保存"""
+
+    __slots__ = ("send", "max_bytes", "status", "headers", "chunks", "size", "complete")
+
+    def __init__(self, send: Send, max_bytes: int):
+        self.send = send
+        self.max_bytes = max_bytes
+        self.status = 0
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.complete = False
+
+    async def __call__(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body" and self.size <= self.max_bytes:
+            chunk = message.get("body", b"")
+            self.size += len(chunk)
+            if self.size <= self.max_bytes:
+                self.chunks.append(chunk)
+                self.complete = not message.get("more_body", False)
+            else:
+                # 超过单条上限，不再缓冲
+                self.chunks = []
+        await self.send(message)
+
+    def storable(self, idempotent: bool) -> bool:
+        """
+        响应是否可以保存：内容去重只保存2xx响应；
+        Idempotency-Key 还保存4xx（客户端重试得到同样的结果），但不保存429和5xx等可以重试的失败。
+        """
+        if not self.complete or self.size > self.max_bytes:
+            return False
+        for name, value in self.headers:
+            if name == b"cache-control" and b"no-store" in value.lower():
+                return False
+        if idempotent:
+            return self.status < 500 and self.status not in (408, 409, 425, 429)
+        return 200 <= self.status < 300
+
+
+class ProxyMiddleware:
     """
     代理中间件，用于将请求转发到后端服务。
     路径格式: /api/[service_name]/[endpoint]
     例如: /api/user/profile 将被转发到 user服务的/profile端点
+    以纯ASGI方式实现，直接处理 scope/receive/send。
     """
-    
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        
-        # 如果不是API请求或者没有遵循我们的格式，交给下一个中间件处理
-        if not path.startswith("/api/") or path.count("/") < 3:
-            return await call_next(request)
-        
-        # 解析服务名称
-        _, _, service_name, *rest = path.split("/")
-        
-        # 跳过本地API路由 (auth)
-        if service_name == "auth":
-            return await call_next(request)
-            
-        endpoint = "/" + "/".join(rest)
-        
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = get_context(scope)
+        service_name = context.route.service
+
+        # 路由没有对应的后端服务（非API请求或本地API路由），交给下一个中间件处理
+        if service_name is None:
+            await self.app(scope, receive, send)
+            return
+
         # 检查服务是否在配置中
-        if service_name not in settings.BACKEND_SERVICES:
-            logger.error(f"未找到服务配置: '{service_name}'")
-            return Response(
+        pool = context.pool
+        if pool is None:
+            logger.error("未找到服务配置: '%s'", service_name)
+            response = Response(
                 content=f"Service '{service_name}' not found",
                 status_code=status.HTTP_404_NOT_FOUND
             )
-        
-        # 构建目标URL
-        target_url = f"{settings.BACKEND_SERVICES[service_name]}{endpoint}"
-        
+            await response(scope, receive, send)
+            return
+
+        # 声明的请求体超过上限时不读取请求体，直接拒绝；其余请求在接收过程中累计检查
+        limit = context.route.max_body_size
+        if limit is None:
+            limit = settings.MAX_REQUEST_BODY_SIZE
+        if limit > 0:
+            content_length = context.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                logger.warning("请求体过大，拒绝请求 (%s %s): %s 字节", service_name, context.route.upstream_path, content_length)
+                await self._send_error(
+                    scope, receive, send, False, "Request body too large", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                )
+                return
+            receive = _LimitedReceive(receive, limit)
+
+        # 启用了去重的路由上，POST请求先经过去重缓存
+        if context.route.dedup and settings.DEDUP_CACHE_ENABLED and context.method == "POST":
+            await self._proxy_dedup(context, receive, send, service_name, pool, context.route.upstream_path)
+            return
+
+        # GET请求先经过响应缓存
+        if (
+            settings.RESPONSE_CACHE_ENABLED
+            and context.method == "GET"
+            and "content-length" not in context.headers
+            and "transfer-encoding" not in context.headers
+        ):
+            await self._proxy_cached(context, receive, send, service_name, pool, context.route.upstream_path)
+            return
+
         # 转发请求
-        return await self._proxy_request(request, target_url)
-    
-    async def _proxy_request(self, request: Request, target_url: str):
-        """转发请求到目标URL"""
+        await self._proxy_request(context, receive, send, service_name, pool, context.route.upstream_path)
+
+    async def _proxy_cached(
+        self,
+        context: GatewayContext,
+        receive: Receive,
+        send: Send,
+        service_name: str,
+        pool: UpstreamPool,
+        upstream_path: str,
+    ) -> None:
+        """
+        经过响应缓存转发GET请求。
+        新鲜的条目直接返回；过期条目带 If-None-Match 向后端重新验证；
+        相同请求并发未命中时只转发一次，其余请求等待结果后从缓存返回。
+        """
+        request_cache_control = parse_cache_control(context.headers.get("cache-control", ""))
+        if "no-store" in request_cache_control:
+            await self._proxy_request(context, receive, send, service_name, pool, upstream_path)
+            return
+        # 客户端要求重新验证时不直接使用缓存
+        revalidate = "no-cache" in request_cache_control or request_cache_control.get("max-age") == "0"
+
+        target = upstream_path
+        if context.query_string:
+            target = f"{target}?{context.query_string.decode('latin-1')}"
+        identity = response_cache.identity(context.headers, context.user)
+        now = time.time()
+
+        entry = response_cache.lookup(service_name, target, context.headers, identity)
+        if entry is not None and not revalidate and entry.is_fresh(now):
+            await self._send_cached(context, send, entry, b"HIT")
+            return
+
+        key = response_cache.flight_key(service_name, target, identity)
+        future = response_cache.pending(key)
+        if future is not None:
+            # 相同请求正在转发，等待其结果
+            await future
+            entry = response_cache.lookup(service_name, target, context.headers, identity)
+            if entry is not None and entry.validated_at >= now:
+                await self._send_cached(context, send, entry, b"HIT")
+                return
+            await self._proxy_request(context, receive, send, service_name, pool, upstream_path)
+            return
+
+        response_cache.begin(key)
         try:
-            # 获取请求方法
-            method = request.method
-            
-            # 获取请求头
-            headers = dict(request.headers.items())
-            # 移除主机相关头，避免冲突
-            headers.pop("host", None)
-            
-            # 如果请求状态中有用户信息，添加到自定义请求头
-            if hasattr(request.state, "user"):
-                user = request.state.user
-                # 将用户ID添加到自定义请求头
-                if "sub" in user:
-                    headers["X-User-ID"] = str(user["sub"])
-                    logger.info(f"添加用户ID到请求头: {user['sub']}")
-                
-                # 可以添加更多用户信息到请求头
-                # 例如，如果payload中有角色信息
-                if "scopes" in user:
-                    headers["X-User-Scopes"] = str(user["scopes"])
-            
-            # 获取查询参数
-            params = dict(request.query_params)
-            
-            # 获取请求体
-            body = await request.body()
-            
-            # 记录系统信息和完整的请求信息，帮助调试
-            system_info = f"平台: {platform.system()}, 版本: {platform.version()}"
-            logger.info(f"系统信息: {system_info}")
-            logger.info(f"转发请求到: {target_url}, 方法: {method}, 参数: {params}")
-            
-            # 创建异步HTTP客户端并发送请求
-            timeout = httpx.Timeout(30.0, connect=10.0)  # 增加连接超时时间
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.request(
-                    method=method,
-                    url=target_url,
-                    headers=headers,
-                    params=params,
-                    content=body,
-                    follow_redirects=True
+            await self._proxy_request(
+                context, receive, send, service_name, pool, upstream_path,
+                cache_target=target, cache_identity=identity, cached=entry,
+            )
+        finally:
+            response_cache.finish(key)
+
+    async def _send_cached(self, context: GatewayContext, send: Send, entry: CachedResponse, cache_status: bytes) -> None:
+        """返回缓存的响应；客户端的 If-None-Match 匹配时返回304"""
+        headers = entry.headers + [
+            (b"age", str(entry.age(time.time())).encode("latin-1")),
+            (b"x-cache", cache_status),
+        ]
+        if_none_match = context.headers.get("if-none-match")
+        if if_none_match and entry.etag and etag_matches(if_none_match, entry.etag):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [
+                    (key, value) for key, value in headers
+                    if key in NOT_MODIFIED_HEADERS or key in (b"age", b"x-cache")
+                ],
+            })
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": entry.body, "more_body": False})
+
+    async def _proxy_dedup(
+        self,
+        context: GatewayContext,
+        receive: Receive,
+        send: Send,
+        service_name: str,
+        pool: UpstreamPool,
+        upstream_path: str,
+    ) -> None:
+        """
+        经过去重缓存转发POST请求。
+        内容相同的请求（同一用户、同一路径、规范化后相同的请求体）直接返回保存的2xx响应；
+        携带 Idempotency-Key 的请求按该键保存结果，客户端重试时原样重放，键被用于不同的请求体时返回422。
+        请求体超过 DEDUP_CACHE_MAX_BODY_BYTES 时不去重，直接转发。
+        """
+        if "no-store" in parse_cache_control(context.headers.get("cache-control", "")):
+            await self._proxy_request(context, receive, send, service_name, pool, upstream_path)
+            return
+
+        chunks: List[bytes] = []
+        size = 0
+        more_body = True
+        while more_body and size <= dedup_cache.max_body_bytes:
+            try:
+                message = await receive()
+            except RequestBodyTooLarge as e:
+                logger.warning("请求体过大，拒绝请求 (%s %s): %s", service_name, upstream_path, e)
+                await self._send_error(
+                    context.scope, receive, send, False, "Request body too large", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
                 )
-                
-                logger.info(f"请求成功, 状态码: {response.status_code}")
-                
-                # 创建响应
-                return Response(
-                    content=response.content,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
+                return
+            if message["type"] == "http.disconnect":
+                logger.warning("客户端在请求体发送完成前断开连接 (%s %s)", service_name, upstream_path)
+                return
+            chunk = message.get("body", b"")
+            chunks.append(chunk)
+            size += len(chunk)
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        replay = _ReplayReceive(body, more_body, receive)
+        if size > dedup_cache.max_body_bytes:
+            await self._proxy_request(context, replay, send, service_name, pool, upstream_path)
+            return
+
+        target = upstream_path
+        if context.query_string:
+            target = f"{target}?{context.query_string.decode('latin-1')}"
+        identity = response_cache.identity(context.headers, context.user)
+        fingerprint = dedup_cache.fingerprint(context.method, service_name, target, identity, context.headers, body)
+        idempotency_key = context.headers.get("idempotency-key")
+        key = fingerprint
+        if idempotency_key is not None:
+            key = dedup_cache.idempotency_key(service_name, identity, idempotency_key)
+
+        stored = dedup_cache.get(key)
+        if stored is None:
+            future = dedup_cache.pending(key)
+            if future is not None:
+                if idempotency_key is not None:
+                    # 同一个键的第一个请求还没有结果，不能确定重试是否应该执行
+                    await self._send_error(
+                        context.scope, receive, send, False,
+                        "A request with the same Idempotency-Key is still in progress", status.HTTP_409_CONFLICT,
+                    )
+                    return
+                # 相同请求正在转发，等待其结果
+                await future
+                stored = dedup_cache.get(key)
+                if stored is None:
+                    await self._proxy_request(context, replay, send, service_name, pool, upstream_path)
+                    return
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                await self._send_error(
+                    context.scope, receive, send, False,
+                    "Idempotency-Key was already used with a different request", status.HTTP_422_UNPROCESSABLE_ENTITY,
                 )
-                
-        except httpx.ConnectError as e:
-            error_msg = f"连接错误 ({target_url}): {str(e)}"
-            logger.error(error_msg)
-            logger.error(f"目标服务可能未运行或不可达。系统: {platform.system()}")
-            return Response(
-                content=error_msg,
-                status_code=status.HTTP_502_BAD_GATEWAY
+                return
+            await self._send_stored(send, stored, idempotency_key is not None)
+            return
+
+        capture = _ResponseCapture(send, dedup_cache.max_entry_bytes)
+        dedup_cache.begin(key)
+        try:
+            await self._proxy_request(context, replay, capture, service_name, pool, upstream_path)
+            if capture.storable(idempotency_key is not None):
+                dedup_cache.put(key, fingerprint, capture.status, capture.headers, b"".join(capture.chunks))
+        finally:
+            dedup_cache.finish(key)
+
+    async def _send_stored(self, send: Send, stored: StoredResponse, idempotent: bool) -> None:
+        """返回去重缓存中保存的响应"""
+        headers = stored.headers + [(b"x-cache", b"HIT")]
+        if idempotent:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+        await send({"type": "http.response.body", "body": stored.body, "more_body": False})
+
+    async def _proxy_request(
+        self,
+        context: GatewayContext,
+        receive: Receive,
+        send: Send,
+        service_name: str,
+        pool: UpstreamPool,
+        upstream_path: str,
+        cache_target: Optional[str] = None,
+        cache_identity: Optional[str] = None,
+        cached: Optional[CachedResponse] = None,
+    ) -> None:
+        """
+        从服务实例池中选择实例并转发请求。
+
+        参数:
+            cache_target: 缓存键中的后端路径，非None时尝试缓存响应
+            cache_identity: 请求的身份标识
+            cached: 需要重新验证的过期缓存条目
+        """
+        scope = context.scope
+        trace = context.trace
+        policy = resilience.get(service_name)
+        breaker = policy.breaker if settings.CIRCUIT_BREAKER_ENABLED else None
+        if breaker is not None and not breaker.allow():
+            # 熔断期间快速失败，不再占用连接和协程等待后端超时
+            logger.warning("服务熔断中，拒绝请求: '%s'", service_name)
+            response = Response(
+                content=f"Service '{service_name}' temporarily unavailable",
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(breaker.retry_after())},
             )
-        except httpx.TimeoutException as e:
-            error_msg = f"请求超时 ({target_url}): {str(e)}"
-            logger.error(error_msg)
-            return Response(
-                content=error_msg,
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT
+            await response(scope, receive, send)
+            return
+
+        # 并发达到上限时短暂排队，队列满或排队超时则快速失败，不把积压的请求压到后端
+        limiter = policy.limiter if settings.CONCURRENCY_LIMIT_ENABLED else None
+        if limiter is not None:
+            queued = time.perf_counter()
+            try:
+                await limiter.acquire(context.route.priority)
+                if trace is not None:
+                    trace.add("queue", queued)
+            except BaseException as e:
+                # 请求没有到达后端（被拒绝或排队期间被取消），归还熔断器半开状态的探测名额
+                if breaker is not None:
+                    breaker.record(None, 0.0)
+                if not isinstance(e, ConcurrencyLimitExceeded):
+                    raise
+                logger.warning("服务过载，拒绝请求 (%s): %s", service_name, e)
+                metrics.record_load_shed(service_name, e.reason)
+                response = Response(
+                    content=f"Service '{service_name}' overloaded",
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": "1"},
+                )
+                await response(scope, receive, send)
+                return
+
+        response_started = False
+        success = False
+        # 熔断器记录的结果，None 表示与后端无关
+        outcome: Optional[bool] = False
+        started = time.monotonic()
+        latency = 0.0
+        # 并发限制算法使用的延迟样本，None 表示结果不能反映后端负载
+        limit_sample: Optional[float] = None
+        overloaded = False
+        endpoint: Optional[Endpoint] = None
+        spooled: Optional[_SpooledBody] = None
+        # 保留原始查询字符串（包括重复参数）
+        target = upstream_path
+        if context.query_string:
+            target = f"{target}?{context.query_string.decode('latin-1')}"
+        try:
+            # 获取请求方法
+            method = context.method
+
+            # 获取请求头
+            stage_started = time.perf_counter()
+            headers = build_upstream_headers(context)
+            if cache_target is not None:
+                # 条件请求由网关根据缓存应答，向后端获取完整响应或用缓存的验证器重新验证
+                headers.pop("if-none-match", None)
+                headers.pop("if-modified-since", None)
+                if cached is not None and cached.etag:
+                    headers["if-none-match"] = cached.etag
+            if trace is not None:
+                trace.add("headers", stage_started)
+
+            logger.debug("转发请求到: %s %s, 方法: %s", service_name, target, method)
+
+            # 只有声明了请求体的请求才发送请求体，避免为GET等请求附加分块编码
+            has_body = "content-length" in headers or "transfer-encoding" in headers
+            if not has_body:
+                content = None
+            elif settings.PROXY_STREAMING:
+                # 流式模式下请求体边接收边发送到后端
+                content = self._iter_request_body(receive)
+            else:
+                # 缓冲的请求体超过阈值时写入临时文件，内存占用与请求体大小无关
+                stage_started = time.perf_counter()
+                spooled = _SpooledBody(settings.REQUEST_BODY_SPOOL_THRESHOLD, settings.REQUEST_BODY_SPOOL_DIR)
+                async for chunk in self._iter_request_body(receive):
+                    spooled.write(chunk)
+                content = spooled.content()
+                if trace is not None:
+                    trace.add("body", stage_started)
+
+            # 流式请求体无法重放，因此流式模式下只有无请求体时才跟随重定向和重试
+            replayable = not (has_body and settings.PROXY_STREAMING)
+            endpoint, response = await self._dispatch(
+                service_name, pool, policy, method, target, headers, content, replayable,
+                trace if trace is not None and trace.sampled else None,
             )
-        except httpx.RequestError as e:
-            error_msg = f"转发请求错误 ({target_url}): {str(e)}"
-            logger.error(error_msg)
-            logger.error(f"详细错误: {traceback.format_exc()}")
-            return Response(
-                content=error_msg,
-                status_code=status.HTTP_502_BAD_GATEWAY
+            if trace is not None:
+                trace.mark = time.perf_counter()
+            latency = time.monotonic() - started
+            context.upstream_time = latency
+            policy.latency.record(latency)
+            limit_sample = latency
+            overloaded = response.status_code in (429, 503)
+            logger.debug("请求成功, 状态码: %s", response.status_code)
+            # 5xx响应计入实例的被动健康检查和熔断统计
+            success = response.status_code < 500
+            outcome = success
+
+            try:
+                response_headers = self._build_response_headers(response)
+                cache_entry = None
+                if cached is not None and response.status_code == 304:
+                    # 缓存条目仍然有效
+                    response_cache.refresh(cached, response.headers)
+                    response_started = True
+                    await self._send_cached(context, send, cached, b"REVALIDATED")
+                    return
+                if cache_target is not None:
+                    cache_entry = response_cache.prepare(
+                        service_name, cache_target, context.headers, cache_identity,
+                        response.status_code, response.headers, response_headers,
+                    )
+                if cache_entry is not None:
+                    # 可缓存的响应先在内存中缓冲，超过单条上限时改为流式返回且不缓存
+                    chunks = []
+                    size = 0
+                    iterator = response.aiter_raw()
+                    async for chunk in iterator:
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size > response_cache.max_entry_bytes:
+                            break
+                    else:
+                        response_cache.store(cache_entry, b"".join(chunks))
+                        response_started = True
+                        await self._send_cached(context, send, cache_entry, b"MISS")
+                        return
+                    await send({
+                        "type": "http.response.start",
+                        "status": response.status_code,
+                        "headers": response_headers,
+                    })
+                    response_started = True
+                    for chunk in chunks:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    async for chunk in iterator:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                elif settings.PROXY_STREAMING:
+                    # 流式模式下按块原样返回后端响应，适用于SSE和分块输出的AI推理结果
+                    await send({
+                        "type": "http.response.start",
+                        "status": response.status_code,
+                        "headers": response_headers,
+                    })
+                    response_started = True
+                    async for chunk in response.aiter_raw():
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                else:
+                    body = b"".join([chunk async for chunk in response.aiter_raw()])
+                    await send({
+                        "type": "http.response.start",
+                        "status": response.status_code,
+                        "headers": response_headers,
+                    })
+                    response_started = True
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+            finally:
+                await response.aclose()
+
+        except ClientDisconnect:
+            # 客户端主动断开不代表实例异常
+            success = True
+            outcome = None
+            logger.warning("客户端在请求体发送完成前断开连接 (%s %s)", service_name, target)
+        except RequestBodyTooLarge as e:
+            success = True
+            outcome = None
+            logger.warning("请求体过大，拒绝请求 (%s %s): %s", service_name, target, e)
+            await self._send_error(
+                scope, receive, send, response_started, "Request body too large", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
             )
+        except httpx.ConnectError as e:
+            success = False
+            error_msg = f"连接错误 ({service_name} {target}): {str(e)}"
+            logger.error("连接错误 (%s %s): %s，目标服务可能未运行或不可达", service_name, target, e)
+            await self._send_error(scope, receive, send, response_started, error_msg, status.HTTP_502_BAD_GATEWAY)
+        except httpx.TimeoutException as e:
+            success = False
+            limit_sample = time.monotonic() - started
+            overloaded = True
+            error_msg = f"请求超时 ({service_name} {target}): {str(e)}"
+            logger.error("请求超时 (%s %s): %s", service_name, target, e)
+            await self._send_error(scope, receive, send, response_started, error_msg, status.HTTP_504_GATEWAY_TIMEOUT)
+        except httpx.RequestError as e:
+            success = False
+            error_msg = f"转发请求错误 ({service_name} {target}): {str(e)}"
+            logger.error("转发请求错误 (%s %s): %s", service_name, target, e, exc_info=True)
+            await self._send_error(scope, receive, send, response_started, error_msg, status.HTTP_502_BAD_GATEWAY)
         except Exception as e:
-            error_msg = f"未知错误 ({target_url}): {str(e)}"
-            logger.error(error_msg)
-            logger.error(f"详细错误: {traceback.format_exc()}")
-            return Response(
-                content=error_msg,
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-            ) 
\ No newline at end of file
+            error_msg = f"未知错误 ({service_name} {target}): {str(e)}"
+            logger.error("未知错误 (%s %s): %s", service_name, target, e, exc_info=True)
+            await self._send_error(scope, receive, send, response_started, error_msg, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            if spooled is not None:
+                spooled.close()
+            if endpoint is not None:
+                pool.release(endpoint, success)
+            if breaker is not None:
+                breaker.record(outcome, latency or time.monotonic() - started)
+            if limiter is not None:
+                # 名额在响应体转发完成后才归还，流式响应期间后端仍在处理这个请求
+                limiter.release(limit_sample, overloaded)
+
+    async def _dispatch(
+        self,
+        service_name: str,
+        pool: UpstreamPool,
+        policy: ServiceResilience,
+        method: str,
+        target: str,
+        headers: Dict[str, str],
+        content: Any,
+        replayable: bool,
+        trace: Optional[Trace] = None,
+    ) -> Tuple[Endpoint, httpx.Response]:
+        """
+        发送请求直到收到后端响应头。
+        - 连接失败（请求未到达后端）时，可重放的请求换一个实例重试
+        - 幂等请求遇到超时或 RETRY_STATUS_CODES 中的状态码时同样重试
+        - 启用对冲时，幂等请求超过延迟分位数仍未响应则向另一个实例再发一次，取先返回者
+        重试和对冲都消耗服务的重试预算，后端整体故障时不会成倍放大请求量。
+
+        参数:
+            trace: 被采样请求的追踪信息，记录每次尝试的连接池等待、建连、发送和等待响应头耗时
+
+        返回:
+            处理请求的实例（已计入进行中请求）和流式响应
+        """
+        client = upstream_clients.get(service_name)
+        idempotent = replayable and method in IDEMPOTENT_METHODS
+        policy.retry_budget.record_request()
+
+        def build(endpoint: Endpoint) -> httpx.Request:
+            extensions = {"trace": UpstreamTrace(trace)} if trace is not None else None
+            return client.build_request(
+                method=method, url=f"{endpoint.url}{target}", headers=headers, content=content, extensions=extensions
+            )
+
+        retries = 0
+        endpoint = pool.pick()
+        while True:
+            try:
+                hedge_delay = policy.hedge_delay() if idempotent and len(pool.endpoints) > 1 else None
+                if hedge_delay is not None:
+                    endpoint, response = await self._hedge(client, pool, policy, endpoint, build, hedge_delay)
+                else:
+                    response = await self._attempt(client, pool, endpoint, build(endpoint), replayable)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.TimeoutException) as e:
+                # 连接阶段的错误说明请求没有到达后端，可重放的请求都可以重试；其余超时只重试幂等请求
+                retry = replayable if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)) else idempotent
+                if not (retry and retries < settings.RETRY_MAX_ATTEMPTS and policy.retry_budget.try_retry()):
+                    raise
+                logger.warning("请求失败，重试 (%d) (%s %s): %s", retries + 1, endpoint.url, target, e)
+            else:
+                if not (
+                    idempotent
+                    and response.status_code in settings.RETRY_STATUS_CODES
+                    and retries < settings.RETRY_MAX_ATTEMPTS
+                    and policy.retry_budget.try_retry()
+                ):
+                    return endpoint, response
+                logger.warning("后端返回 %s，重试 (%d) (%s %s)", response.status_code, retries + 1, endpoint.url, target)
+                await response.aclose()
+                pool.release(endpoint, False)
+            retries += 1
+            endpoint = pool.pick(exclude=endpoint)
+
+    async def _attempt(
+        self,
+        client: httpx.AsyncClient,
+        pool: UpstreamPool,
+        endpoint: Endpoint,
+        request: httpx.Request,
+        follow_redirects: bool,
+    ) -> httpx.Response:
+        """向一个实例发送请求；失败时释放实例并记录被动健康状态"""
+        pool.acquire(endpoint)
+        try:
+            return await client.send(request, stream=True, follow_redirects=follow_redirects)
+        except (asyncio.CancelledError, ClientDisconnect, RequestBodyTooLarge):
+            # 被取消的对冲请求、客户端断开或请求体过大不代表实例异常
+            pool.release(endpoint, True)
+            raise
+        except BaseException:
+            pool.release(endpoint, False)
+            raise
+
+    async def _hedge(
+        self,
+        client: httpx.AsyncClient,
+        pool: UpstreamPool,
+        policy: ServiceResilience,
+        endpoint: Endpoint,
+        build: Callable[[Endpoint], httpx.Request],
+        delay: float,
+    ) -> Tuple[Endpoint, httpx.Response]:
+        """
+        对冲请求：首个请求在 delay 秒内未返回响应头时向另一个实例再发一次，
+        使用先返回响应头的结果并取消另一个请求。
+        """
+        attempts = {asyncio.ensure_future(self._attempt(client, pool, endpoint, build(endpoint), True)): endpoint}
+        try:
+            done, pending = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                second = pool.pick(exclude=endpoint)
+                if second is not endpoint and policy.retry_budget.try_retry():
+                    attempts[asyncio.ensure_future(self._attempt(client, pool, second, build(second), True))] = second
+                pending = set(attempts)
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return attempts.pop(task), task.result()
+                    error = error or task.exception()
+                    del attempts[task]
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # 取消尚未完成的请求；已经返回响应的落选请求需要关闭并释放实例
+            for task, loser in attempts.items():
+                task.cancel()
+                try:
+                    response = await task
+                except (asyncio.CancelledError, Exception):
+                    continue
+                await response.aclose()
+                pool.release(loser, True)
+
+    def _build_response_headers(self, response: httpx.Response) -> List[Tuple[bytes, bytes]]:
+        """保留后端原始响应头（包括多个Set-Cookie），去掉逐跳头"""
+        return [
+            (key.lower(), value) for key, value in response.headers.raw
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        ]
+
+    async def _iter_request_body(self, receive: Receive) -> AsyncIterator[bytes]:
+        """逐块读取客户端请求体"""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect()
+            body = message.get("body", b"")
+            if body:
+                yield body
+            if not message.get("more_body", False):
+                break
+
+    async def _send_error(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        response_started: bool,
+        error_msg: str,
+        status_code: int,
+    ) -> None:
+        """
+        返回错误响应。
+        如果响应头已经发送（流式传输途中出错），只能中断连接。
+        """
+        if response_started:
+            raise RuntimeError(error_msg)
+        response = Response(content=error_msg, status_code=status_code)
+        await response(scope, receive, send)
@@ -1,60 +1,83 @@
+import math
 import time
-from collections import defaultdict, deque
-from typing import Dict, Deque, Tuple, Optional, Any
-from fastapi import Request, Response, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Optional, Tuple
+from fastapi import Response, status
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.core.config import settings
-from app.utils.logger import logger
+from app.core.metrics import metrics
+from app.core.rate_limit_policy import RateLimitPolicy, RateLimitTier, rate_limit_policies
+from app.core.rate_limit_storage import rate_limit_storage
+from app.middlewares.context import GatewayContext, get_context
+from app.middlewares.websocket import reject
+from app.utils.logger import logger as base_logger
 
+logger = base_logger.get_child("rate_limit")
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+# 来自缓存的响应没有在后端产生用量，不按响应头结算
+_CACHED_RESPONSES = (b"HIT", b"REVALIDATED")
+
+
+class RateLimitMiddleware:
     """
     流量控制中间件，用于限制请求频率。
-    可以根据IP、路径或用户ID进行限流。
-    使用滑动窗口算法实现。
+    路由引用的限流策略决定按用户（JWT的 sub）还是按IP计数、按 scopes 选择哪一档配额以及每个请求的权重；
+    后端在响应头中报告实际用量（例如AI接口的token数）时，响应后按实际用量结算预扣的差额。
+    WebSocket连接在握手时计为一次请求。
+    限流算法可配置（滑动窗口计数器、令牌桶、GCRA），每个键只保存固定大小的状态。
+    以纯ASGI方式实现，直接处理 scope/receive/send。
     """
     
-    def __init__(self, app):
+    def __init__(self, app: ASGIApp):
         """
         初始化流量控制中间件。
-        从配置文件中读取设置。
+        启用状态和阈值每次从配置读取，配置热加载后立即生效。
         """
-        super().__init__(app)
-        self.enabled = settings.RATE_LIMIT_ENABLED
-        self.window_size = settings.RATE_LIMIT_WINDOW_SIZE
-        self.max_requests = settings.RATE_LIMIT_MAX_REQUESTS
-        self.exclude_paths = settings.RATE_LIMIT_EXCLUDE_PATHS + settings.WHITELIST_PATHS
+        self.app = app
         
-        # 存储每个限流键（如IP或路径）的请求时间戳
-        self.request_records: Dict[str, Deque[float]] = defaultdict(lambda: deque())
+        # 每个限流键（如用户或IP）的状态由配置的存储后端保存
+        self.storage = rate_limit_storage
+        self.policies = rate_limit_policies
         
-        logger.info(f"流量控制中间件已初始化: 启用={self.enabled}, 窗口大小={self.window_size}秒, 最大请求数={self.max_requests}")
+        logger.info(
+            "流量控制中间件已初始化: 启用=%s, 算法=%s, 存储=%s, 窗口大小=%s秒, 最大请求数=%s",
+            self.enabled, self.storage.algorithm.name, self.storage.name, self.window_size, self.max_requests,
+        )
     
-    def _generate_key(self, request: Request) -> str:
+    @property
+    def enabled(self) -> bool:
+        return settings.RATE_LIMIT_ENABLED
+
+    @property
+    def window_size(self) -> float:
+        return self.storage.algorithm.window
+
+    @property
+    def max_requests(self) -> int:
+        return self.storage.algorithm.limit
+
+    def _generate_key(self, context: GatewayContext, policy: RateLimitPolicy, tier: RateLimitTier) -> str:
         """
         根据请求生成限流键。
-        可以根据IP、路径或两者的组合生成。
+        策略按用户计数时使用JWT的 sub，同一出口IP后的多个用户各自计数；未认证的请求按IP计数。
         
         参数:
-            request: 请求对象
+            context: 请求的网关上下文
+            policy: 路由的限流策略
+            tier: 按用户 scopes 选出的配额档位
             
         返回:
             限流键
         """
-        client_ip = request.client.host if request.client else "unknown"
-        
-        # 使用仅根据IP限流，而不是IP+路径组合
-        return f"ip:{client_ip}"
-        
-        # 原来的组合限流方式（按IP+路径）
-        # path = request.url.path
-        # return f"ip:{client_ip}:path:{path}"
+        if policy.key == "user" and context.user is not None:
+            subject = context.user.get("sub")
+            if subject is not None:
+                return f"{tier.prefix}user:{subject}"
+        return f"{tier.prefix}ip:{context.client_ip}"
     
-    def _is_rate_limited(self, key: str) -> Tuple[bool, int]:
+    async def _is_rate_limited(self, key: str) -> Tuple[bool, int]:
         """
         检查请求是否超过限流阈值。
-        使用滑动窗口算法。
         
         参数:
             key: 限流键
@@ -62,78 +85,99 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         返回:
             (是否被限流, 剩余可用请求数)
         """
-        current_time = time.time()
-        records = self.request_records[key]
-        
-        # 移除时间窗口外的请求记录
-        while records and current_time - records[0] > self.window_size:
-            records.popleft()
-        
-        # 检查是否超过限额
-        if len(records) >= self.max_requests:
-            return True, 0
-        
-        # 添加当前请求的时间戳
-        records.append(current_time)
-        
-        # 返回是否被限流和剩余可用请求数
-        return False, self.max_requests - len(records)
+        result = await self.storage.hit(key)
+        return not result.allowed, result.remaining
+
+    @staticmethod
+    def _reported_usage(policy: RateLimitPolicy, message: Message) -> Optional[float]:
+        """从响应头中读取后端报告的实际用量，没有报告或响应来自缓存时返回None"""
+        usage = None
+        for name, value in message.get("headers", []):
+            if name.lower() == policy.usage_header:
+                try:
+                    usage = float(value)
+                except ValueError:
+                    logger.warning("后端报告的用量无效: %s", value.decode("latin-1", "replace"))
+                    return None
+            elif name.lower() == b"x-cache" and value in _CACHED_RESPONSES:
+                return None
+        if usage is None or usage < 0:
+            return None
+        return usage
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         处理请求并应用流量控制。
         
         参数:
-            request: 请求对象
-            call_next: 下一个处理函数
-            
-        返回:
-            响应对象
+            scope: ASGI scope
+            receive: ASGI receive
+            send: ASGI send
         """
-        # 如果流量控制未启用或请求路径在排除列表中，直接处理请求
-        if not self.enabled or request.url.path in self.exclude_paths:
-            return await call_next(request)
-        
-        # 生成限流键
-        key = self._generate_key(request)
-        
-        # 检查是否超出限流
-        is_limited, remaining = self._is_rate_limited(key)
-        
-        if is_limited:
-            logger.warning(f"请求被限流: {key}")
-            return Response(
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        
+        context = get_context(scope)
+        
+        # 如果流量控制未启用或路由不参与限流（排除路径和白名单），直接处理请求
+        if not self.enabled or context.route.rate_limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # 按路由的策略和用户的 scopes 确定配额档位，生成限流键
+        policy = self.policies.get(context.route.rate_limit)
+        tier = policy.select(context.user)
+        algorithm = tier.algorithm
+        key = self._generate_key(context, policy, tier)
+        
+        # 检查是否超出限流，同时预扣本次请求的权重
+        started = time.perf_counter()
+        result = await self.storage.hit(key, policy.cost, algorithm)
+        if context.trace is not None:
+            context.trace.add("ratelimit", started)
+        reset = int(time.time() + result.reset_after)
+        
+        if not result.allowed:
+            logger.warning("请求被限流: %s", key)
+            metrics.record_rate_limited(policy.name)
+            response = Response(
                 content="请求频率过高，请稍后再试",
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 headers={
-                    "X-RateLimit-Limit": str(self.max_requests),
+                    "X-RateLimit-Limit": str(algorithm.limit),
                     "X-RateLimit-Remaining": "0",
-                    "X-RateLimit-Reset": str(int(time.time() + self.window_size)),
+                    "X-RateLimit-Reset": str(reset),
+                    "Retry-After": str(math.ceil(result.retry_after)),
                 }
             )
-        
-        # 记录限流相关信息到请求状态中，以便后续中间件可以获取
-        request.state.rate_limit_info = {
-            "limit": self.max_requests,
-            "remaining": remaining,
-            "reset": int(time.time() + self.window_size)
-        }
-        
-        # 处理请求
-        response = await call_next(request)
-        
-        # 获取响应头并添加限流相关信息
-        headers = dict(response.headers)
-        headers.update({
-            "X-RateLimit-Limit": str(self.max_requests),
-            "X-RateLimit-Remaining": str(remaining),
-            "X-RateLimit-Reset": str(int(time.time() + self.window_size)),
+            await reject(scope, receive, send, response)
+            return
+        
+        # 记录限流相关信息到请求上下文中，以便后续阶段可以获取
+        context.set_rate_limit_info({
+            "limit": algorithm.limit,
+            "remaining": result.remaining,
+            "reset": reset
         })
-        
-        # 创建包含响应头的新响应
-        return Response(
-            content=response.body,
-            status_code=response.status_code,
-            headers=headers,
-            media_type=response.media_type
-        ) 
\ No newline at end of file
+        rate_limit_headers = [
+            (b"x-ratelimit-limit", str(algorithm.limit).encode("latin-1")),
+            (b"x-ratelimit-remaining", str(result.remaining).encode("latin-1")),
+            (b"x-ratelimit-reset", str(reset).encode("latin-1")),
+        ]
+        
+        async def send_with_rate_limit_headers(message: Message) -> None:
+            # 在响应开始（或接受WebSocket连接）时追加限流相关响应头，响应体原样透传
+            if message["type"] not in ("http.response.start", "websocket.accept"):
+                await send(message)
+                return
+            usage = self._reported_usage(policy, message) if policy.usage_header else None
+            message["headers"] = list(message.get("headers", [])) + rate_limit_headers
+            await send(message)
+            if usage is not None:
+                metrics.record_quota_usage(policy.name, usage)
+                if usage != policy.cost:
+                    # 响应头已经发出后再结算，不增加响应延迟；用量超过剩余配额的部分记为欠额
+                    await self.storage.charge(key, usage - policy.cost, algorithm)
+        
+        await self.app(scope, receive, send_with_rate_limit_headers)
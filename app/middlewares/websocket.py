@@ -0,0 +1,389 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import Response, status
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.load_balancer import Endpoint, UpstreamPool
+from app.core.metrics import metrics
+from app.core.resilience import ServiceResilience, resilience
+from app.middlewares.context import GatewayContext, get_context
+from app.middlewares.proxy import build_upstream_headers
+from app.utils.logger import logger as base_logger
+
+logger = base_logger.get_child("websocket")
+
+try:
+    from websockets.asyncio.client import ClientConnection, connect
+    from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidStatus
+except ImportError:
+    connect = None
+
+# 握手相关的请求头由连接后端时重新生成，Sec-WebSocket-Protocol 以子协议列表的形式转发
+_HANDSHAKE_HEADERS = {
+    "host",
+    "connection",
+    "keep-alive",
+    "upgrade",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "proxy-authorization",
+    "sec-websocket-key",
+    "sec-websocket-version",
+    "sec-websocket-extensions",
+    "sec-websocket-protocol",
+}
+
+# 可以出现在关闭帧中的状态码，1005、1006、1015 只用于表示没有收到关闭帧
+_SENDABLE_CLOSE_CODES = {1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 1012, 1013, 1014}
+
+_CLOSE_GOING_AWAY = 1001
+_CLOSE_INTERNAL_ERROR = 1011
+
+
+def _sendable(code: Optional[int]) -> bool:
+    return code is not None and (code in _SENDABLE_CLOSE_CODES or 3000 <= code < 5000)
+
+
+async def reject(scope: Scope, receive: Receive, send: Send, response: Response) -> None:
+    """
+    拒绝请求。
+    HTTP请求直接返回响应；WebSocket握手在服务器支持 websocket.http.response 扩展时返回同样的HTTP响应，
+    否则以关闭握手拒绝（客户端收到403）。
+
+    参数:
+        scope: ASGI scope
+        receive: ASGI receive
+        send: ASGI send
+        response: 拒绝时返回的响应
+    """
+    if scope["type"] != "websocket":
+        await response(scope, receive, send)
+        return
+    # 握手阶段的第一条消息是 websocket.connect
+    await receive()
+    if "websocket.http.response" in scope.get("extensions", {}):
+        await send({
+            "type": "websocket.http.response.start",
+            "status": response.status_code,
+            "headers": response.raw_headers,
+        })
+        await send({"type": "websocket.http.response.body", "body": response.body})
+        return
+    await send({"type": "websocket.close", "code": 1008})
+
+
+def _websocket_url(endpoint_url: str) -> str:
+    """把实例的HTTP地址转换为WebSocket地址"""
+    if endpoint_url.startswith("https://"):
+        return "wss://" + endpoint_url[len("https://"):]
+    if endpoint_url.startswith("http://"):
+        return "ws://" + endpoint_url[len("http://"):]
+    return endpoint_url
+
+
+class WebSocketProxyMiddleware:
+    """
+    WebSocket代理中间件。
+    /api/{service}/... 的WebSocket连接在认证和限流之后由这里连接后端，再在两个方向上逐条转发消息。
+    - 后端的消息对象直接交给客户端一侧发送，不重新拼接或复制
+    - 背压：每个方向最多缓冲 WEBSOCKET_MAX_QUEUE 条消息，发往后端的数据超过 WEBSOCKET_WRITE_LIMIT 时暂停读取客户端，
+      慢的一方会让另一方停止读取套接字，单个连接的内存有上限
+    - 两个方向都没有消息超过 WEBSOCKET_IDLE_TIMEOUT 时关闭连接
+    - 每个工作进程最多同时转发 WEBSOCKET_MAX_CONNECTIONS 个连接（各进程分别计数，不跨进程共享）
+    以纯ASGI方式实现，直接处理 scope/receive/send。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.active = 0  # 当前进程正在转发的连接数
+        if connect is None and settings.WEBSOCKET_ENABLED:
+            logger.info("未安装 websockets，不转发WebSocket连接。请安装 websockets")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "websocket" or connect is None or not settings.WEBSOCKET_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        context = get_context(scope)
+        service_name = context.route.service
+        # 没有对应后端服务的连接交给应用处理
+        if service_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        pool = context.pool
+        if pool is None:
+            logger.error("未找到服务配置: '%s'", service_name)
+            await reject(scope, receive, send, Response(
+                content=f"Service '{service_name}' not found",
+                status_code=status.HTTP_404_NOT_FOUND,
+            ))
+            return
+
+        if self.active >= settings.WEBSOCKET_MAX_CONNECTIONS:
+            logger.warning("WebSocket连接数已达本进程上限 %d，拒绝连接: '%s'", settings.WEBSOCKET_MAX_CONNECTIONS, service_name)
+            await reject(scope, receive, send, Response(
+                content="Too many WebSocket connections",
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            ))
+            return
+
+        self.active += 1
+        try:
+            await self._proxy_websocket(context, receive, send, service_name, pool)
+        finally:
+            self.active -= 1
+
+    def _build_target(self, context: GatewayContext) -> str:
+        """后端路径和查询字符串；通过查询参数传递的JWT不转发给后端"""
+        target = context.route.upstream_path
+        if not context.query_string:
+            return target
+        query = context.query_string.decode("latin-1")
+        param = settings.WEBSOCKET_TOKEN_QUERY_PARAM
+        if param and param in query:
+            query = urlencode([
+                (key, value) for key, value in parse_qsl(query, keep_blank_values=True) if key != param
+            ])
+        return f"{target}?{query}" if query else target
+
+    def _build_headers(self, context: GatewayContext) -> Tuple[Dict[str, str], List[str]]:
+        """转发给后端的握手请求头和客户端请求的子协议"""
+        headers = {
+            key: value for key, value in build_upstream_headers(context).items()
+            if key.lower() not in _HANDSHAKE_HEADERS
+        }
+        protocols = context.headers.get("sec-websocket-protocol", "")
+        subprotocols = [item.strip() for item in protocols.split(",") if item.strip()]
+        return headers, subprotocols
+
+    async def _proxy_websocket(
+        self,
+        context: GatewayContext,
+        receive: Receive,
+        send: Send,
+        service_name: str,
+        pool: UpstreamPool,
+    ) -> None:
+        """连接后端、接受客户端握手并转发消息直到任意一方关闭"""
+        scope = context.scope
+        policy = resilience.get(service_name)
+        breaker = policy.breaker if settings.CIRCUIT_BREAKER_ENABLED else None
+        if breaker is not None and not breaker.allow():
+            logger.warning("服务熔断中，拒绝WebSocket连接: '%s'", service_name)
+            await reject(scope, receive, send, Response(
+                content=f"Service '{service_name}' temporarily unavailable",
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(breaker.retry_after())},
+            ))
+            return
+
+        target = self._build_target(context)
+        headers, subprotocols = self._build_headers(context)
+        started = time.monotonic()
+        try:
+            endpoint, upstream = await self._connect(service_name, pool, policy, target, headers, subprotocols)
+        except InvalidStatus as e:
+            # 后端拒绝了握手，把后端的状态码返回给客户端
+            status_code = e.response.status_code
+            if breaker is not None:
+                breaker.record(status_code < 500, time.monotonic() - started)
+            logger.warning("后端拒绝WebSocket握手 (%s %s): %s", service_name, target, status_code)
+            await reject(scope, receive, send, Response(content=bytes(e.response.body or b""), status_code=status_code))
+            return
+        except (OSError, asyncio.TimeoutError, InvalidHandshake) as e:
+            if breaker is not None:
+                breaker.record(False, time.monotonic() - started)
+            timeout = isinstance(e, asyncio.TimeoutError)
+            logger.error("WebSocket连接后端失败 (%s %s): %s", service_name, target, e or type(e).__name__)
+            await reject(scope, receive, send, Response(
+                content=f"{'连接超时' if timeout else '连接错误'} ({service_name} {target}): {str(e)}",
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT if timeout else status.HTTP_502_BAD_GATEWAY,
+            ))
+            return
+        except BaseException:
+            # 握手期间被取消（例如客户端断开），结果与后端无关，只归还熔断器半开状态的探测名额
+            if breaker is not None:
+                breaker.record(None, 0.0)
+            raise
+        latency = time.monotonic() - started
+        context.upstream_time = latency
+        if breaker is not None:
+            breaker.record(True, latency)
+
+        connections = metrics.websockets
+        connections[service_name] = connections.get(service_name, 0) + 1
+        try:
+            # 客户端一侧的握手消息 websocket.connect
+            message = await receive()
+            if message["type"] != "websocket.connect":
+                return
+            await send({
+                "type": "websocket.accept",
+                "subprotocol": upstream.subprotocol,
+                "headers": [],
+            })
+            logger.debug("WebSocket已连接: %s %s -> %s", service_name, target, endpoint.url)
+            await _Tunnel(receive, send, upstream, settings.WEBSOCKET_IDLE_TIMEOUT).run()
+        finally:
+            connections[service_name] -= 1
+            await upstream.close()
+            pool.release(endpoint, True)
+
+    async def _connect(
+        self,
+        service_name: str,
+        pool: UpstreamPool,
+        policy: ServiceResilience,
+        target: str,
+        headers: Dict[str, str],
+        subprotocols: List[str],
+    ) -> Tuple[Endpoint, "ClientConnection"]:
+        """
+        连接后端实例完成WebSocket握手。
+        连接失败时按重试预算换一个实例重试；连接期间实例计入进行中请求，最少连接策略按连接数分配。
+
+        返回:
+            连接的实例（已计入进行中请求）和后端连接
+        """
+        overrides = settings.UPSTREAM_SERVICE_TIMEOUTS.get(service_name, {})
+        open_timeout = overrides.get("connect", settings.UPSTREAM_CONNECT_TIMEOUT)
+        ping_interval = settings.WEBSOCKET_PING_INTERVAL or None
+        policy.retry_budget.record_request()
+
+        retries = 0
+        endpoint = pool.pick()
+        while True:
+            pool.acquire(endpoint)
+            try:
+                upstream = await connect(
+                    _websocket_url(endpoint.url) + target,
+                    additional_headers=headers,
+                    subprotocols=subprotocols or None,
+                    compression="deflate" if settings.WEBSOCKET_COMPRESSION else None,
+                    user_agent_header=None,
+                    proxy=None,
+                    open_timeout=open_timeout,
+                    ping_interval=ping_interval,
+                    ping_timeout=ping_interval,
+                    max_size=settings.WEBSOCKET_MAX_MESSAGE_SIZE,
+                    max_queue=settings.WEBSOCKET_MAX_QUEUE,
+                    write_limit=settings.WEBSOCKET_WRITE_LIMIT,
+                )
+                return endpoint, upstream
+            except InvalidStatus as e:
+                pool.release(endpoint, e.response.status_code < 500)
+                raise
+            except (OSError, asyncio.TimeoutError, InvalidHandshake) as e:
+                pool.release(endpoint, False)
+                if not (retries < settings.RETRY_MAX_ATTEMPTS and policy.retry_budget.try_retry()):
+                    raise
+                logger.warning("WebSocket连接失败，重试 (%d) (%s %s): %s", retries + 1, endpoint.url, target, e)
+            except BaseException:
+                pool.release(endpoint, True)
+                raise
+            retries += 1
+            endpoint = pool.pick(exclude=endpoint)
+
+
+class _Tunnel:
+    """
+    一个已建立的WebSocket连接的双向转发。
+    每个方向一个任务；空闲检测使用事件循环定时器，只在到期时检查最后一次收到消息的时间，
+    收发消息时只更新时间戳。
+    """
+
+    __slots__ = ("receive", "send", "upstream", "idle_timeout", "loop", "last_activity", "client_code", "idle", "tasks", "timer")
+
+    def __init__(self, receive: Receive, send: Send, upstream: "ClientConnection", idle_timeout: float):
+        self.receive = receive
+        self.send = send
+        self.upstream = upstream
+        self.idle_timeout = idle_timeout
+        self.loop = asyncio.get_running_loop()
+        self.last_activity = self.loop.time()
+        self.client_code: Optional[int] = None  # 客户端断开时的关闭码，客户端仍连接时为None
+        self.idle = False
+        self.tasks: Tuple[asyncio.Future, ...] = ()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    async def run(self) -> None:
+        self.tasks = (
+            asyncio.ensure_future(self._client_to_upstream()),
+            asyncio.ensure_future(self._upstream_to_client()),
+        )
+        if self.idle_timeout > 0:
+            self.timer = self.loop.call_at(self.last_activity + self.idle_timeout, self._check_idle)
+        try:
+            await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if self.timer is not None:
+                self.timer.cancel()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self._close()
+
+    def _check_idle(self) -> None:
+        deadline = self.last_activity + self.idle_timeout
+        if self.loop.time() < deadline:
+            self.timer = self.loop.call_at(deadline, self._check_idle)
+            return
+        self.idle = True
+        for task in self.tasks:
+            task.cancel()
+
+    async def _client_to_upstream(self) -> None:
+        receive = self.receive
+        upstream = self.upstream
+        while True:
+            message: Message = await receive()
+            message_type = message["type"]
+            if message_type == "websocket.receive":
+                self.last_activity = self.loop.time()
+                data = message.get("bytes")
+                await upstream.send(data if data is not None else message.get("text") or "")
+            elif message_type == "websocket.disconnect":
+                self.client_code = message.get("code", 1000)
+                return
+
+    async def _upstream_to_client(self) -> None:
+        send = self.send
+        try:
+            async for data in self.upstream:
+                self.last_activity = self.loop.time()
+                if isinstance(data, bytes):
+                    await send({"type": "websocket.send", "bytes": data})
+                else:
+                    await send({"type": "websocket.send", "text": data})
+        except ConnectionClosed:
+            # 后端异常断开，由 _close 通知客户端
+            pass
+
+    async def _close(self) -> None:
+        """把一方的关闭传递给另一方；空闲超时时两边都以 1001 关闭"""
+        upstream = self.upstream
+        if self.client_code is None:
+            if self.idle:
+                code, reason = _CLOSE_GOING_AWAY, "idle timeout"
+            elif upstream.close_code is None:
+                code, reason = _CLOSE_GOING_AWAY, ""
+            elif _sendable(upstream.close_code):
+                code, reason = upstream.close_code, upstream.close_reason or ""
+            else:
+                code, reason = _CLOSE_INTERNAL_ERROR, ""
+            try:
+                await self.send({"type": "websocket.close", "code": code, "reason": reason})
+            except Exception:
+                # 客户端已经断开
+                pass
+            await upstream.close(code, reason)
+            return
+        code = self.client_code if _sendable(self.client_code) else 1000
+        await upstream.close(code)
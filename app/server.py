@@ -0,0 +1,409 @@
+"""
+生产环境启动入口：预先派生（pre-fork）多个工作进程运行网关。
+
+    python main.py
+    python -m app.server
+
+- 工作进程数默认等于CPU核数（SERVER_WORKERS）
+- 已安装 uvloop / httptools 时自动使用（pip install .[server]）
+- 支持 SO_REUSEPORT 时每个工作进程单独监听同一端口，由内核分配连接；否则共享主进程的监听套接字
+- SIGTERM / SIGINT：工作进程停止接受新连接，等待进行中的请求和流式响应完成（最多 SERVER_GRACEFUL_TIMEOUT 秒）后退出
+- SIGHUP：转发给所有工作进程，重新加载配置
+- 工作进程处理的请求数或常驻内存超过阈值时，先启动替代进程，替代进程就绪后再平滑停止旧进程
+"""
+import importlib.util
+import os
+import random
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+
+from app.core.config import load_settings, settings
+from app.utils.logger import logger as base_logger
+
+logger = base_logger.get_child("server")
+
+# 工作进程通过管道通知主进程的消息
+_READY = b"R"  # 启动完成，开始接受连接
+_RECYCLE = b"X"  # 达到重启阈值，请求替换
+
+# 工作进程启动后多久内退出视为启动失败（秒），连续失败时推迟重新派生
+_CRASH_WINDOW = 5.0
+_MAX_RESPAWN_DELAY = 30.0
+
+
+class _WorkerServer(uvicorn.Server):
+    """工作进程中的uvicorn服务器：启动完成和达到重启阈值时通知主进程"""
+
+    def __init__(self, config: uvicorn.Config, status_fd: int, max_requests: int, max_memory: int):
+        super().__init__(config)
+        self.status_fd = status_fd
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        self._recycle_requested = False
+
+    def _notify(self, message: bytes) -> None:
+        try:
+            os.write(self.status_fd, message)
+        except OSError:
+            # 主进程已经退出
+            pass
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self._notify(_READY)
+
+    async def on_tick(self, counter: int) -> bool:
+        # 每秒检查一次重启阈值，只通知主进程一次，由主进程决定何时停止本进程
+        if counter % 10 == 0 and not self._recycle_requested:
+            reason = self._recycle_reason()
+            if reason is not None:
+                logger.info("工作进程 %d %s，请求替换", os.getpid(), reason)
+                self._recycle_requested = True
+                self._notify(_RECYCLE)
+        return await super().on_tick(counter)
+
+    def _recycle_reason(self) -> Optional[str]:
+        if self.max_requests and self.server_state.total_requests >= self.max_requests:
+            return f"已处理 {self.server_state.total_requests} 个请求"
+        if self.max_memory:
+            rss = _rss_bytes(os.getpid())
+            if rss is not None and rss >= self.max_memory:
+                return f"常驻内存 {rss // (1024 * 1024)}MB"
+        return None
+
+
+class _Worker:
+    __slots__ = ("pid", "status_fd", "started_at", "ready", "retiring", "replaces")
+
+    def __init__(self, pid: int, status_fd: int, replaces: Optional[int]):
+        self.pid = pid
+        self.status_fd = status_fd
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.retiring = False  # 已有替代进程，等待其就绪后停止
+        self.replaces = replaces  # 本进程替代的旧进程
+
+
+class Arbiter:
+    """
+    主进程：派生并监管工作进程。
+    主进程不处理请求，只负责监听信号、在工作进程退出时重新派生、按阈值替换工作进程。
+    """
+
+    def __init__(self, host: str, port: int, workers: int, reuse_port: bool):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.reuse_port = reuse_port
+        self.workers: Dict[int, _Worker] = {}
+        self._shared_socket: Optional[socket.socket] = None
+        self._pending: List[Tuple[float, Optional[int]]] = []  # (派生时间, 替代的进程)
+        self._crashes = 0
+        self._signals: List[int] = []
+        self._stopping = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    def run(self) -> None:
+        """启动所有工作进程并进入监管循环，直到所有工作进程退出"""
+        if self.reuse_port:
+            # 先在主进程中检查端口可用，避免每个工作进程分别报错
+            _bind_socket(self.host, self.port, reuse_port=True).close()
+        else:
+            self._shared_socket = _bind_socket(self.host, self.port, reuse_port=False)
+            self._shared_socket.listen(settings.SERVER_BACKLOG)
+
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, self._on_signal)
+
+        logger.warning(
+            "网关启动: http://%s:%d, 工作进程 %d, %s, 事件循环 %s, HTTP解析器 %s",
+            self.host, self.port, self.worker_count,
+            "SO_REUSEPORT" if self.reuse_port else "共享监听套接字",
+            _resolve_loop(), _resolve_http(),
+        )
+        for _ in range(self.worker_count):
+            self._spawn(None)
+
+        deadline: Optional[float] = None
+        while self.workers or (self._pending and not self._stopping):
+            self._handle_signals()
+            self._reap()
+            if self._stopping:
+                if deadline is None:
+                    deadline = time.monotonic() + settings.SERVER_GRACEFUL_TIMEOUT + 5
+                elif time.monotonic() > deadline:
+                    logger.error("工作进程未能在超时时间内退出，强制结束: %s", list(self.workers))
+                    self._kill_all(signal.SIGKILL)
+                    deadline = time.monotonic() + 5
+            else:
+                self._spawn_pending()
+            self._wait(1.0)
+
+        signal.set_wakeup_fd(-1)
+        if self._shared_socket is not None:
+            self._shared_socket.close()
+        logger.warning("网关已停止")
+
+    def _on_signal(self, sig: int, frame) -> None:
+        self._signals.append(sig)
+
+    def _handle_signals(self) -> None:
+        signals, self._signals = self._signals, []
+        for sig in signals:
+            if sig in (signal.SIGTERM, signal.SIGINT):
+                if self._stopping and sig == signal.SIGINT:
+                    logger.warning("再次收到中断信号，立即结束所有工作进程")
+                    self._kill_all(signal.SIGKILL)
+                    continue
+                if not self._stopping:
+                    logger.warning("收到 %s，等待进行中的请求完成后退出", signal.Signals(sig).name)
+                    self._stopping = True
+                    self._pending = []
+                    self._kill_all(signal.SIGTERM)
+            elif sig == signal.SIGHUP:
+                logger.info("收到 SIGHUP，通知工作进程重新加载配置")
+                self._kill_all(signal.SIGHUP)
+
+    def _wait(self, timeout: float) -> None:
+        fds = [self._wakeup_r] + [worker.status_fd for worker in self.workers.values()]
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except InterruptedError:
+            return
+        for fd in readable:
+            try:
+                data = os.read(fd, 64)
+            except OSError:
+                continue
+            if fd == self._wakeup_r:
+                continue
+            worker = next((worker for worker in self.workers.values() if worker.status_fd == fd), None)
+            if worker is None or not data:
+                continue
+            if _READY in data:
+                self._on_ready(worker)
+            if _RECYCLE in data:
+                self._on_recycle(worker)
+
+    def _on_ready(self, worker: _Worker) -> None:
+        worker.ready = True
+        self._crashes = 0
+        old = self.workers.get(worker.replaces) if worker.replaces is not None else None
+        if old is not None:
+            logger.info("替代进程 %d 已就绪，停止工作进程 %d", worker.pid, old.pid)
+            _signal(old.pid, signal.SIGTERM)
+
+    def _on_recycle(self, worker: _Worker) -> None:
+        if worker.retiring or self._stopping:
+            return
+        worker.retiring = True
+        self._spawn(worker.pid)
+
+    def _spawn_pending(self) -> None:
+        now = time.monotonic()
+        due = [item for item in self._pending if item[0] <= now]
+        self._pending = [item for item in self._pending if item[0] > now]
+        for _, replaces in due:
+            if replaces is None or replaces in self.workers:
+                self._spawn(replaces)
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.status_fd)
+            if self._stopping or worker.retiring:
+                continue
+            # 意外退出：立即派生新进程；启动阶段连续失败时逐渐推迟，避免快速循环
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+            if not worker.ready or time.monotonic() - worker.started_at < _CRASH_WINDOW:
+                self._crashes += 1
+            delay = min(0.5 * (2 ** (self._crashes - 1)), _MAX_RESPAWN_DELAY) if self._crashes else 0.0
+            logger.error("工作进程 %d 意外退出 (%s)，%.1f秒后重新派生", pid, code, delay)
+            # 尚未就绪的替代进程退出时，旧进程继续服务并重新安排替换
+            replaces = worker.replaces if not worker.ready else None
+            self._pending.append((time.monotonic() + delay, replaces))
+
+    def _spawn(self, replaces: Optional[int]) -> None:
+        status_r, status_w = os.pipe()
+        max_requests = settings.SERVER_MAX_REQUESTS
+        if max_requests and settings.SERVER_MAX_REQUESTS_JITTER:
+            max_requests += random.randint(0, settings.SERVER_MAX_REQUESTS_JITTER)
+        pid = os.fork()
+        if pid == 0:
+            os.close(status_r)
+            code = 0
+            try:
+                self._run_worker(status_w, max_requests)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException:
+                logger.error("工作进程启动失败", exc_info=True)
+                code = 1
+            finally:
+                base_logger.shutdown()
+                os._exit(code)
+        os.close(status_w)
+        self.workers[pid] = _Worker(pid, status_r, replaces)
+
+    def _run_worker(self, status_fd: int, max_requests: int) -> None:
+        """工作进程入口（fork 之后执行）"""
+        # 恢复主进程修改过的信号处理，uvicorn 在运行期间会接管 SIGINT / SIGTERM
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for worker in self.workers.values():
+            os.close(worker.status_fd)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, _exit_on_signal)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)  # 应用启动后由配置热加载接管
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        # 主进程的配置是启动时的快照，此后工作进程可能已经热加载过新配置；
+        # 替代进程和重新派生的进程在导入应用之前重新读取配置，与其他工作进程保持一致
+        try:
+            current = load_settings()
+        except Exception as e:
+            logger.error("工作进程加载配置失败，使用启动时的配置: %s", e)
+        else:
+            settings.__dict__.update(current.__dict__)
+
+        if self.reuse_port:
+            sock = _bind_socket(self.host, self.port, reuse_port=True)
+        else:
+            sock = self._shared_socket
+        config = uvicorn.Config(
+            "app.main:app",
+            loop=_resolve_loop(),
+            http=_resolve_http(),
+            backlog=settings.SERVER_BACKLOG,
+            timeout_keep_alive=int(settings.SERVER_KEEPALIVE_TIMEOUT),
+            timeout_graceful_shutdown=int(settings.SERVER_GRACEFUL_TIMEOUT),
+            access_log=settings.SERVER_ACCESS_LOG,
+            log_level="warning",
+            **_websocket_options(),
+        )
+        server = _WorkerServer(
+            config,
+            status_fd,
+            max_requests=max_requests,
+            max_memory=settings.SERVER_MAX_MEMORY_MB * 1024 * 1024,
+        )
+        server.run(sockets=[sock])
+
+    def _kill_all(self, sig: int) -> None:
+        for pid in list(self.workers):
+            _signal(pid, sig)
+
+
+def _exit_on_signal(sig: int, frame) -> None:
+    raise SystemExit(0)
+
+
+def _signal(pid: int, sig: int) -> None:
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family, sock_type, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, sock_type, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _resolve_loop() -> str:
+    if settings.SERVER_LOOP != "auto":
+        return settings.SERVER_LOOP
+    return "uvloop" if importlib.util.find_spec("uvloop") is not None else "asyncio"
+
+
+def _resolve_http() -> str:
+    if settings.SERVER_HTTP != "auto":
+        return settings.SERVER_HTTP
+    return "httptools" if importlib.util.find_spec("httptools") is not None else "h11"
+
+
+def _websocket_options() -> Dict[str, object]:
+    """客户端一侧的WebSocket参数，与转发到后端的一侧保持一致"""
+    ping_interval = settings.WEBSOCKET_PING_INTERVAL or None
+    return {
+        "ws_max_size": settings.WEBSOCKET_MAX_MESSAGE_SIZE,
+        "ws_max_queue": settings.WEBSOCKET_MAX_QUEUE,
+        "ws_ping_interval": ping_interval,
+        "ws_ping_timeout": ping_interval,
+        "ws_per_message_deflate": settings.WEBSOCKET_COMPRESSION,
+    }
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """进程的常驻内存（字节），仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def main() -> None:
+    """按配置启动网关"""
+    workers = settings.SERVER_WORKERS or os.cpu_count() or 1
+    if not hasattr(os, "fork"):
+        # 不支持 fork 的平台（Windows）退回单进程
+        logger.warning("当前平台不支持多进程模式，以单进程启动")
+        uvicorn.run(
+            "app.main:app",
+            host=settings.SERVER_HOST,
+            port=settings.SERVER_PORT,
+            backlog=settings.SERVER_BACKLOG,
+            timeout_keep_alive=int(settings.SERVER_KEEPALIVE_TIMEOUT),
+            timeout_graceful_shutdown=int(settings.SERVER_GRACEFUL_TIMEOUT),
+            access_log=settings.SERVER_ACCESS_LOG,
+            **_websocket_options(),
+        )
+        return
+
+    metrics_dir = None
+    if workers > 1:
+        if settings.METRICS_ENABLED and not settings.METRICS_DIR:
+            # 多进程时 /metrics 需要合并各进程的快照；同时写入环境变量，使配置热加载后保持一致
+            metrics_dir = tempfile.mkdtemp(prefix="gateway-metrics-")
+            os.environ["METRICS_DIR"] = settings.METRICS_DIR = metrics_dir
+        if settings.RATE_LIMIT_ENABLED and settings.RATE_LIMIT_STORAGE == "memory":
+            logger.warning("RATE_LIMIT_STORAGE=memory 时每个工作进程单独计数，多进程部署建议使用 shared_memory")
+
+    reuse_port = settings.SERVER_REUSE_PORT and hasattr(socket, "SO_REUSEPORT")
+    try:
+        Arbiter(settings.SERVER_HOST, settings.SERVER_PORT, workers, reuse_port).run()
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,230 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 import sys
-from typing import Any, Dict, List, Optional
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional, Tuple
 
 from app.core.config import settings
 
+# LogRecord 的标准属性，JSON格式中其余属性视为 extra 字段输出
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，通过 extra 传入的字段一并输出"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按日志器名称采样 DEBUG/INFO 日志，WARNING 及以上级别始终保留。
+    采样率按名称前缀匹配，最长前缀优先，例如 {"api_gateway": 0.1}。
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self._rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self._cache: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            for prefix, value in self._rates:
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = value
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RepeatFilter(logging.Filter):
+    """
+    限制重复的 WARNING/ERROR 日志。
+    同一位置、同一消息模板的日志在 interval 秒内最多输出 burst 条，
+    其余只计数，在下一个周期的第一条日志中注明被抑制的条数。
+    """
+
+    # 跟踪的日志位置数量上限，超过后重新开始统计
+    MAX_KEYS = 10000
+
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (日志器, 文件, 行号, 消息模板) -> [周期开始时间, 已输出条数, 已抑制条数]
+        self._windows: Dict[Tuple[str, str, int, Any], List[Any]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None:
+            if len(self._windows) >= self.MAX_KEYS:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            return True
+        if now - window[0] >= self.interval:
+            suppressed = window[2]
+            window[0], window[1], window[2] = now, 1, 0
+            if suppressed and isinstance(record.msg, str):
+                record.msg = f"{record.msg} (此前 {self.interval:.0f} 秒内另有 {suppressed} 条相同日志被抑制)"
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列，由后台线程格式化并输出。
+    队列已满时丢弃日志并计数，不会阻塞事件循环。
+    使用无锁的 SimpleQueue，长度上限通过 qsize() 近似控制。
+    """
+
+    def __init__(self, log_queue: "queue.SimpleQueue[logging.LogRecord]", max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同一进程内的线程队列不需要序列化，消息拼接和格式化都留给后台线程
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
 
 class Logger:
-    """自定义日志器"""
-    
-    def __init__(self, name: str = "api_gateway"):
+    """
+    自定义日志器。
+    - 同步模式直接写标准输出；异步模式（LOG_ASYNC）下调用方只把日志记录放入队列，
+      格式化和I/O在后台线程完成，标准输出消费缓慢时也不会阻塞事件循环
+    - LOG_FORMAT 为 "json" 时输出结构化JSON
+    - LOG_SAMPLE_RATES 按日志器名称采样 DEBUG/INFO 日志
+    - 重复的 WARNING/ERROR 日志按 LOG_REPEAT_BURST / LOG_REPEAT_INTERVAL 限流
+    消息使用 %-style 参数，例如 logger.info("转发请求: %s", url)，级别未启用时不会拼接字符串。
+    """
+
+    def __init__(self, name: str = "api_gateway", configure: bool = True):
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
-        
+        self._queue_handler: Optional[NonBlockingQueueHandler] = None
+        self._listener: Optional[QueueListener] = None
+        if not configure:
+            # 子日志器不单独配置处理器，日志交给父日志器的处理器输出
+            return
+
+        level = settings.LOG_LEVEL or ("DEBUG" if settings.DEBUG else "INFO")
+        self.logger.setLevel(level.upper())
+        self.logger.propagate = False
+
         # 控制台处理器
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        ))
-        self.logger.addHandler(console_handler)
-    
+        self._console_handler = logging.StreamHandler(sys.stdout)
+        if settings.LOG_FORMAT == "json":
+            self._console_handler.setFormatter(JsonFormatter())
+        else:
+            self._console_handler.setFormatter(logging.Formatter(
+                "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+            ))
+
+        if settings.LOG_ASYNC:
+            self._queue_handler = NonBlockingQueueHandler(queue.SimpleQueue(), settings.LOG_QUEUE_SIZE)
+            handler: logging.Handler = self._queue_handler
+            self._start_listener()
+            # 子进程中后台线程不存在，需要重新创建队列和线程
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._restart_listener)
+            atexit.register(self.shutdown)
+        else:
+            handler = self._console_handler
+
+        # 采样和重复日志限流在放入队列之前完成，被丢弃的日志不产生后续开销
+        if settings.LOG_SAMPLE_RATES:
+            handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+        handler.addFilter(RepeatFilter(settings.LOG_REPEAT_BURST, settings.LOG_REPEAT_INTERVAL))
+        self.logger.addHandler(handler)
+
+    def _start_listener(self) -> None:
+        self._listener = QueueListener(self._queue_handler.queue, self._console_handler)
+        self._listener.start()
+
+    def _restart_listener(self) -> None:
+        self._queue_handler.queue = queue.SimpleQueue()
+        self._start_listener()
+
+    def shutdown(self) -> None:
+        """停止后台线程，输出队列中剩余的日志"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+            if self._queue_handler.dropped:
+                self._console_handler.handle(logging.makeLogRecord({
+                    "name": self.logger.name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "日志队列已满，丢弃了 %d 条日志",
+                    "args": (self._queue_handler.dropped,),
+                }))
+
+    def get_child(self, suffix: str) -> "Logger":
+        """
+        获取子日志器，例如 logger.get_child("proxy") 对应 "api_gateway.proxy"。
+        子日志器共用本日志器的处理器和级别，可以在 LOG_SAMPLE_RATES 中单独配置采样率。
+        """
+        return Logger(f"{self.logger.name}.{suffix}", configure=False)
+
+    # stacklevel=2 使日志记录的文件和行号指向调用方，而不是本包装类
     def debug(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("stacklevel", 2)
         self.logger.debug(msg, *args, **kwargs)
-    
+
     def info(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("stacklevel", 2)
         self.logger.info(msg, *args, **kwargs)
-    
+
     def warning(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("stacklevel", 2)
         self.logger.warning(msg, *args, **kwargs)
-    
+
     def error(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("stacklevel", 2)
         self.logger.error(msg, *args, **kwargs)
-    
+
     def critical(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("stacklevel", 2)
         self.logger.critical(msg, *args, **kwargs)
 
 
 # 创建全局日志器实例
-logger = Logger() 
\ No newline at end of file
+logger = Logger()
@@ -0,0 +1,198 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, List, Optional, Sequence, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+from app.utils.logger import logger
+
+Command = Sequence[Union[str, bytes, int, float]]
+
+
+class RedisError(Exception):
+    """Redis返回的错误回复"""
+
+
+class RedisClient:
+    """
+    精简的异步Redis协议(RESP)客户端。
+    只使用一条连接，同一轮事件循环内提交的命令会合并为一次写入（流水线），
+    回复按顺序匹配，适用于Redis及兼容RESP协议的服务。
+    命令在 command_timeout 秒内没有收到回复时抛出 asyncio.TimeoutError 并断开连接：
+    之后的回复无法再与命令对应，已提交的其他命令同样以连接错误结束。
+    """
+
+    def __init__(self, url: str, connect_timeout: float = 1.0, command_timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        # 等待回复的流水线：(命令数量, future)
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self._buffer: List[bytes] = []
+        self._flush_scheduled = False
+        self._has_waiters = asyncio.Event()
+
+    @staticmethod
+    def _encode(command: Command) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, str):
+                data = arg.encode("utf-8")
+            else:
+                data = repr(arg).encode("ascii")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout
+            )
+            self._reader, self._writer = reader, writer
+            self._read_task = asyncio.create_task(self._read_loop(reader))
+            logger.info("已连接Redis: %s:%s/%s", self.host, self.port, self.db)
+            setup: List[Command] = []
+            if self.password:
+                setup.append(("AUTH", self.password))
+            if self.db:
+                setup.append(("SELECT", self.db))
+            if setup:
+                for reply in await self._wait(self._submit(setup)):
+                    if isinstance(reply, RedisError):
+                        raise reply
+
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis连接已关闭")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"无法解析的Redis回复: {line!r}")
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                while not self._waiters:
+                    self._has_waiters.clear()
+                    await self._has_waiters.wait()
+                count, future = self._waiters[0]
+                replies = [await self._read_reply(reader) for _ in range(count)]
+                self._waiters.popleft()
+                if not future.done():
+                    future.set_result(replies)
+        except Exception as e:
+            # 连接已被 _abort 或 close 替换时，等待中的命令已经由它们处理
+            if self._read_task is not asyncio.current_task():
+                return
+            logger.error("Redis连接出错: %s", e)
+            self._fail_waiters(e)
+            self._reset()
+
+    def _fail_waiters(self, error: Exception) -> None:
+        while self._waiters:
+            _, future = self._waiters.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def _reset(self) -> None:
+        writer, self._writer, self._reader = self._writer, None, None
+        self._buffer.clear()
+        if writer is not None:
+            writer.close()
+
+    def _abort(self, error: Exception) -> None:
+        """断开连接并结束所有等待回复的命令，下一条命令重新建立连接"""
+        task, self._read_task = self._read_task, None
+        if task is not None:
+            task.cancel()
+        self._fail_waiters(error)
+        self._reset()
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        if self._writer is None or not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._writer.write(data)
+
+    def _submit(self, commands: Sequence[Command]) -> "asyncio.Future[List[Any]]":
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((len(commands), future))
+        self._has_waiters.set()
+        self._buffer.extend(self._encode(command) for command in commands)
+        if not self._flush_scheduled:
+            # 同一轮事件循环内提交的命令合并为一次写入
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        return future
+
+    async def _wait(self, future: "asyncio.Future[List[Any]]") -> List[Any]:
+        try:
+            return await asyncio.wait_for(future, self.command_timeout)
+        except asyncio.TimeoutError:
+            self._abort(ConnectionError("Redis命令超时，连接已断开"))
+            raise asyncio.TimeoutError(f"Redis命令超过 {self.command_timeout} 秒未回复，已断开连接") from None
+
+    async def pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        """
+        以流水线方式执行一组命令。
+
+        参数:
+            commands: 命令列表，每个命令是参数序列
+
+        返回:
+            按顺序排列的回复；错误回复以 RedisError 实例表示
+
+        异常:
+            asyncio.TimeoutError: 超过 command_timeout 秒未收到回复
+        """
+        if self._writer is None:
+            await self._connect()
+        return await self._wait(self._submit(commands))
+
+    async def execute(self, *command: Union[str, bytes, int, float]) -> Any:
+        """执行单条命令，错误回复会被抛出"""
+        reply = (await self.pipeline([command]))[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def close(self) -> None:
+        """关闭连接"""
+        task, self._read_task = self._read_task, None
+        self._fail_waiters(ConnectionError("Redis客户端已关闭"))
+        self._reset()
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
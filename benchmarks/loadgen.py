@@ -0,0 +1,100 @@
+"""
+HTTP负载生成器。
+以固定并发数在指定时长内持续发送请求，统计吞吐量和延迟分位数。
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """已排序数据的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    """
+    汇总一次压测的结果。
+
+    参数:
+        latencies: 成功请求的延迟（秒）
+        errors: 失败的请求数（连接错误或非2xx响应）
+        elapsed: 压测时长（秒）
+
+    返回:
+        结果字典，延迟单位为毫秒
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": count / elapsed if elapsed else 0.0,
+        "mean_ms": sum(latencies) / count * 1000 if count else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "p999_ms": percentile(latencies, 0.999) * 1000,
+        "max_ms": latencies[-1] * 1000 if count else 0.0,
+    }
+
+
+async def run_load(
+    url: str,
+    method: str = "GET",
+    headers: Optional[Dict[str, str]] = None,
+    body: Optional[bytes] = None,
+    concurrency: int = 32,
+    duration: float = 10.0,
+    warmup: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    对一个URL施加负载。
+
+    参数:
+        url: 目标URL
+        method: 请求方法
+        headers: 请求头
+        body: 请求体
+        concurrency: 并发请求数
+        duration: 统计时长（秒）
+        warmup: 统计前的预热时长（秒），预热期间的请求不计入结果
+
+    返回:
+        summarize() 的结果
+    """
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+
+        async def worker() -> None:
+            nonlocal errors
+            while True:
+                request_started = time.perf_counter()
+                if request_started >= deadline:
+                    return
+                try:
+                    # 读取完整响应体，流式响应计算到最后一个字节
+                    response = await client.request(method, url, headers=headers, content=body)
+                    ok = 200 <= response.status_code < 300
+                except httpx.HTTPError:
+                    ok = False
+                finished = time.perf_counter()
+                if request_started < measure_from:
+                    continue
+                if ok:
+                    latencies.append(finished - request_started)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - measure_from
+    return summarize(latencies, errors, elapsed)
@@ -0,0 +1,128 @@
+"""
+网关热点路径的微基准测试。
+直接调用各阶段的核心函数，测量单次调用耗时（纳秒），不经过网络。
+
+    python -m benchmarks.microbench
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+# 在导入网关模块之前设置配置：关闭日志输出，放宽限流阈值，避免干扰测量
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("HEALTH_CHECK_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_MAX_REQUESTS", str(10 ** 9))
+
+
+def _best_of(run: Callable[[int], float], number: int, repeat: int) -> float:
+    """重复 repeat 轮，返回最快一轮的单次耗时（纳秒）"""
+    return min(run(number) for _ in range(repeat)) / number * 1e9
+
+
+def bench(func: Callable[[], Any], number: int = 10000, repeat: int = 5) -> float:
+    """测量同步函数的单次调用耗时（纳秒）"""
+    def run(n: int) -> float:
+        started = time.perf_counter()
+        for _ in range(n):
+            func()
+        return time.perf_counter() - started
+    return _best_of(run, number, repeat)
+
+
+def bench_async(func: Callable[[], Awaitable[Any]], number: int = 10000, repeat: int = 5) -> float:
+    """测量协程函数的单次调用耗时（纳秒），所有调用在同一个事件循环中执行"""
+    loop = asyncio.new_event_loop()
+
+    async def run_async(n: int) -> float:
+        started = time.perf_counter()
+        for _ in range(n):
+            await func()
+        return time.perf_counter() - started
+
+    try:
+        return _best_of(lambda n: loop.run_until_complete(run_async(n)), number, repeat)
+    finally:
+        loop.close()
+
+
+def run_all() -> Dict[str, float]:
+    """
+    运行所有微基准测试。
+
+    返回:
+        测试名称 -> 单次调用耗时（纳秒）
+    """
+    from jose import jwt
+
+    from app.core.auth import decode_access_token
+    from app.core.config import settings
+    from app.core.router import router
+    from app.middlewares.context import GatewayContext
+    from app.middlewares.proxy import build_upstream_headers
+    from app.middlewares.rate_limit import RateLimitMiddleware
+
+    token = jwt.encode(
+        {"sub": "bench-user", "exp": int(time.time()) + 3600, "scopes": ["read"]},
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+    )
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/backend/v1/items/42",
+        "query_string": b"page=1&size=20",
+        "client": ("127.0.0.1", 50000),
+        "headers": [
+            (b"host", b"gateway.local"),
+            (b"user-agent", b"benchmark/1.0"),
+            (b"accept", b"application/json"),
+            (b"accept-encoding", b"gzip, deflate"),
+            (b"authorization", f"Bearer {token}".encode("latin-1")),
+            (b"x-request-id", b"0123456789abcdef"),
+        ],
+    }
+    results: Dict[str, float] = {}
+
+    cache_enabled = settings.JWT_CACHE_ENABLED
+    settings.JWT_CACHE_ENABLED = False
+    results["decode_access_token (uncached)"] = bench(lambda: decode_access_token(token), number=2000)
+    settings.JWT_CACHE_ENABLED = True
+    decode_access_token(token)
+    results["decode_access_token (cached)"] = bench(lambda: decode_access_token(token))
+    settings.JWT_CACHE_ENABLED = cache_enabled
+
+    rate_limit = RateLimitMiddleware(None)
+    keys = [f"ip:10.0.{index // 256}.{index % 256}" for index in range(1024)]
+    counter = iter(range(10 ** 9))
+    results["RateLimitMiddleware._is_rate_limited"] = bench_async(
+        lambda: rate_limit._is_rate_limited(keys[next(counter) % len(keys)])
+    )
+
+    results["router.resolve (cached)"] = bench(lambda: router.resolve(scope["path"]), number=100000)
+    results["router.resolve (uncached)"] = bench(lambda: router._resolve(scope["path"]))
+    results["GatewayContext (headers + route)"] = bench(lambda: GatewayContext(scope))
+
+    context = GatewayContext(scope)
+    context.user = {"sub": "bench-user", "scopes": ["read"]}
+    results["build_upstream_headers"] = bench(lambda: build_upstream_headers(context))
+    return results
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="网关热点路径微基准测试")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    args = parser.parse_args()
+    results = run_all()
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    for name, value in results.items():
+        print(f"{name:<45} {value:>12,.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+网关基准测试。
+
+启动本地后端和网关进程，在以下场景下施加负载，并运行微基准测试：
+- direct:      直接请求本地后端（基线）
+- proxy:       经过网关转发，不认证、不限流
+- proxy_auth:  经过网关转发，JWT认证，不限流
+- full:        完整链路 认证 → 流量控制 → 代理
+- full_post:   完整链路，POST请求体
+- stream:      完整链路，分块流式响应
+
+每层的开销按相邻场景的 p50 延迟之差计算。结果保存为JSON，可用 --compare 与之前的结果对比：
+
+    python -m benchmarks.run --duration 10 --concurrency 32
+    python -m benchmarks.run --compare benchmarks/results/<之前的结果>.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.loadgen import run_load
+from benchmarks.microbench import run_all as run_microbench
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_kb(pid: int) -> Optional[int]:
+    """进程的常驻内存（KB），仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _wait_ready(url: str, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"服务未能在 {timeout} 秒内启动: {url}")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _start_processes(args: argparse.Namespace) -> Dict[str, Any]:
+    backend_port = _free_port()
+    gateway_port = _free_port()
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_backend", "--port", str(backend_port)], cwd=ROOT
+    )
+    env = dict(os.environ)
+    env.update({
+        "BACKEND_SERVICES": json.dumps({"bench": backend_url}),
+        # 同一个后端的三种路由：不认证不限流、只认证、完整链路（/api/bench/**）
+        "ROUTES": json.dumps([
+            {"path": "/bench/open/**", "service": "bench", "auth": False, "rate_limit": None},
+            {"path": "/bench/auth/**", "service": "bench", "rate_limit": None},
+        ]),
+        "RATE_LIMIT_MAX_REQUESTS": str(10 ** 9),
+        "RESPONSE_CACHE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+    gateway = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(gateway_port),
+            "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        _wait_ready(f"{backend_url}/health")
+        _wait_ready(f"http://127.0.0.1:{gateway_port}/health")
+    except RuntimeError:
+        backend.terminate()
+        gateway.terminate()
+        raise
+    return {
+        "backend": backend,
+        "gateway": gateway,
+        "backend_url": backend_url,
+        "gateway_url": f"http://127.0.0.1:{gateway_port}",
+    }
+
+
+def _scenarios(args: argparse.Namespace, backend_url: str, gateway_url: str) -> Dict[str, Dict[str, Any]]:
+    from jose import jwt
+
+    from app.core.config import settings
+
+    token = jwt.encode(
+        {"sub": "bench-user", "exp": int(time.time()) + 3600},
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM,
+    )
+    auth = {"Authorization": f"Bearer {token}"}
+    query = f"delay?ms={args.latency_ms}&size={args.size}"
+    stream = f"stream?chunks={args.stream_chunks}&size={args.size}&interval_ms={args.latency_ms}"
+    return {
+        "direct": {"url": f"{backend_url}/{query}"},
+        "proxy": {"url": f"{gateway_url}/bench/open/{query}"},
+        "proxy_auth": {"url": f"{gateway_url}/bench/auth/{query}", "headers": auth},
+        "full": {"url": f"{gateway_url}/api/bench/{query}", "headers": auth},
+        "full_post": {
+            "url": f"{gateway_url}/api/bench/{query}",
+            "method": "POST",
+            "headers": auth,
+            "body": b"x" * args.size,
+        },
+        "stream": {"url": f"{gateway_url}/api/bench/{stream}", "headers": auth},
+    }
+
+
+def _layers(scenarios: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """按相邻场景的 p50 延迟之差估算每层的开销（毫秒）"""
+    layers = {}
+    for name, current, previous in (
+        ("proxy", "proxy", "direct"),
+        ("auth", "proxy_auth", "proxy"),
+        ("rate_limit", "full", "proxy_auth"),
+    ):
+        if current in scenarios and previous in scenarios:
+            layers[name] = scenarios[current]["p50_ms"] - scenarios[previous]["p50_ms"]
+    return layers
+
+
+def _print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    def delta(value: float, old: Optional[float]) -> str:
+        if old is None or not old:
+            return ""
+        return f" ({(value - old) / old * 100:+.1f}%)"
+
+    old_scenarios = baseline.get("scenarios", {}) if baseline else {}
+    print(f"\n{'场景':<12} {'RPS':>14} {'p50(ms)':>16} {'p99(ms)':>16} {'p999(ms)':>10} {'错误':>6} {'内存增长(KB)':>12}")
+    for name, data in result["scenarios"].items():
+        old = old_scenarios.get(name, {})
+        print(
+            f"{name:<12} {data['rps']:>8.0f}{delta(data['rps'], old.get('rps')):>6} "
+            f"{data['p50_ms']:>8.2f}{delta(data['p50_ms'], old.get('p50_ms')):>8} "
+            f"{data['p99_ms']:>8.2f}{delta(data['p99_ms'], old.get('p99_ms')):>8} "
+            f"{data['p999_ms']:>10.2f} {data['errors']:>6} {data.get('rss_growth_kb') or 0:>12}"
+        )
+
+    if result["layers"]:
+        print("\n每层开销（p50，毫秒）")
+        for name, value in result["layers"].items():
+            print(f"  {name:<12} {value:>8.3f}")
+
+    if result["micro"]:
+        old_micro = baseline.get("micro", {}) if baseline else {}
+        print("\n微基准测试（纳秒/次）")
+        for name, value in result["micro"].items():
+            print(f"  {name:<45} {value:>12,.0f}{delta(value, old_micro.get(name))}")
+
+
+async def _run_scenarios(args: argparse.Namespace, processes: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    scenarios = _scenarios(args, processes["backend_url"], processes["gateway_url"])
+    for name, scenario in scenarios.items():
+        if args.scenarios and name not in args.scenarios:
+            continue
+        rss_before = _rss_kb(processes["gateway"].pid)
+        print(f"运行场景 {name} ...", flush=True)
+        data = await run_load(
+            scenario["url"],
+            method=scenario.get("method", "GET"),
+            headers=scenario.get("headers"),
+            body=scenario.get("body"),
+            concurrency=args.concurrency,
+            duration=args.duration,
+            warmup=args.warmup,
+        )
+        rss_after = _rss_kb(processes["gateway"].pid)
+        data["rss_growth_kb"] = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        results[name] = data
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="网关基准测试")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个场景的统计时长（秒）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="每个场景的预热时长（秒）")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发请求数")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="后端延迟（毫秒）")
+    parser.add_argument("--size", type=int, default=1024, help="响应体大小（字节）")
+    parser.add_argument("--stream-chunks", type=int, default=16, help="流式场景的分块数")
+    parser.add_argument("--scenarios", nargs="*", help="只运行指定场景")
+    parser.add_argument("--skip-micro", action="store_true", help="跳过微基准测试")
+    parser.add_argument("--compare", help="与之前保存的结果对比")
+    parser.add_argument("--output", help="结果文件路径，默认保存到 benchmarks/results/")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    processes = _start_processes(args)
+    try:
+        scenarios = asyncio.run(_run_scenarios(args, processes))
+    finally:
+        for name in ("gateway", "backend"):
+            processes[name].terminate()
+            processes[name].wait(timeout=10)
+
+    result = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        },
+        "scenarios": scenarios,
+        "layers": _layers(scenarios),
+        "micro": {} if args.skip_micro else run_microbench(),
+    }
+    _print_report(result, baseline)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{result['meta']['commit']}.json")
+    with open(output, "w") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
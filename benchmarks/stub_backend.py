@@ -0,0 +1,104 @@
+"""
+基准测试用的本地后端服务（纯ASGI，尽量减少后端自身的开销）。
+
+    GET|POST /delay?ms=10&size=1024                 等待 ms 毫秒后返回 size 字节
+    GET      /stream?chunks=10&size=1024&interval_ms=5  分块流式返回，每块 size 字节
+    GET      /health                                健康检查
+
+启动:
+    python -m benchmarks.stub_backend --port 9001
+"""
+import argparse
+import asyncio
+from typing import Dict
+from urllib.parse import parse_qsl
+
+from starlette.types import Receive, Scope, Send
+
+# 预先生成的响应体，按需切片，避免每个请求分配大块内存
+_PAYLOAD = b"x" * (16 * 1024 * 1024)
+
+
+def _params(scope: Scope) -> Dict[str, float]:
+    params: Dict[str, float] = {}
+    for key, value in parse_qsl(scope.get("query_string", b"").decode("latin-1")):
+        try:
+            params[key] = float(value)
+        except ValueError:
+            pass
+    return params
+
+
+async def _drain(receive: Receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] != "http.request" or not message.get("more_body", False):
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    await _drain(receive)
+    params = _params(scope)
+    path = scope["path"]
+
+    if path == "/stream":
+        chunks = int(params.get("chunks", 10))
+        size = int(params.get("size", 1024))
+        interval = params.get("interval_ms", 0) / 1000
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream")],
+        })
+        for _ in range(chunks):
+            if interval:
+                await asyncio.sleep(interval)
+            await send({"type": "http.response.body", "body": _PAYLOAD[:size], "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        return
+
+    if path == "/delay":
+        delay = params.get("ms", 0) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+        body = _PAYLOAD[:int(params.get("size", 1024))]
+        status = 200
+    elif path == "/health":
+        body = b'{"status":"ok"}'
+        status = 200
+    else:
+        body = b"not found"
+        status = 404
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/octet-stream"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="基准测试用的本地后端服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
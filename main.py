@@ -1,15 +1,6 @@
-import uvicorn
-from app.main import app
-
-def main():
-    """
-    启动API网关服务
-    """
-    uvicorn.run(app, host="0.0.0.0", port=10001)
+from app.server import main
 
 
 if __name__ == "__main__":
-    print("所有路由:")
-    for route in app.routes:
-        print(f"Path: {route.path}, Name: {route.name}")
+    # 生产环境启动：多工作进程、平滑退出，配置见 SERVER_* 配置项
     main()
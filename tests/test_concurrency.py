@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from app.core.concurrency import AIMDLimit, AdaptiveConcurrencyLimiter, ConcurrencyLimitExceeded
+
+
+def make_limiter(limit: int = 1, queue_size: int = 2, queue_timeout: float = 1.0) -> AdaptiveConcurrencyLimiter:
+    return AdaptiveConcurrencyLimiter(
+        "test",
+        AIMDLimit(backoff_ratio=0.9, latency_threshold=10.0),
+        initial_limit=limit,
+        min_limit=limit,
+        max_limit=limit,
+        queue_size=queue_size,
+        queue_timeout=queue_timeout,
+    )
+
+
+def test_cancel_while_queued_before_release():
+    async def run():
+        limiter = make_limiter()
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.snapshot() == [1, 1, 1]
+
+        # 取消后等待中的任务还没有恢复执行时名额就被释放
+        waiter.cancel()
+        limiter.release(None, False)
+        assert limiter.snapshot() == [1, 0, 0]
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.snapshot() == [1, 0, 0]
+
+        await asyncio.wait_for(limiter.acquire(), 0.1)
+        assert limiter.snapshot() == [1, 1, 0]
+
+    asyncio.run(run())
+
+
+def test_release_hands_slot_to_next_live_waiter():
+    async def run():
+        limiter = make_limiter(queue_size=3)
+        await limiter.acquire()
+        cancelled = asyncio.ensure_future(limiter.acquire())
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        limiter.release(None, False)
+        await asyncio.wait_for(waiting, 0.1)
+        assert limiter.snapshot() == [1, 1, 0]
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    asyncio.run(run())
+
+
+def test_preemption_by_higher_priority():
+    async def run():
+        limiter = make_limiter(queue_size=1)
+        await limiter.acquire()
+        low = asyncio.ensure_future(limiter.acquire(priority=0))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(limiter.acquire(priority=1))
+        await asyncio.sleep(0)
+        with pytest.raises(ConcurrencyLimitExceeded) as info:
+            await low
+        assert info.value.reason == "preempted"
+        assert limiter.snapshot() == [1, 1, 1]
+
+        limiter.release(None, False)
+        await asyncio.wait_for(high, 0.1)
+        assert limiter.snapshot() == [1, 1, 0]
+
+    asyncio.run(run())
+
+
+def test_preemption_skips_cancelled_waiter():
+    async def run():
+        limiter = make_limiter(queue_size=1)
+        await limiter.acquire()
+        low = asyncio.ensure_future(limiter.acquire(priority=0))
+        await asyncio.sleep(0)
+
+        async def cancel_then_acquire():
+            # 被取消的请求恢复执行之前仍在队列中，新请求不需要挤出任何请求
+            low.cancel()
+            await limiter.acquire(priority=1)
+
+        high = asyncio.ensure_future(cancel_then_acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.CancelledError):
+            await low
+        assert limiter.snapshot() == [1, 1, 1]
+        limiter.release(None, False)
+        await asyncio.wait_for(high, 0.1)
+        assert limiter.snapshot() == [1, 1, 0]
+
+    asyncio.run(run())
+
+
+def test_queue_full_rejects_equal_priority():
+    async def run():
+        limiter = make_limiter(queue_size=1)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(ConcurrencyLimitExceeded) as info:
+            await limiter.acquire()
+        assert info.value.reason == "queue_full"
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    asyncio.run(run())
+
+
+def test_queue_timeout():
+    async def run():
+        limiter = make_limiter(queue_timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(ConcurrencyLimitExceeded) as info:
+            await limiter.acquire()
+        assert info.value.reason == "queue_timeout"
+        assert limiter.snapshot() == [1, 1, 0]
+
+    asyncio.run(run())
+
+
+def test_negative_priority_is_not_queued():
+    async def run():
+        limiter = make_limiter()
+        await limiter.acquire()
+        with pytest.raises(ConcurrencyLimitExceeded) as info:
+            await limiter.acquire(priority=-1)
+        assert info.value.reason == "limit"
+
+    asyncio.run(run())
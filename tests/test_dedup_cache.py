@@ -0,0 +1,125 @@
+import pytest
+
+from app.core.dedup_cache import DedupCache, _digest
+
+HEADERS = [(b"content-type", b"application/json"), (b"x-trace", b"a:b")]
+
+
+def key(name: str) -> bytes:
+    return _digest(name.encode("utf-8"))
+
+
+def record_size(headers, body: bytes) -> int:
+    return DedupCache.RECORD.size + len(b"\r\n".join(name + b":" + value for name, value in headers)) + len(body)
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    caches = []
+
+    def factory(max_bytes: int = 4096, slots: int = 64, ttl: float = 60.0) -> DedupCache:
+        cache = DedupCache(str(tmp_path / "dedup.cache"), max_bytes, slots, 1024, 1024, ttl)
+        caches.append(cache)
+        return cache
+
+    yield factory
+    for cache in caches:
+        cache.close()
+
+
+def test_roundtrip(make_cache):
+    cache = make_cache()
+    fingerprint = key("fingerprint")
+    assert cache.put(key("a"), fingerprint, 201, HEADERS, b'{"id":1}', now=100.0)
+
+    stored = cache.get(key("a"), now=100.0)
+    assert stored.status == 201
+    assert stored.headers == HEADERS
+    assert stored.body == b'{"id":1}'
+    assert stored.fingerprint == fingerprint
+    assert cache.get(key("missing"), now=100.0) is None
+
+
+def test_empty_headers_and_body(make_cache):
+    cache = make_cache()
+    assert cache.put(key("a"), key("fp"), 204, [], b"", now=100.0)
+    stored = cache.get(key("a"), now=100.0)
+    assert (stored.status, stored.headers, stored.body) == (204, [], b"")
+
+
+def test_same_key_returns_latest(make_cache):
+    cache = make_cache()
+    cache.put(key("a"), key("fp"), 200, [], b"first", now=100.0)
+    cache.put(key("a"), key("fp"), 200, [], b"second", now=101.0)
+    assert cache.get(key("a"), now=101.0).body == b"second"
+
+
+def test_expired_entry(make_cache):
+    cache = make_cache(ttl=10.0)
+    cache.put(key("a"), key("fp"), 200, [], b"body", now=100.0)
+    assert cache.get(key("a"), now=109.9) is not None
+    assert cache.get(key("a"), now=110.0) is None
+
+
+def test_oversized_entry_is_not_stored(make_cache):
+    cache = make_cache(max_bytes=256)
+    assert not cache.put(key("a"), key("fp"), 200, [], b"x" * 1025, now=100.0)
+    assert not cache.put(key("b"), key("fp"), 200, [], b"x" * 256, now=100.0)
+    assert cache.get(key("a"), now=100.0) is None
+    assert cache.get(key("b"), now=100.0) is None
+
+
+def test_ring_wraparound_drops_overwritten_records(make_cache):
+    body = b"x" * 40
+    length = record_size([], body)
+    # 数据区容纳 3 条完整记录，第 4 条放不下剩余空间，跳到开头覆盖第 1 条
+    cache = make_cache(max_bytes=length * 3 + length // 2)
+    for name in ("a", "b", "c"):
+        assert cache.put(key(name), key("fp"), 200, [], body + name.encode(), now=100.0)
+    for name in ("a", "b", "c"):
+        assert cache.get(key(name), now=100.0).body == body + name.encode()
+
+    assert cache.put(key("d"), key("fp"), 200, [], body + b"d", now=100.0)
+    assert cache.get(key("a"), now=100.0) is None
+    for name in ("b", "c", "d"):
+        assert cache.get(key(name), now=100.0).body == body + name.encode()
+
+    # 继续写入，环形日志多次回绕后只有最近的记录可读
+    names = [f"k{index}" for index in range(20)]
+    for name in names:
+        assert cache.put(key(name), key("fp"), 200, [], body + name.encode(), now=100.0)
+    readable = [name for name in ["b", "c", "d"] + names if cache.get(key(name), now=100.0) is not None]
+    assert readable == names[-3:]
+    for name in readable:
+        assert cache.get(key(name), now=100.0).body == body + name.encode()
+
+
+def test_overwritten_slot_is_reused_before_evicting_live_entry(make_cache):
+    body = b"x" * 40
+    length = record_size([], body)
+    # 只有 1 个索引槽位时，新键占用已被覆盖的槽位
+    cache = make_cache(max_bytes=length, slots=1)
+    cache.put(key("a"), key("fp"), 200, [], body, now=100.0)
+    cache.put(key("b"), key("fp"), 200, [], body, now=100.0)
+    assert cache.get(key("a"), now=100.0) is None
+    assert cache.get(key("b"), now=100.0).body == body
+
+
+def test_full_index_evicts_oldest_slot(make_cache):
+    cache = make_cache(slots=2)
+    cache.put(key("a"), key("fp"), 200, [], b"a", now=100.0)
+    cache.put(key("b"), key("fp"), 200, [], b"b", now=100.0)
+    cache.put(key("c"), key("fp"), 200, [], b"c", now=100.0)
+    readable = [name for name in "abc" if cache.get(key(name), now=100.0) is not None]
+    assert "c" in readable
+    assert len(readable) <= 2
+
+
+def test_entries_survive_reopen(make_cache):
+    cache = make_cache()
+    cache.put(key("a"), key("fp"), 200, HEADERS, b"body", now=100.0)
+    cache.close()
+
+    assert make_cache().get(key("a"), now=100.0).body == b"body"
+    # 容量变化时重新初始化
+    assert make_cache(max_bytes=8192).get(key("a"), now=100.0) is None
@@ -0,0 +1,174 @@
+import asyncio
+from typing import Any, Dict, List, Sequence
+
+import pytest
+
+from app.core import rate_limit_storage
+from app.core.rate_limit_storage import RedisStorage, SharedMemoryStorage
+from app.core.rate_limiter import create_algorithm
+from app.utils.redis_client import RedisError
+
+
+class FakeRedis:
+    """在内存中模拟限流存储用到的Redis命令，回复格式与Redis一致"""
+
+    def __init__(self):
+        self.store: Dict[str, bytes] = {}
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        replies = []
+        for name, key, *args in commands:
+            if name == "INCRBYFLOAT":
+                value = float(self.store.get(key, b"0")) + float(args[0])
+                self.store[key] = repr(value).encode("ascii")
+                replies.append(self.store[key])
+            elif name == "PEXPIRE":
+                replies.append(1)
+            elif name == "GET":
+                replies.append(self.store.get(key))
+            else:
+                raise AssertionError(f"unexpected command {name}")
+        return replies
+
+    async def close(self) -> None:
+        pass
+
+    def total(self) -> float:
+        return sum(float(value) for value in self.store.values())
+
+
+def make_redis_storage(limit: int, lease_size: int = 0) -> RedisStorage:
+    storage = RedisStorage(
+        create_algorithm("sliding_window", limit, 3600.0),
+        url="redis://127.0.0.1:6379/0",
+        prefix="test:",
+        lease_size=lease_size,
+        fail_open=False,
+        eviction_interval=10.0,
+        timeout=1.0,
+    )
+    storage._client = FakeRedis()
+    return storage
+
+
+async def admitted(storage, key: str, cost: float, attempts: int) -> int:
+    count = 0
+    for _ in range(attempts):
+        result = await storage.hit(key, cost)
+        count += result.allowed
+    # 被拒绝的请求归还预占计数的操作在后台执行
+    await asyncio.sleep(0)
+    return count
+
+
+@pytest.mark.parametrize("cost, expected", [(0.5, 4), (1.5, 1), (0.25, 8)])
+def test_redis_fractional_costs(cost, expected):
+    async def run():
+        storage = make_redis_storage(limit=2)
+        assert await admitted(storage, "user:alice", cost, 10) == expected
+        assert storage._client.total() == pytest.approx(expected * cost)
+
+    asyncio.run(run())
+
+
+def test_redis_fractional_costs_with_lease():
+    async def run():
+        storage = make_redis_storage(limit=3, lease_size=2)
+        assert await admitted(storage, "user:alice", 0.5, 10) == 6
+        assert storage._client.total() == pytest.approx(3.0)
+        await storage.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_fractional_charge_and_refund():
+    async def run():
+        storage = make_redis_storage(limit=2)
+        assert (await storage.hit("user:alice", 0.5)).allowed
+        await storage.charge("user:alice", 0.75)
+        await storage.charge("user:alice", -0.25)
+        assert storage._client.total() == pytest.approx(1.0)
+        assert (await storage.hit("user:alice", 1.0)).allowed
+        assert not (await storage.hit("user:alice", 0.5)).allowed
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("cost, expected", [(0.5, 4), (1.5, 1), (0.25, 8)])
+def test_shared_memory_fractional_costs(tmp_path, cost, expected):
+    async def run():
+        storage = SharedMemoryStorage(
+            create_algorithm("sliding_window", 2, 3600.0), str(tmp_path / "rl.shm"), slots=64, idle_ttl=60.0
+        )
+        await storage.start()
+        try:
+            assert await admitted(storage, "user:alice", cost, 10) == expected
+        finally:
+            await storage.stop()
+
+    asyncio.run(run())
+
+
+def test_shared_memory_survives_limit_change_in_new_worker(tmp_path):
+    async def run():
+        path = str(tmp_path / "rl.shm")
+        first = SharedMemoryStorage(create_algorithm("sliding_window", 2, 3600.0), path, slots=64, idle_ttl=60.0)
+        await first.start()
+        assert await admitted(first, "user:alice", 1, 2) == 2
+
+        # 热加载修改阈值后新启动的工作进程不能清空其他进程正在使用的计数
+        second = SharedMemoryStorage(create_algorithm("sliding_window", 3, 3600.0), path, slots=64, idle_ttl=60.0)
+        await second.start()
+        try:
+            assert await admitted(second, "user:alice", 1, 5) == 1
+            assert not (await first.hit("user:alice", 1)).allowed
+        finally:
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(run())
+
+
+def test_shared_memory_reinitializes_on_layout_change(tmp_path):
+    async def run():
+        path = str(tmp_path / "rl.shm")
+        first = SharedMemoryStorage(create_algorithm("sliding_window", 1, 3600.0), path, slots=64, idle_ttl=60.0)
+        await first.start()
+        assert await admitted(first, "user:alice", 1, 2) == 1
+        await first.stop()
+
+        second = SharedMemoryStorage(create_algorithm("token_bucket", 1, 3600.0), path, slots=64, idle_ttl=60.0)
+        await second.start()
+        try:
+            assert await admitted(second, "user:alice", 1, 2) == 1
+        finally:
+            await second.stop()
+
+    asyncio.run(run())
+
+
+
+@pytest.mark.parametrize("failure, as_reply", [
+    (asyncio.TimeoutError(), False),
+    (ConnectionError("reset"), False),
+    (RedisError("READONLY You can't write against a read only replica."), False),
+    # 管道中单条命令的错误作为回复返回，而不是抛出
+    (RedisError("READONLY You can't write against a read only replica."), True),
+])
+def test_redis_release_failure_is_logged_not_raised(monkeypatch, failure, as_reply):
+    class FailingRedis(FakeRedis):
+        async def pipeline(self, commands):
+            if as_reply:
+                return [failure]
+            raise failure
+
+    warnings = []
+    monkeypatch.setattr(rate_limit_storage.logger, "warning", lambda *args: warnings.append(args))
+
+    async def run():
+        storage = make_redis_storage(2)
+        storage._client = FailingRedis()
+        await storage._release_remote("test:user:alice", 1.0)
+
+    asyncio.run(run())
+    assert len(warnings) == 1
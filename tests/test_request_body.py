@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from app.middlewares.proxy import RequestBodyTooLarge, _LimitedReceive, _SpooledBody
+
+
+def make_receive(chunks: List[bytes]):
+    messages: List[Dict[str, Any]] = [
+        {"type": "http.request", "body": chunk, "more_body": index < len(chunks) - 1}
+        for index, chunk in enumerate(chunks)
+    ]
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop(0)
+
+    return receive
+
+
+async def collect(body: _SpooledBody) -> bytes:
+    return b"".join([chunk async for chunk in body])
+
+
+def test_limited_receive_within_limit():
+    async def run():
+        receive = _LimitedReceive(make_receive([b"a" * 4, b"b" * 6]), limit=10)
+        assert (await receive())["body"] == b"a" * 4
+        assert (await receive())["body"] == b"b" * 6
+        assert receive.size == 10
+
+    asyncio.run(run())
+
+
+def test_limited_receive_rejects_once_limit_exceeded():
+    async def run():
+        receive = _LimitedReceive(make_receive([b"a" * 8, b"b" * 8, b"c"]), limit=10)
+        await receive()
+        with pytest.raises(RequestBodyTooLarge):
+            await receive()
+
+    asyncio.run(run())
+
+
+def test_limited_receive_passes_disconnect_through():
+    async def disconnect() -> Dict[str, Any]:
+        return {"type": "http.disconnect"}
+
+    async def run():
+        receive = _LimitedReceive(disconnect, limit=1)
+        assert (await receive())["type"] == "http.disconnect"
+
+    asyncio.run(run())
+
+
+def test_spooled_body_below_threshold_stays_in_memory():
+    body = _SpooledBody(threshold=100, directory="")
+    body.write(b"hello ")
+    body.write(b"world")
+    assert not body.spooled
+    assert body.content() == b"hello world"
+    body.close()
+
+
+def test_spooled_body_replays_from_disk(tmp_path):
+    async def run():
+        body = _SpooledBody(threshold=10, directory=str(tmp_path))
+        data = bytes(range(256)) * 1024
+        for offset in range(0, len(data), 1000):
+            body.write(data[offset:offset + 1000])
+        assert body.spooled
+        content = body.content()
+        assert content is body
+        # 重试和对冲会多次、并发地读取同一个请求体
+        first, second = await asyncio.gather(collect(body), collect(body))
+        assert first == second == data
+        assert await collect(body) == data
+        body.close()
+        assert not body.spooled
+
+    asyncio.run(run())
+
+
+def test_spooled_body_reads_in_chunks(tmp_path):
+    async def run():
+        body = _SpooledBody(threshold=0, directory=str(tmp_path))
+        body.write(b"x" * (_SpooledBody.CHUNK_SIZE * 2 + 1))
+        body.content()
+        sizes = [len(chunk) async for chunk in body]
+        assert sizes == [_SpooledBody.CHUNK_SIZE, _SpooledBody.CHUNK_SIZE, 1]
+        body.close()
+
+    asyncio.run(run())